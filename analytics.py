@@ -0,0 +1,320 @@
+import math
+import threading
+import logging
+from importlib.util import find_spec
+
+logger = logging.getLogger(__name__)
+
+# NumPy là optional (fallback sang pure Python) và import mất ~0.1s,
+# nên chỉ import khi cần để server khởi động nhanh
+HAS_NUMPY = find_spec("numpy") is not None
+np = None
+_numpy_lock = threading.Lock()
+
+
+def load_numpy():
+    """Import NumPy on first use"""
+    global np
+    if np is None and HAS_NUMPY:
+        with _numpy_lock:
+            if np is None:
+                import numpy
+                np = numpy
+    return np
+
+
+def preload():
+    """Import NumPy in a background thread so the first analytics request does not pay for it"""
+    if HAS_NUMPY and np is None:
+        threading.Thread(target=load_numpy, name="numpy-import", daemon=True).start()
+
+
+class AnalyticsEngine:
+    """Volume, VWAP, returns, rolling volatility and candle bucketing.
+
+    With NumPy the ts/price/size columns are wrapped once as zero-copy
+    arrays over the memory-mapped column store and every computation is
+    vectorized. Without NumPy the same results are computed in pure Python.
+    """
+
+    def __init__(self, store, use_numpy=True):
+        self.store = store
+        self.backend = "numpy" if (use_numpy and HAS_NUMPY) else "python"
+        self._columns = None
+        self._arrays = None
+
+    def _numpy_columns(self):
+        """NumPy views over the mmap'd columns, rebuilt only after a remap"""
+        load_numpy()
+        columns = self.store.columns
+        # So sánh object (không phải id): dict của lần map trước có thể bị free và id được dùng lại
+        if columns is not self._columns:
+            self._arrays = {
+                "ts": np.frombuffer(columns["ts"], dtype=np.int64),
+                "price": np.frombuffer(columns["price"], dtype=np.float64),
+                "size": np.frombuffer(columns["size"], dtype=np.float64),
+            }
+            self._columns = columns
+        return self._arrays
+
+    def load(self, rows, start, stop):
+        """Gather ts/price/size for index entries rows[start:stop]"""
+        if self.backend == "numpy":
+            arrays = self._numpy_columns()
+            # Copy slice: view trên array sống sẽ chặn SymbolIndex.commit extend tại chỗ
+            selected = np.frombuffer(rows[start:stop], dtype=np.int64)
+            return arrays["ts"][selected], arrays["price"][selected], arrays["size"][selected]
+
+        columns = self.store.columns
+        stamps, prices, sizes = columns["ts"], columns["price"], columns["size"]
+        selected = rows[start:stop]
+        return ([stamps[r] for r in selected], [prices[r] for r in selected],
+                [sizes[r] for r in selected])
+
+    def summary(self, ts, prices, sizes, window=20, interval_ms=None):
+        """Compute all analytics for one series (ts ascending)"""
+        if self.backend == "numpy":
+            load_numpy()
+            return numpy_summary(ts, prices, sizes, window, interval_ms)
+        return python_summary(ts, prices, sizes, window, interval_ms)
+
+    def downsample(self, ts, prices, sizes, points, method="lttb"):
+        """Reduce a series to at most ``points`` points (ts ascending).
+
+        Returns (ts, price, volume) lists; volume is the size traded since
+        the previous returned point, so it still sums to the range total.
+        """
+        if self.backend == "numpy":
+            load_numpy()
+            ts, prices, sizes = np.asarray(ts, dtype=np.int64), np.asarray(prices, dtype=np.float64), \
+                np.asarray(sizes, dtype=np.float64)
+            selected = (numpy_lttb if method == "lttb" else numpy_minmax)(ts, prices, points)
+            cumulative = np.cumsum(sizes)[selected]
+            volumes = np.diff(cumulative, prepend=0.0)
+            return ts[selected].tolist(), prices[selected].tolist(), volumes.tolist()
+
+        selected = (python_lttb if method == "lttb" else python_minmax)(ts, prices, points)
+        volumes = []
+        total = 0.0
+        previous = 0.0
+        position = 0
+        for index in selected:
+            while position <= index:
+                total += sizes[position]
+                position += 1
+            volumes.append(total - previous)
+            previous = total
+        return [ts[i] for i in selected], [prices[i] for i in selected], volumes
+
+
+def _lttb_bounds(count, points):
+    """LTTB buckets: point i + 1 is picked from [bounds[i], bounds[i + 1]), first and last are fixed"""
+    return [k * (count - 2) // (points - 2) + 1 for k in range(points - 1)] + [count]
+
+
+def python_lttb(ts, prices, points):
+    """Largest-Triangle-Three-Buckets: indices of the selected points, one pass"""
+    count = len(ts)
+    points = max(points, 3)
+    if points >= count:
+        return list(range(count))
+    origin = ts[0]
+    bounds = _lttb_bounds(count, points)
+    selected = [0]
+    a = 0
+    for i in range(points - 2):
+        # Đỉnh thứ ba của tam giác: điểm trung bình của bucket kế tiếp
+        next_start, next_end = bounds[i + 1], bounds[i + 2]
+        avg_x = sum(ts[j] - origin for j in range(next_start, next_end)) / (next_end - next_start)
+        avg_y = sum(prices[j] for j in range(next_start, next_end)) / (next_end - next_start)
+        ax, ay = ts[a] - origin, prices[a]
+        best, best_area = bounds[i], -1.0
+        for j in range(bounds[i], bounds[i + 1]):
+            area = abs((ax - avg_x) * (prices[j] - ay) - (ax - (ts[j] - origin)) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(count - 1)
+    return selected
+
+
+def numpy_lttb(ts, prices, points):
+    count = len(ts)
+    points = max(points, 3)
+    if points >= count:
+        return np.arange(count)
+    x = (ts - ts[0]).astype(np.float64)
+    bounds = _lttb_bounds(count, points)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    a = 0
+    # Mỗi bucket phụ thuộc điểm đã chọn ở bucket trước: lặp theo bucket, vectorize trong bucket
+    for i in range(points - 2):
+        next_start, next_end = bounds[i + 1], bounds[i + 2]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = prices[next_start:next_end].mean()
+        ax, ay = x[a], prices[a]
+        start, end = bounds[i], bounds[i + 1]
+        areas = np.abs((ax - avg_x) * (prices[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _minmax_buckets(ts, points):
+    """Equal-time buckets for min/max: two points per bucket plus first and last"""
+    return max((points - 2) // 2, 1), ts[0], ts[-1] - ts[0] + 1
+
+
+def python_minmax(ts, prices, points):
+    """First, last and the min/max point of each equal-time bucket, in ts order"""
+    count = len(ts)
+    if points >= count:
+        return list(range(count))
+    buckets, origin, span = _minmax_buckets(ts, points)
+    lows, highs = {}, {}
+    for i in range(count):
+        bucket = (ts[i] - origin) * buckets // span
+        if bucket not in lows:
+            lows[bucket] = highs[bucket] = i
+        elif prices[i] < prices[lows[bucket]]:
+            lows[bucket] = i
+        elif prices[i] > prices[highs[bucket]]:
+            highs[bucket] = i
+    return sorted({0, count - 1, *lows.values(), *highs.values()})
+
+
+def numpy_minmax(ts, prices, points):
+    count = len(ts)
+    if points >= count:
+        return np.arange(count)
+    buckets, origin, span = _minmax_buckets(ts, points)
+    ids = (ts - origin) * buckets // span
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+    counts = np.diff(np.append(starts, count))
+    group = np.repeat(np.arange(len(starts)), counts)
+    selected = [np.array([0, count - 1])]
+    for reduce in (np.minimum, np.maximum):
+        extremes = np.repeat(reduce.reduceat(prices, starts), counts)
+        candidates = np.flatnonzero(prices == extremes)
+        # Lần xuất hiện đầu tiên của min/max trong mỗi bucket
+        _, first = np.unique(group[candidates], return_index=True)
+        selected.append(candidates[first])
+    return np.unique(np.concatenate(selected))
+
+
+def _volatility_stats(volatility, maximum=None, total=None):
+    if not len(volatility):
+        return {"latest": None, "max": None, "mean": None}
+    maximum = max(volatility) if maximum is None else maximum
+    total = sum(volatility) if total is None else total
+    return {
+        "latest": float(volatility[-1]),
+        "max": float(maximum),
+        "mean": float(total / len(volatility))
+    }
+
+
+def numpy_summary(ts, prices, sizes, window, interval_ms):
+    notional = prices * sizes
+    volume = float(notional.sum())
+    base_volume = float(sizes.sum())
+
+    returns = np.empty(0)
+    if len(prices) > 1:
+        previous = prices[:-1]
+        returns = np.divide(np.diff(prices), previous, out=np.zeros(len(previous)), where=previous != 0)
+    volatility = np.empty(0)
+    if window > 0 and len(returns) >= window:
+        # Rolling population std qua cumulative sums
+        s1 = np.concatenate(([0.0], np.cumsum(returns)))
+        s2 = np.concatenate(([0.0], np.cumsum(returns * returns)))
+        sum1 = s1[window:] - s1[:-window]
+        sum2 = s2[window:] - s2[:-window]
+        volatility = np.sqrt(np.maximum(sum2 / window - (sum1 / window) ** 2, 0.0))
+
+    candles = []
+    if interval_ms and len(ts):
+        buckets = ts - ts % interval_ms
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.concatenate((starts[1:], [len(ts)]))
+        highs = np.maximum.reduceat(prices, starts)
+        lows = np.minimum.reduceat(prices, starts)
+        volumes = np.add.reduceat(sizes, starts)
+        quote_volumes = np.add.reduceat(notional, starts)
+        for i in range(len(starts)):
+            candles.append({
+                "open_time": int(buckets[starts[i]]),
+                "open": float(prices[starts[i]]),
+                "high": float(highs[i]),
+                "low": float(lows[i]),
+                "close": float(prices[ends[i] - 1]),
+                "volume": float(volumes[i]),
+                "quote_volume": float(quote_volumes[i]),
+                "trades": int(ends[i] - starts[i])
+            })
+
+    return {
+        "trades": int(len(prices)),
+        "volume_usd": volume,
+        "base_volume": base_volume,
+        "vwap": volume / base_volume if base_volume else None,
+        "return_total": float(prices[-1] / prices[0] - 1) if len(prices) > 1 and prices[0] else None,
+        "volatility": _volatility_stats(
+            volatility,
+            volatility.max() if len(volatility) else None,
+            volatility.sum() if len(volatility) else None
+        ),
+        "candles": candles
+    }
+
+
+def python_summary(ts, prices, sizes, window, interval_ms):
+    volume = 0.0
+    base_volume = 0.0
+    for price, size in zip(prices, sizes):
+        volume += price * size
+        base_volume += size
+
+    returns = [(prices[i] - prices[i - 1]) / prices[i - 1] if prices[i - 1] else 0.0
+               for i in range(1, len(prices))]
+    volatility = []
+    if window > 0 and len(returns) >= window:
+        sum1 = sum(returns[:window])
+        sum2 = sum(r * r for r in returns[:window])
+        volatility.append(math.sqrt(max(sum2 / window - (sum1 / window) ** 2, 0.0)))
+        for i in range(window, len(returns)):
+            old, new = returns[i - window], returns[i]
+            sum1 += new - old
+            sum2 += new * new - old * old
+            volatility.append(math.sqrt(max(sum2 / window - (sum1 / window) ** 2, 0.0)))
+
+    candles = []
+    if interval_ms:
+        current = None
+        for t, price, size in zip(ts, prices, sizes):
+            bucket = t - t % interval_ms
+            if current is None or bucket != current["open_time"]:
+                current = {
+                    "open_time": bucket, "open": price, "high": price, "low": price,
+                    "close": price, "volume": 0.0, "quote_volume": 0.0, "trades": 0
+                }
+                candles.append(current)
+            current["high"] = max(current["high"], price)
+            current["low"] = min(current["low"], price)
+            current["close"] = price
+            current["volume"] += size
+            current["quote_volume"] += price * size
+            current["trades"] += 1
+
+    return {
+        "trades": len(prices),
+        "volume_usd": volume,
+        "base_volume": base_volume,
+        "vwap": volume / base_volume if base_volume else None,
+        "return_total": prices[-1] / prices[0] - 1 if len(prices) > 1 and prices[0] else None,
+        "volatility": _volatility_stats(volatility),
+        "candles": candles
+    }
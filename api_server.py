@@ -1,16 +1,56 @@
-from flask import Flask, jsonify, request
-import json
+from flask import Flask, jsonify, request, Response, stream_with_context, has_request_context, g
+from flask.json.provider import DefaultJSONProvider
+import math
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import signal
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import threading
 import time
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+
+from trade_cache import TradeCache, decode_cursor
+from shared_cache import SharedTradeCache
+from candles import Candle, INTERVALS, INTERVAL_NAMES, bucket_start, read_candles, candle_points
+from analytics import AnalyticsEngine, preload as preload_analytics
+from trade_stream import TradeSubscriber
+from response_cache import ResponseCache
+import codec
+from trade_guard import load_gaps
+from order_book import read_book
+from export import TradeExporter, SpoolCache, FORMATS, COMPRESSIONS, read_range, zstandard
+import metrics
+from bisect import bisect_left, bisect_right
 
 app = Flask(__name__)
 
+def response_mimetype():
+    """Negotiate JSON or MessagePack from the Accept header"""
+    if codec.HAS_MSGPACK and has_request_context():
+        best = request.accept_mimetypes.best_match([codec.JSON_MIMETYPE, codec.MSGPACK_MIMETYPE])
+        if best == codec.MSGPACK_MIMETYPE:
+            return best
+    return codec.JSON_MIMETYPE
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify() through codec (orjson when installed), MessagePack on request"""
+    
+    def dumps(self, obj, **kwargs):
+        return codec.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        mimetype = response_mimetype()
+        return self._app.response_class(codec.encode(obj, mimetype), mimetype=mimetype)
+
+app.json = CodecJSONProvider(app)
+
 # Cấu hình logging cho production
 logging.basicConfig(
     level=logging.INFO,
@@ -26,97 +66,275 @@ logger = logging.getLogger(__name__)
 PRODUCTION_CONFIG = {
     "max_records_per_request": 1000,
     "default_limit": 100,
-    "cache_timeout": 60,  # seconds
+    "cache_refresh_interval": 1.0,  # seconds, background incremental refresh
+    "max_cached_records": 200000,
+    # Một worker load + publish snapshot, các workers khác chỉ mmap (memory không tăng theo số workers)
+    "shared_cache": True,
+    "shared_cache_dir": None,       # None = /dev/shm/trading_api_cache_<hash of columns_dir>
+    # Mỗi generation là bản copy đầy đủ của indexes (~15 MB / 200k rows): publish tối đa mỗi N giây
+    "shared_cache_publish_interval": 1.0,
+    # Snapshot indexes + aggregates trên disk: restart chỉ cần ingest các rows mới
+    "cache_checkpoint": "cache_checkpoint/trade_cache.snap",
+    "cache_checkpoint_interval": 60,  # seconds
+    # Index phụ cho trades lớn (whale alerts): chỉ trades >= large_trade_usd, tối đa large_trade_max mỗi index
+    "large_trade_usd": 1000,
+    "large_trade_max": 100000,
+    "large_default_window": "1h",
+    "columns_dir": "trade_columns",
+    "candles_dir": "candles",
+    "stream_socket": "trade_stream.sock",
+    # Mỗi SSE client giữ một gthread thread suốt thời gian stream: giới hạn theo --threads (API_THREADS)
+    # và chừa lại threads cho REST/health checks. ASGI mode không giữ thread nên dùng giới hạn riêng.
+    "worker_threads": int(os.environ.get("API_THREADS", "32")),
+    "stream_rest_threads": 8,
+    "asgi_stream_max_subscribers": 1000,  # per worker
+    "stream_queue_size": 1000,      # trades buffered per client before dropping oldest
+    "stream_heartbeat": 15,         # seconds
+    "asgi_threads": 32,             # asgi_server.py: thread pool chạy Flask routes (mỗi worker)
+    "response_cache_entries": 256,  # pre-serialized responses per worker
+    "gzip_min_bytes": 1024,
+    "trade_log_dir": "trade_log",
+    "archive_dir": "trade_archive",
+    "gaps_file": "gaps.json",
+    "books_dir": "order_books",
+    "book_default_depth": 20,
+    "book_max_depth": 200,          # = snapshot_depth của collector
+    "series_default_points": 500,
+    "series_max_points": 5000,
+    # /api/series: range có nhiều hơn points * mức này ticks được tính từ candles (CPU không tăng
+    # theo số ticks); phải nhỏ hơn hẳn max_cached_records, nếu không range dày không bao giờ dùng candles
+    "series_ticks_per_point": 20,
+    "batch_max_queries": 50,        # sub-queries per /api/batch request
+    # Pool chung của worker cho sub-queries: candles đọc files, NumPy nhả GIL; giới hạn để một batch
+    # lớn không chiếm hết CPU của các request khác
+    "batch_threads": 4,
+    "metrics_dir": "metrics_snapshots",  # mỗi worker ghi metrics của mình, /metrics gộp lại
+    # JSON array files từ collector cũ, export đọc cả những file này
+    "export_legacy_files": ["trading_data.json", "trading_data.json.migrated",
+                            "trading_data_backup_*.json", "backups/trading_data_*.json"],
+    # Range/resume chỉ cho 'to' cũ hơn mức này: trades đến trễ và writer flush đã xong
+    "export_settle_seconds": 120,
+    # Exports đã encode cho Range requests, dùng lại giữa các workers cho tới khi ETag đổi
+    "export_spool_dir": "export_spool",
+    "export_spool_max_bytes": 2 * 1024 ** 3,
+    "export_spool_max_age": 3600,
+    "export_spool_wait": 5.0,         # giây chờ encode trước khi trả 503 + Retry-After
+    "export_spool_retry_after": 5,
     "enable_cors": True
 }
 
+# Column store được mmap read-only, dùng chung page cache giữa các workers.
+# Cache chỉ đọc phần records mới, refresh chạy ở background thread.
+if PRODUCTION_CONFIG["shared_cache"]:
+    trade_cache = SharedTradeCache(
+        PRODUCTION_CONFIG["columns_dir"],
+        PRODUCTION_CONFIG["max_cached_records"],
+        PRODUCTION_CONFIG["cache_refresh_interval"],
+        PRODUCTION_CONFIG["shared_cache_dir"],
+        checkpoint_path=PRODUCTION_CONFIG["cache_checkpoint"],
+        checkpoint_interval=PRODUCTION_CONFIG["cache_checkpoint_interval"],
+        large_trade_usd=PRODUCTION_CONFIG["large_trade_usd"],
+        large_trade_max=PRODUCTION_CONFIG["large_trade_max"],
+        publish_interval=PRODUCTION_CONFIG["shared_cache_publish_interval"]
+    )
+else:
+    trade_cache = TradeCache(
+        PRODUCTION_CONFIG["columns_dir"],
+        PRODUCTION_CONFIG["max_cached_records"],
+        PRODUCTION_CONFIG["cache_refresh_interval"],
+        PRODUCTION_CONFIG["cache_checkpoint"],
+        PRODUCTION_CONFIG["cache_checkpoint_interval"],
+        PRODUCTION_CONFIG["large_trade_usd"],
+        PRODUCTION_CONFIG["large_trade_max"]
+    )
+analytics = AnalyticsEngine(trade_cache.store)
+PRODUCTION_CONFIG["stream_max_subscribers"] = max(
+    PRODUCTION_CONFIG["worker_threads"] - PRODUCTION_CONFIG["stream_rest_threads"], 1)  # per worker
+trade_stream = TradeSubscriber(
+    PRODUCTION_CONFIG["stream_socket"],
+    PRODUCTION_CONFIG["stream_max_subscribers"]
+)
+
+exporter = TradeExporter(
+    PRODUCTION_CONFIG["trade_log_dir"],
+    PRODUCTION_CONFIG["archive_dir"],
+    PRODUCTION_CONFIG["export_legacy_files"]
+)
+# Threads chỉ được tạo khi có batch đầu tiên, tức sau khi gunicorn fork
+batch_executor = ThreadPoolExecutor(max_workers=PRODUCTION_CONFIG["batch_threads"], thread_name_prefix="api-batch")
+export_spool = SpoolCache(
+    PRODUCTION_CONFIG["export_spool_dir"],
+    PRODUCTION_CONFIG["export_spool_max_bytes"],
+    PRODUCTION_CONFIG["export_spool_max_age"]
+)
+
+# Responses đã serialize sẵn, dùng lại cho tới khi data version thay đổi
+response_cache = ResponseCache(
+    PRODUCTION_CONFIG["response_cache_entries"],
+    PRODUCTION_CONFIG["gzip_min_bytes"]
+)
+
+# Prometheus metrics, gộp giữa các gunicorn workers qua snapshot files
+worker_metrics = metrics.WorkerSnapshots(PRODUCTION_CONFIG["metrics_dir"])
+REQUESTS = metrics.counter("api_requests_total", "HTTP requests", ("endpoint", "status"))
+REQUEST_SECONDS = metrics.histogram("api_request_seconds", "Time to produce a response (streams: until headers)",
+                                    ("endpoint",))
+RESPONSE_BYTES = metrics.histogram("api_response_bytes", "Response body size (sized responses only)",
+                                   ("endpoint",), buckets=metrics.SIZE_BUCKETS)
+metrics.gauge("api_cache_rows", "Rows in the trade cache (data version)", func=lambda: trade_cache.version)
+metrics.gauge("api_cache_generation", "Shared cache snapshot generation mapped by this worker",
+              func=lambda: getattr(trade_cache, "generation", 0))
+metrics.gauge("api_cache_age_seconds", "Seconds since the last cache refresh",
+              func=lambda: time.time() - trade_cache.last_refresh if trade_cache.last_refresh else 0)
+metrics.counter("api_response_cache_hits_total", "Pre-serialized response cache hits",
+                func=lambda: response_cache.hits)
+metrics.counter("api_response_cache_misses_total", "Pre-serialized response cache misses",
+                func=lambda: response_cache.misses)
+metrics.gauge("api_stream_subscribers", "Connected SSE clients", func=lambda: len(trade_stream.subscriptions))
+
 # Simple cache để tối ưu performance
 data_cache = {
-    "data": [],
-    "timestamp": 0.0,
     "stats": {},
+    "stats_version": -1,
     "stats_timestamp": 0.0
 }
 
 def get_cached_data():
-    """Get cached data or load from file"""
-    current_time = time.time()
-    
-    if (not data_cache["data"] or 
-        data_cache["timestamp"] == 0.0 or 
-        current_time - data_cache["timestamp"] > PRODUCTION_CONFIG["cache_timeout"]):
-        
-        try:
-            if os.path.exists('trading_data.json'):
-                with open('trading_data.json', 'r', encoding='utf-8') as f:
-                    data_cache["data"] = json.load(f)
-                    data_cache["timestamp"] = current_time
-                    logger.info(f"Refreshed cache with {len(data_cache['data'])} records")
-            else:
-                data_cache["data"] = []
-                data_cache["timestamp"] = current_time
-        except Exception as e:
-            logger.error(f"Error loading data: {e}")
-            data_cache["data"] = []
-    
-    return data_cache["data"]
+    """Get a view over the newest cached rows (never blocks on a refresh)"""
+    trade_cache.ensure_started()
+    return trade_cache.view()
 
 def get_cached_stats():
-    """Get cached statistics"""
-    current_time = time.time()
+    """Get statistics from the running aggregates (rebuilt only when data changes)"""
+    get_cached_data()
     
-    if (not data_cache["stats"] or 
-        data_cache["stats_timestamp"] == 0.0 or 
-        current_time - data_cache["stats_timestamp"] > PRODUCTION_CONFIG["cache_timeout"]):
-        
-        data = get_cached_data()
-        if data:
-            symbols = {}
-            latest_timestamp = None
-            total_volume = 0
-            
-            for trade in data:
-                symbol = trade.get('symbol', 'Unknown')
-                if symbol not in symbols:
-                    symbols[symbol] = {"count": 0, "volume": 0}
-                symbols[symbol]["count"] += 1
-                
-                # Calculate volume
-                try:
-                    price = float(trade.get('data', {}).get('price', 0))
-                    size = float(trade.get('data', {}).get('size', 0))
-                    volume = price * size
-                    symbols[symbol]["volume"] += volume
-                    total_volume += volume
-                except:
-                    pass
-                
-                # Track latest timestamp
-                timestamp = trade.get('timestamp', '')
-                if not latest_timestamp or timestamp > latest_timestamp:
-                    latest_timestamp = timestamp
-            
-            data_cache["stats"] = {
-                "total_trades": len(data),
-                "symbols_count": len(symbols),
-                "symbols_breakdown": symbols,
-                "latest_trade_time": latest_timestamp,
-                "total_volume_usd": total_volume,
-                "data_file_size": os.path.getsize('trading_data.json') if os.path.exists('trading_data.json') else 0
-            }
-            data_cache["stats_timestamp"] = current_time
-        else:
-            data_cache["stats"] = {
-                "total_trades": 0,
-                "symbols_count": 0,
-                "symbols_breakdown": {},
-                "latest_trade_time": None,
-                "total_volume_usd": 0,
-                "data_file_size": 0
-            }
+    # Retention tính lại aggregates mà không đổi version
+    version = (trade_cache.version, trade_cache.first_row)
+    if not data_cache["stats"] or data_cache["stats_version"] != version:
+        last_ts = trade_cache.last_ts
+        symbols = trade_cache.stats_breakdown()
+        data_cache["stats"] = {
+            "total_trades": trade_cache.total_trades,
+            "symbols_count": len(symbols),
+            "symbols_breakdown": symbols,
+            "latest_trade_time": datetime.fromtimestamp(last_ts / 1000).isoformat() if last_ts else None,
+            "total_volume_usd": trade_cache.total_volume,
+            "data_file_size": trade_cache.store.size_bytes()
+        }
+        data_cache["stats_version"] = version
+        data_cache["stats_timestamp"] = time.time()
     
     return data_cache["stats"]
 
+def parse_range_args():
+    """Parse from/to (exchange ts in ms) and cursor query parameters"""
+    from_ts = request.args.get('from', type=int)
+    to_ts = request.args.get('to', type=int)
+    cursor = request.args.get('cursor', type=str)
+    if request.args.get('from') and from_ts is None:
+        raise ValueError("Invalid 'from' parameter, expected ts in milliseconds")
+    if request.args.get('to') and to_ts is None:
+        raise ValueError("Invalid 'to' parameter, expected ts in milliseconds")
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor)
+        except ValueError:
+            raise ValueError("Invalid 'cursor' parameter")
+    else:
+        cursor = None
+    return from_ts, to_ts, cursor
+
+def versioned_response(view):
+    """Serve a GET endpoint from pre-serialized bytes with ETag/Last-Modified.
+
+    The ETag is derived from the data version and the first row kept by
+    retention, so a matching If-None-Match is answered with 304 before the
+    view runs. If-Modified-Since is only used without If-None-Match, and
+    only once the second of the last update is over. Otherwise the body is
+    built once per (path, query args, POST body, ETag) and reused, gzipped
+    on request.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        get_cached_data()
+        mimetype = response_mimetype()
+        # Retention (drop_before) đổi first_row, tức view được trả về, mà không đổi version/last_ts
+        tag = f"{trade_cache.version:x}-{trade_cache.last_ts:x}-{trade_cache.first_row:x}"
+        if mimetype != codec.JSON_MIMETYPE:
+            tag += "-msgpack"
+        # Last-Modified chỉ chính xác tới giây: chỉ gửi (và so với If-Modified-Since) khi giây của
+        # last_update đã qua, nếu không trades đến sau trong cùng giây vẫn bị trả về 304
+        last_update = trade_cache.last_update
+        last_modified = (datetime.fromtimestamp(int(last_update), timezone.utc)
+                         if last_update and int(last_update) < int(time.time()) else None)
+        
+        if request.method != 'GET':
+            not_modified = False  # conditional POST là precondition (412), không phải cache
+        elif request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(tag)
+        else:
+            not_modified = (last_modified is not None and request.if_modified_since is not None and
+                            request.if_modified_since.timestamp() >= last_modified.timestamp())
+        if not_modified:
+            response = Response(status=304)
+            cache_status = "REVALIDATED"
+        else:
+            key = (request.path, mimetype, tuple(sorted(request.args.items(multi=True))),
+                   request.get_data() if request.method == 'POST' else None)
+            entry = response_cache.get(key, tag)
+            cache_status = "HIT"
+            if entry is None:
+                built = app.make_response(view(*args, **kwargs))
+                if built.status_code != 200:
+                    return built
+                entry = response_cache.put(key, tag, built.get_data(), built.mimetype)
+                cache_status = "MISS"
+            
+            body = None
+            if request.accept_encodings['gzip']:
+                body = response_cache.gzipped(entry)
+            response = Response(body if body is not None else entry.body, mimetype=entry.mimetype)
+            if body is not None:
+                response.headers['Content-Encoding'] = 'gzip'
+        
+        response.set_etag(tag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        response.headers['X-Cache'] = cache_status
+        return response
+    return wrapper
+
+def bad_request(message):
+    return jsonify({
+        "status": "error",
+        "mode": "production",
+        "message": message,
+        "timestamp": datetime.now().isoformat()
+    }), 400
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    worker_metrics.ensure_started()
+    # Request đầu tiên (thường là health check) bắt đầu load cache ở background
+    if trade_cache.thread is None:
+        trade_cache.ensure_started(wait=False)
+        preload_analytics()
+
+@app.after_request
+def record_request_metrics(response):
+    """Per-endpoint latency, status and size (url rule, so path params do not add series)"""
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, str(response.status_code)).inc()
+        if not response.is_streamed and response.content_length is not None:
+            RESPONSE_BYTES.labels(endpoint).observe(response.content_length)
+    return response
+
 @app.after_request
 def after_request(response):
     """Add CORS headers for production"""
@@ -127,6 +345,7 @@ def after_request(response):
     return response
 
 @app.route('/')
+@versioned_response
 def home():
     stats = get_cached_stats()
     return jsonify({
@@ -135,10 +354,20 @@ def home():
         "status": "running",
         "version": "1.0.0",
         "endpoints": {
-            "/api/trading": "GET - Get all trading data (with pagination)",
+            "/api/trading": "GET - Get all trading data (cursor pagination, from/to in ms)",
             "/api/trading/latest": "GET - Get latest trades",
             "/api/trading/symbol/<symbol>": "GET - Get trades by symbol",
             "/api/trading/stats": "GET - Get comprehensive statistics",
+            "/api/trading/large": "GET - Largest trades (symbol, min_usd, window=1h, sort=notional|time)",
+            "/api/candles/<symbol>": "GET - OHLCV candles (interval=1m|5m|15m|1h|4h|1d)",
+            "/api/analytics/<symbol>": "GET - Volume, VWAP, returns, rolling volatility",
+            "/api/series/<symbol>": "GET - Downsampled chart series (points=500, method=lttb|minmax, from, to)",
+            "/api/batch": "POST - Many symbol queries in one request ({\"queries\": [{\"symbol\", \"type\", ...}]})",
+            "/api/stream": "GET - Live trades (Server-Sent Events, ?symbol=BTCUSDT,ETHUSDT)",
+            "/api/book/<symbol>": "GET - Order book snapshot (depth=20), best bid/ask, spread",
+            "/api/gaps": "GET - Missed trade intervals detected after reconnects (symbol, from, to)",
+            "/api/export": "GET - Stream history (format=csv|ndjson|columnar, compression=gzip|zstd|none)",
+            "/metrics": "GET - Prometheus metrics (all workers)",
             "/api/health": "GET - Health check",
             "/api/info": "GET - Server information"
         },
@@ -156,7 +385,15 @@ def home():
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Comprehensive health check"""
+    """Comprehensive health check (answers immediately while the cache is still loading)"""
+    trade_cache.ensure_started(wait=False)
+    if not trade_cache.loaded.is_set():
+        return jsonify({
+            "status": "starting",
+            "mode": "production",
+            "message": "Cache is loading",
+            "timestamp": datetime.now().isoformat()
+        })
     data = get_cached_data()
     stats = get_cached_stats()
     
@@ -192,10 +429,14 @@ def health_check():
         },
         "cache_status": {
             "enabled": True,
-            "last_refresh": datetime.fromtimestamp(data_cache["timestamp"]).isoformat() if data_cache["timestamp"] > 0 else None
+            "last_refresh": datetime.fromtimestamp(trade_cache.last_refresh).isoformat() if trade_cache.last_refresh > 0 else None,
+            "last_refresh_ms": round(trade_cache.refresh_duration * 1000, 2),
+            "shared": PRODUCTION_CONFIG["shared_cache"],
+            "generation": getattr(trade_cache, "generation", None),
+            "loader": getattr(trade_cache, "is_leader", True)
         },
         "disk_status": {
-            "data_file_exists": os.path.exists('trading_data.json'),
+            "data_file_exists": os.path.isdir(PRODUCTION_CONFIG["columns_dir"]),
             "data_file_size_mb": round(float(stats.get("data_file_size", 0)) / (1024*1024), 2)
         }
     })
@@ -216,51 +457,72 @@ def server_info():
             "pagination": True,
             "filtering": True,
             "statistics": True,
+            "analytics_backend": analytics.backend,
+            "json_backend": codec.JSON_BACKEND,
+            "msgpack": codec.HAS_MSGPACK,
+            "response_cache": response_cache.stats(),
             "cors": PRODUCTION_CONFIG["enable_cors"]
         }
     })
 
 @app.route('/api/trading', methods=['GET'])
+@versioned_response
 def get_trading_data():
-    """Get trading data with pagination"""
+    """Get trading data with cursor pagination and optional time range"""
     try:
         # Get parameters
         limit = request.args.get('limit', default=PRODUCTION_CONFIG["default_limit"], type=int)
-        offset = request.args.get('offset', default=0, type=int)
         symbol = request.args.get('symbol', type=str)
+        from_ts, to_ts, cursor = parse_range_args()
         
         # Validate parameters
-        limit = min(limit, PRODUCTION_CONFIG["max_records_per_request"])
-        offset = max(offset, 0)
+        limit = max(min(limit, PRODUCTION_CONFIG["max_records_per_request"]), 1)
         
         data = get_cached_data()
         
-        # Filter by symbol if specified
-        if symbol:
-            data = [trade for trade in data if trade.get('symbol', '').upper() == symbol.upper()]
-        
-        # Apply pagination
-        total_records = len(data)
-        paginated_data = data[offset:offset + limit]
+        if 'offset' in request.args:
+            # Legacy offset pagination (deprecated, dùng cursor thay thế)
+            offset = max(request.args.get('offset', default=0, type=int), 0)
+            if symbol:
+                data = trade_cache.symbol_view(symbol) or []
+            total_records = len(data)
+            paginated_data = data[offset:offset + limit]
+            pagination = {
+                "total_records": total_records,
+                "returned_records": len(paginated_data),
+                "offset": offset,
+                "limit": limit,
+                "has_more": offset + limit < total_records
+            }
+        else:
+            rows, total_records, next_cursor = trade_cache.range_query(
+                symbol or None, from_ts, to_ts, cursor, limit
+            )
+            paginated_data = rows[:]
+            pagination = {
+                "total_records": total_records,
+                "returned_records": len(paginated_data),
+                "limit": limit,
+                "has_more": next_cursor is not None,
+                "next_cursor": next_cursor
+            }
         
         return jsonify({
             "status": "success",
             "mode": "production",
             "message": "Trading data retrieved successfully",
             "data": paginated_data,
-            "pagination": {
-                "total_records": total_records,
-                "returned_records": len(paginated_data),
-                "offset": offset,
-                "limit": limit,
-                "has_more": offset + limit < total_records
-            },
+            "pagination": pagination,
             "filters": {
-                "symbol": symbol
+                "symbol": symbol,
+                "from": from_ts,
+                "to": to_ts
             },
             "timestamp": datetime.now().isoformat()
         })
         
+    except ValueError as e:
+        return bad_request(str(e))
     except Exception as e:
         logger.error(f"Error in trading API: {e}")
         return jsonify({
@@ -271,14 +533,15 @@ def get_trading_data():
         }), 500
 
 @app.route('/api/trading/latest', methods=['GET'])
+@versioned_response
 def get_latest_trades():
     """Get latest trades"""
     try:
         limit = request.args.get('limit', default=50, type=int)
-        limit = min(limit, 500)  # Max 500 for latest
+        limit = max(min(limit, 500), 1)  # 1..500 for latest
         
         data = get_cached_data()
-        latest_data = data[-limit:] if len(data) >= limit else data
+        latest_data = data[-limit:]  # view -> list of records (cả khi ít hơn limit)
         
         return jsonify({
             "status": "success",
@@ -297,19 +560,28 @@ def get_latest_trades():
             "message": "Internal server error"
         }), 500
 
+def symbol_trades(symbol, limit, from_ts=None, to_ts=None, cursor=None):
+    """(trades, next cursor) of one symbol: latest ``limit``, or a time range oldest first"""
+    if from_ts is not None or to_ts is not None or cursor is not None:
+        # Time range: oldest first, trang tiếp theo qua cursor
+        rows, _, next_cursor = trade_cache.range_query(symbol, from_ts, to_ts, cursor, limit)
+        return rows[:], next_cursor
+    rows = trade_cache.symbol_view(symbol) or []
+    # Get latest records
+    return (rows[-limit:] if limit > 0 else rows[:]), None
+
 @app.route('/api/trading/symbol/<symbol>', methods=['GET'])
+@versioned_response
 def get_trades_by_symbol(symbol):
     """Get trades by specific symbol"""
     try:
         limit = request.args.get('limit', default=100, type=int)
-        limit = min(limit, PRODUCTION_CONFIG["max_records_per_request"])
+        limit = max(min(limit, PRODUCTION_CONFIG["max_records_per_request"]), 1)
         
-        data = get_cached_data()
-        filtered_data = [trade for trade in data if trade.get('symbol', '').upper() == symbol.upper()]
+        from_ts, to_ts, cursor = parse_range_args()
         
-        # Get latest records
-        if limit > 0:
-            filtered_data = filtered_data[-limit:]
+        get_cached_data()
+        filtered_data, next_cursor = symbol_trades(symbol, limit, from_ts, to_ts, cursor)
         
         return jsonify({
             "status": "success",
@@ -318,9 +590,12 @@ def get_trades_by_symbol(symbol):
             "symbol": symbol.upper(),
             "data": filtered_data,
             "total_records": len(filtered_data),
+            "next_cursor": next_cursor,
             "timestamp": datetime.now().isoformat()
         })
         
+    except ValueError as e:
+        return bad_request(str(e))
     except Exception as e:
         logger.error(f"Error in symbol trading API: {e}")
         return jsonify({
@@ -330,6 +605,7 @@ def get_trades_by_symbol(symbol):
         }), 500
 
 @app.route('/api/trading/stats', methods=['GET'])
+@versioned_response
 def get_trading_stats():
     """Get comprehensive trading statistics"""
     try:
@@ -355,6 +631,615 @@ def get_trading_stats():
             "message": "Internal server error"
         }), 500
 
+@app.route('/api/trading/large', methods=['GET'])
+@versioned_response
+def get_large_trades():
+    """Largest (or newest) trades above a USD threshold in a recent window"""
+    try:
+        symbol = request.args.get('symbol', type=str)
+        min_usd = request.args.get('min_usd', type=str)
+        if min_usd:
+            try:
+                min_usd = float(min_usd)
+            except ValueError:
+                return bad_request("Invalid 'min_usd' parameter, expected a number")
+            if not math.isfinite(min_usd) or min_usd < 0:
+                return bad_request("Invalid 'min_usd' parameter, expected a non-negative number")
+        else:
+            min_usd = PRODUCTION_CONFIG["large_trade_usd"]
+        window = request.args.get('window', default=PRODUCTION_CONFIG["large_default_window"], type=str)
+        sort = request.args.get('sort', default='notional', type=str)
+        limit = request.args.get('limit', default=50, type=int)
+        limit = max(min(limit, PRODUCTION_CONFIG["max_records_per_request"]), 1)
+        if min_usd < PRODUCTION_CONFIG["large_trade_usd"]:
+            return bad_request(f"Invalid 'min_usd', trades below {PRODUCTION_CONFIG['large_trade_usd']} USD are not indexed")
+        if window != "all" and window not in INTERVALS:
+            return bad_request(f"Invalid window, expected 'all' or one of: {', '.join(INTERVAL_NAMES)}")
+        if sort not in ("notional", "time"):
+            return bad_request("Invalid sort, expected one of: notional, time")
+        
+        get_cached_data()
+        # Window tính từ trade mới nhất (không phụ thuộc clock của server)
+        from_ts = trade_cache.last_ts - INTERVALS[window] + 1 if window != "all" else None
+        trades, matches = trade_cache.large_trades(symbol or None, from_ts, min_usd, limit, sort == "notional")
+        data = []
+        for notional, row in trades:
+            record = trade_cache.store.record(row)
+            record["notional_usd"] = notional
+            data.append(record)
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"{len(data)} large trades",
+            "data": data,
+            "total_matches": matches,
+            "filters": {
+                "symbol": symbol.upper() if symbol else None,
+                "min_usd": min_usd,
+                "window": window,
+                "from": from_ts,
+                "sort": sort
+            },
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in large trades API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+def build_open_candle(symbol, interval):
+    """Current (not yet closed) candle for an interval.
+
+    Closed finer candles cover most of the bucket; only trades after the
+    newest closed 1m candle are read from the trade cache.
+    """
+    index = trade_cache.get_index(symbol)
+    stats = trade_cache.symbol_stats.get(trade_cache.symbol_lookup.get(symbol.upper()))
+    if index is None or stats is None or not stats.last_ts:
+        return None
+
+    symbol_name = trade_cache.store.symbol_name(trade_cache.symbol_lookup[symbol.upper()])
+    candle = Candle(bucket_start(stats.last_ts, INTERVALS[interval]))
+    cursor = candle.open_ts
+    for level in range(INTERVAL_NAMES.index(interval) - 1, -1, -1):
+        finer_interval = INTERVAL_NAMES[level]
+        finer = read_candles(PRODUCTION_CONFIG["candles_dir"], symbol_name, finer_interval, from_ts=cursor)
+        for closed in finer:
+            candle.merge(closed)
+        if finer:
+            cursor = finer[-1].open_ts + INTERVALS[finer_interval]
+
+    rows, stamps, size = index.state
+    prices = trade_cache.store.column("price")
+    sizes = trade_cache.store.column("size")
+    for i in range(bisect_left(stamps, cursor, 0, size), size):
+        row = rows[i]
+        candle.add_trade(prices[row], sizes[row])
+    return candle if candle.trades else None
+
+def symbol_candles(symbol, interval, from_ts=None, to_ts=None, limit=100):
+    """(symbol name, candle dicts): closed rollups plus the open candle if in range"""
+    symbol_id = trade_cache.symbol_lookup.get(symbol.upper())
+    symbol_name = trade_cache.store.symbol_name(symbol_id) if symbol_id is not None else symbol.upper()
+    closed = read_candles(PRODUCTION_CONFIG["candles_dir"], symbol_name, interval, from_ts, to_ts, limit)
+    candles = [candle.to_dict() for candle in closed]
+    
+    # Thêm candle đang mở nếu nằm trong khoảng thời gian yêu cầu
+    current = build_open_candle(symbol, interval)
+    if (current is not None and
+            (not closed or current.open_ts > closed[-1].open_ts) and
+            (from_ts is None or current.open_ts >= from_ts) and
+            (to_ts is None or current.open_ts <= to_ts)):
+        candles.append(current.to_dict(closed=False))
+        candles = candles[-limit:]
+    return symbol_name, candles
+
+@app.route('/api/candles/<symbol>', methods=['GET'])
+@versioned_response
+def get_candles(symbol):
+    """Get OHLCV candles from precomputed rollups"""
+    try:
+        interval = request.args.get('interval', default='1m', type=str)
+        limit = request.args.get('limit', default=PRODUCTION_CONFIG["default_limit"], type=int)
+        limit = max(min(limit, PRODUCTION_CONFIG["max_records_per_request"]), 1)
+        from_ts, to_ts, _ = parse_range_args()
+        if interval not in INTERVALS:
+            return bad_request(f"Invalid interval, expected one of: {', '.join(INTERVAL_NAMES)}")
+        
+        get_cached_data()
+        symbol_name, candles = symbol_candles(symbol, interval, from_ts, to_ts, limit)
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"{interval} candles for {symbol_name}",
+            "symbol": symbol_name,
+            "interval": interval,
+            "data": candles,
+            "total_records": len(candles),
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in candles API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+def symbol_analytics(symbol, from_ts=None, to_ts=None, window=20, interval=None):
+    """Analytics summary of a symbol's trades in [from, to]; None if the symbol is unknown"""
+    index = trade_cache.get_index(symbol)
+    if index is None:
+        return None
+    rows, stamps, size = index.state
+    start = bisect_left(stamps, from_ts, 0, size) if from_ts is not None else 0
+    stop = bisect_right(stamps, to_ts, 0, size) if to_ts is not None else size
+    ts, prices, sizes = analytics.load(rows, start, stop)
+    return analytics.summary(ts, prices, sizes, window, INTERVALS.get(interval))
+
+@app.route('/api/analytics/<symbol>', methods=['GET'])
+@versioned_response
+def get_analytics(symbol):
+    """Vectorized analytics over a symbol's trades in [from, to]"""
+    try:
+        from_ts, to_ts, _ = parse_range_args()
+        window = max(request.args.get('window', default=20, type=int), 1)
+        interval = request.args.get('interval', type=str)
+        if interval is not None and interval not in INTERVALS:
+            return bad_request(f"Invalid interval, expected one of: {', '.join(INTERVAL_NAMES)}")
+        
+        get_cached_data()
+        summary = symbol_analytics(symbol, from_ts, to_ts, window, interval)
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"Analytics for {symbol.upper()}",
+            "symbol": symbol.upper(),
+            "backend": analytics.backend,
+            "window": window,
+            "interval": interval,
+            "analytics": summary,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in analytics API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+def series_source(symbol, from_ts, to_ts, points):
+    """(source name, ts, prices, sizes) for a chart series in [from, to].
+
+    Raw ticks from the cache when it covers the range with at most
+    ``series_ticks_per_point`` trades per point; otherwise the finest candle interval with
+    no more than ``points`` candles in the range, plus cached ticks for the
+    uncovered edges (less than one interval each). Without candle rollups
+    for the range only the cached ticks are left, reported as "trades".
+    """
+    index = trade_cache.get_index(symbol)
+    if index is None:
+        return "trades", [], [], []
+    rows, stamps, size = index.state
+    start = bisect_left(stamps, from_ts, 0, size)
+    stop = bisect_right(stamps, to_ts, 0, size)
+    if size and stamps[0] <= from_ts and stop - start <= PRODUCTION_CONFIG["series_ticks_per_point"] * points:
+        return ("trades",) + tuple(analytics.load(rows, start, stop))
+
+    span = to_ts - from_ts + 1
+    interval = next((name for name in INTERVAL_NAMES if span // INTERVALS[name] <= points), INTERVAL_NAMES[-1])
+    interval_ms = INTERVALS[interval]
+    symbol_id = trade_cache.symbol_lookup.get(symbol.upper())
+    symbol_name = trade_cache.store.symbol_name(symbol_id) if symbol_id is not None else symbol.upper()
+    # Chỉ candles nằm trọn trong [from, to]
+    candles = read_candles(PRODUCTION_CONFIG["candles_dir"], symbol_name, interval, from_ts, to_ts - interval_ms + 1)
+    if not candles:
+        # Chưa có candle rollups cho range: chỉ còn ticks trong cache
+        return ("trades",) + tuple(analytics.load(rows, start, stop))
+    head_stop = bisect_left(stamps, candles[0].open_ts, 0, size)
+    tail_start = bisect_left(stamps, candles[-1].open_ts + interval_ms, 0, size)
+    candle_ts, candle_prices, candle_sizes = candle_points(candles, interval_ms)
+    head = analytics.load(rows, start, head_stop)
+    tail = analytics.load(rows, max(tail_start, start), stop)
+    return (f"candles_{interval}", [*head[0], *candle_ts, *tail[0]], [*head[1], *candle_prices, *tail[1]],
+            [*head[2], *candle_sizes, *tail[2]])
+
+@app.route('/api/series/<symbol>', methods=['GET'])
+@versioned_response
+def get_series(symbol):
+    """Downsampled price/volume series for charts (LTTB or min/max per bucket)"""
+    try:
+        from_ts, to_ts, _ = parse_range_args()
+        points = request.args.get('points', default=PRODUCTION_CONFIG["series_default_points"], type=int)
+        points = max(min(points, PRODUCTION_CONFIG["series_max_points"]), 3)
+        method = request.args.get('method', default='lttb', type=str)
+        if method not in ("lttb", "minmax"):
+            return bad_request("Invalid method, expected one of: lttb, minmax")
+        
+        get_cached_data()
+        if to_ts is None:
+            stats = trade_cache.symbol_stats.get(trade_cache.symbol_lookup.get(symbol.upper()))
+            to_ts = stats.last_ts if stats is not None and stats.last_ts else int(time.time() * 1000)
+        if from_ts is None:
+            from_ts = to_ts - INTERVALS["1d"] + 1
+        if from_ts > to_ts:
+            return bad_request("'from' must not be after 'to'")
+        
+        source, ts, prices, sizes = series_source(symbol, from_ts, to_ts, points)
+        raw_points = len(ts)
+        ts, prices, volumes = analytics.downsample(ts, prices, sizes, points, method)
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"{method} series for {symbol.upper()}",
+            "symbol": symbol.upper(),
+            "from": from_ts,
+            "to": to_ts,
+            "method": method,
+            "source": source,
+            "raw_points": raw_points,
+            "points": len(ts),
+            # volume: khối lượng từ điểm trước đến điểm này
+            "series": {"ts": ts, "price": prices, "volume": volumes},
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in series API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+BATCH_TYPES = ("trades", "stats", "candles", "analytics")
+
+def parse_batch_query(query):
+    """Validate one /api/batch sub-query; raises ValueError"""
+    if not isinstance(query, dict):
+        raise ValueError("expected an object")
+    kind = query.get("type", "trades")
+    if kind not in BATCH_TYPES:
+        raise ValueError(f"invalid type, expected one of: {', '.join(BATCH_TYPES)}")
+    symbol = query.get("symbol")
+    if not isinstance(symbol, str) or not symbol:
+        raise ValueError("'symbol' is required")
+
+    parsed = {"type": kind, "symbol": symbol.upper()}
+    for name in ("from", "to"):
+        value = query.get(name)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(f"invalid '{name}', expected ts in milliseconds")
+        parsed[name] = value
+    limit = query.get("limit", PRODUCTION_CONFIG["default_limit"])
+    if not isinstance(limit, int) or isinstance(limit, bool):
+        raise ValueError("invalid 'limit'")
+    parsed["limit"] = max(min(limit, PRODUCTION_CONFIG["max_records_per_request"]), 1)
+
+    if kind == "trades":
+        cursor = query.get("cursor")
+        try:
+            parsed["cursor"] = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise ValueError("invalid 'cursor'")
+    elif kind == "candles":
+        parsed["interval"] = query.get("interval", "1m")
+        if parsed["interval"] not in INTERVALS:
+            raise ValueError(f"invalid interval, expected one of: {', '.join(INTERVAL_NAMES)}")
+    elif kind == "analytics":
+        window = query.get("window", 20)
+        if not isinstance(window, int) or isinstance(window, bool):
+            raise ValueError("invalid 'window'")
+        parsed["window"] = max(window, 1)
+        parsed["interval"] = query.get("interval")
+        if parsed["interval"] is not None and parsed["interval"] not in INTERVALS:
+            raise ValueError(f"invalid interval, expected one of: {', '.join(INTERVAL_NAMES)}")
+    return parsed
+
+def run_batch_query(query):
+    """Answer one parsed sub-query from the per-symbol index (no full scan); raises ValueError"""
+    kind = query["type"]
+    symbol = query["symbol"]
+    if symbol not in trade_cache.symbol_lookup:
+        raise ValueError(f"unknown symbol '{symbol}'")
+    result = {"status": "success", "type": kind, "symbol": symbol}
+    if kind == "trades":
+        data, next_cursor = symbol_trades(symbol, query["limit"], query["from"], query["to"], query["cursor"])
+        result.update(data=data, total_records=len(data), next_cursor=next_cursor)
+    elif kind == "stats":
+        stats = trade_cache.symbol_stats.get(trade_cache.symbol_lookup.get(symbol))
+        result["stats"] = stats.to_dict() if stats is not None else None
+    elif kind == "candles":
+        _, candles = symbol_candles(symbol, query["interval"], query["from"], query["to"], query["limit"])
+        result.update(interval=query["interval"], data=candles, total_records=len(candles))
+    else:
+        result.update(backend=analytics.backend, window=query["window"], interval=query["interval"],
+                      analytics=symbol_analytics(symbol, query["from"], query["to"],
+                                                 query["window"], query["interval"]))
+    return result
+
+@app.route('/api/batch', methods=['POST'])
+@versioned_response
+def batch_query():
+    """Several symbol sub-queries (trades/stats/candles/analytics) in one request"""
+    try:
+        body = request.get_json(silent=True)
+        queries = body.get("queries") if isinstance(body, dict) else body
+        if not isinstance(queries, list) or not queries:
+            return bad_request("Expected a JSON body {\"queries\": [...]} with at least one query")
+        if len(queries) > PRODUCTION_CONFIG["batch_max_queries"]:
+            return bad_request(f"Too many queries (max {PRODUCTION_CONFIG['batch_max_queries']})")
+        # Mỗi sub-query chỉ là bisect + slice trên index của symbol, không quét toàn bộ cache
+        get_cached_data()
+        version = trade_cache.version
+        
+        def answer(item):
+            i, query = item
+            # Sub-query sai (type, symbol, tham số) chỉ hỏng item của nó, các item khác vẫn trả về
+            try:
+                return run_batch_query(parse_batch_query(query))
+            except ValueError as e:
+                return {"status": "error", "index": i, "message": f"queries[{i}]: {e}"}
+        
+        results = list(batch_executor.map(answer, enumerate(queries)))
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"Batch of {len(results)} queries",
+            "version": version,
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in batch API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+@app.route('/api/book/<symbol>', methods=['GET'])
+def get_order_book(symbol):
+    """Top of the collector's latest persisted order book snapshot"""
+    try:
+        depth = request.args.get('depth', default=PRODUCTION_CONFIG["book_default_depth"], type=int)
+        if depth is None or depth < 1:
+            return bad_request("Invalid 'depth' parameter, expected a positive integer")
+        depth = min(depth, PRODUCTION_CONFIG["book_max_depth"])
+        
+        book = read_book(PRODUCTION_CONFIG["books_dir"], symbol, depth)
+        if book is None:
+            return jsonify({
+                "status": "error",
+                "mode": "production",
+                "message": f"No order book for {symbol.upper()}",
+                "timestamp": datetime.now().isoformat()
+            }), 404
+        ts, seq, bids, asks, saved_at = book
+        
+        best_bid = bids[0] if bids else None
+        best_ask = asks[0] if asks else None
+        spread = best_ask[0] - best_bid[0] if best_bid and best_ask else None
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"Order book for {symbol.upper()}",
+            "symbol": symbol.upper(),
+            "depth": depth,
+            "bids": bids,
+            "asks": asks,
+            "best_bid": best_bid,
+            "best_ask": best_ask,
+            "spread": spread,
+            "mid": (best_ask[0] + best_bid[0]) / 2 if spread is not None else None,
+            "ts": ts,
+            "seq": seq,
+            "snapshot_age_ms": round((time.time() - saved_at) * 1000),
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in order book API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+@app.route('/api/gaps', methods=['GET'])
+def get_gaps():
+    """Intervals with missed trades detected by the collector after reconnects"""
+    try:
+        from_ts, to_ts, _ = parse_range_args()
+        symbol = request.args.get('symbol', type=str)
+        
+        gaps = load_gaps(PRODUCTION_CONFIG["gaps_file"])
+        if symbol:
+            gaps = [gap for gap in gaps if gap["symbol"].upper() == symbol.upper()]
+        if from_ts is not None:
+            gaps = [gap for gap in gaps if gap["to_ts"] >= from_ts]
+        if to_ts is not None:
+            gaps = [gap for gap in gaps if gap["from_ts"] <= to_ts]
+        
+        return jsonify({
+            "status": "success",
+            "mode": "production",
+            "message": f"{len(gaps)} gaps detected",
+            "data": gaps,
+            "total_records": len(gaps),
+            "total_missing_ms": sum(gap["duration_ms"] for gap in gaps),
+            "filters": {
+                "symbol": symbol,
+                "from": from_ts,
+                "to": to_ts
+            },
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in gaps API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_trades():
+    """Stream trade history as compressed CSV, NDJSON or columnar blocks"""
+    try:
+        from_ts, to_ts, _ = parse_range_args()
+        fmt = request.args.get('format', default='ndjson', type=str)
+        compression = request.args.get('compression', default='gzip', type=str)
+        symbols = request.args.get('symbol', type=str)
+        symbol_filter = {s.strip().upper() for s in symbols.split(',') if s.strip()} if symbols else None
+        if fmt not in FORMATS:
+            return bad_request(f"Invalid format, expected one of: {', '.join(FORMATS)}")
+        if compression not in COMPRESSIONS:
+            return bad_request(f"Invalid compression, expected one of: {', '.join(COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            return bad_request("zstd compression is not available on this server")
+        
+        def chunks():
+            return exporter.stream(fmt, compression, symbol_filter, from_ts, to_ts)
+        
+        extension, mimetype = FORMATS[fmt]
+        suffix, compressed_mimetype = COMPRESSIONS[compression]
+        filename = f"trades_{'_'.join(sorted(symbol_filter)) if symbol_filter else 'all'}_{from_ts or 0}_{to_ts or 'now'}.{extension}{suffix}"
+        headers = {
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Accept-Ranges": "none"
+        }
+        
+        # Byte ranges chỉ cho range đóng, đã qua: output khi đó chỉ phụ thuộc vào các files chứa nó,
+        # ETag (fingerprint của các files) + If-Range phát hiện retention đã chuyển chúng đi
+        settled_ms = (time.time() - PRODUCTION_CONFIG["export_settle_seconds"]) * 1000
+        if to_ts is not None and to_ts < settled_ms:
+            def source_etag():
+                return f'"{exporter.source_tag(symbol_filter, from_ts, to_ts)}-{fmt}-{compression}"'
+            etag = source_etag()
+            headers["Accept-Ranges"] = "bytes"
+            headers["ETag"] = etag
+            byte_range = request.range
+            if_range = request.headers.get("If-Range")
+            if byte_range is not None and len(byte_range.ranges) == 1 and if_range in (None, etag):
+                # Encode một lần vào spool file ở background (dùng lại cho các lần resume sau): biết
+                # tổng độ dài rồi gửi đúng đoạn được yêu cầu; chưa xong thì 503 để client thử lại
+                spool_key = (sorted(symbol_filter) if symbol_filter else None, from_ts, to_ts, fmt, compression)
+                spooled = export_spool.open(spool_key, etag, chunks, valid=lambda: source_etag() == etag,
+                                            wait=PRODUCTION_CONFIG["export_spool_wait"])
+                if spooled is None:
+                    return jsonify({
+                        "status": "error",
+                        "mode": "production",
+                        "message": "Export is being prepared, retry",
+                        "timestamp": datetime.now().isoformat()
+                    }), 503, {"Retry-After": str(PRODUCTION_CONFIG["export_spool_retry_after"])}
+                spooled, total = spooled
+                span = byte_range.range_for_length(total)
+                if span is None:
+                    spooled.close()
+                    return Response(status=416, headers={"Content-Range": f"bytes */{total}", "ETag": etag})
+                start, stop = span
+                headers["Content-Range"] = f"bytes {start}-{stop - 1}/{total}"
+                headers["Content-Length"] = str(stop - start)
+                return Response(read_range(spooled, start, stop), status=206,
+                                mimetype=compressed_mimetype or mimetype, headers=headers)
+        
+        return Response(stream_with_context(chunks()), mimetype=compressed_mimetype or mimetype, headers=headers)
+        
+    except ValueError as e:
+        return bad_request(str(e))
+    except Exception as e:
+        logger.error(f"Error in export API: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Internal server error"
+        }), 500
+
+def stream_symbols(symbols):
+    """Symbol filter of a stream request ('BTCUSDT,ETHUSDT'); None = every symbol"""
+    return {s.strip().upper() for s in symbols.split(',') if s.strip()} if symbols else None
+
+def stream_events(batch, dropped=0):
+    """SSE text for one wake-up: dropped notice, then the trades or a heartbeat"""
+    # Client chậm: báo số trades đã bị bỏ qua
+    events = f"event: dropped\ndata: {dropped}\n\n" if dropped else ""
+    if batch:
+        return events + "".join(f"event: trade\ndata: {codec.dumps(record).decode('utf-8')}\n\n" for record in batch)
+    return events + ": heartbeat\n\n"
+
+@app.route('/api/stream', methods=['GET'])
+def stream_trades():
+    """Push new trades to the client as Server-Sent Events"""
+    symbol_filter = stream_symbols(request.args.get('symbol', type=str))
+    
+    subscription = trade_stream.subscribe(symbol_filter, PRODUCTION_CONFIG["stream_queue_size"])
+    if subscription is None:
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Too many streaming clients, try again later",
+            "timestamp": datetime.now().isoformat()
+        }), 503
+    
+    def generate():
+        reported_drops = 0
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                batch = subscription.get_batch(PRODUCTION_CONFIG["stream_heartbeat"])
+                dropped = subscription.dropped - reported_drops
+                reported_drops += dropped
+                yield stream_events(batch, dropped)
+        finally:
+            trade_stream.unsubscribe(subscription)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text format: this worker live, other workers from their snapshots"""
+    try:
+        return Response(worker_metrics.render(), content_type=metrics.CONTENT_TYPE)
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {e}")
+        return jsonify({
+            "status": "error",
+            "mode": "production",
+            "message": "Failed to render metrics",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -366,6 +1251,16 @@ def not_found(error):
             "/api/trading/latest", 
             "/api/trading/symbol/<symbol>",
             "/api/trading/stats",
+            "/api/trading/large",
+            "/api/candles/<symbol>",
+            "/api/analytics/<symbol>",
+            "/api/series/<symbol>",
+            "/api/batch",
+            "/api/stream",
+            "/api/book/<symbol>",
+            "/api/gaps",
+            "/api/export",
+            "/metrics",
             "/api/health",
             "/api/info"
         ]
@@ -383,6 +1278,8 @@ def internal_error(error):
 def cleanup():
     """Cleanup on shutdown"""
     logger.info("Shutting down production API server...")
+    trade_cache.stop()
+    trade_stream.stop()
 
 def signal_handler(sig, frame):
     """Handle shutdown signals"""
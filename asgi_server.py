@@ -0,0 +1,216 @@
+import asyncio
+import io
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+try:
+    import uvicorn
+except ImportError:  # Chỉ cần khi chạy trực tiếp (python asgi_server.py)
+    uvicorn = None
+
+import api_server
+from api_server import PRODUCTION_CONFIG, trade_cache, trade_stream, worker_metrics
+from analytics import preload as preload_analytics
+
+logger = logging.getLogger(__name__)
+
+# SSE clients ở đây là coroutines, không giữ thread của pool: không cần giới hạn theo số threads
+trade_stream.max_subscribers = PRODUCTION_CONFIG["asgi_stream_max_subscribers"]
+
+
+def build_environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiServer:
+    """ASGI front end for the API (``uvicorn asgi_server:app``).
+
+    Regular routes run the unchanged Flask app on a thread pool, so cache
+    loading, file reads and serialization never block the event loop and
+    every route stays defined once in api_server.py. /api/stream is served
+    natively: each SSE client is a coroutine woken by the trade stream
+    reader, so idle streams hold no threads.
+    """
+
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            if scope["path"] == "/api/stream" and scope["method"] == "GET":
+                if await self.stream(scope, receive, send):
+                    return
+            await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Load cache ở background: worker nhận requests ngay (health trả về "starting")
+                trade_cache.ensure_started(wait=False)
+                preload_analytics()
+                worker_metrics.ensure_started()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                api_server.cleanup()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _run_wsgi(self, environ, send, loop):
+        """Worker thread: call the Flask app, send its body and close it in one job.
+
+        Flask's stream_with_context pops the request context it pushed in
+        wsgi_app(), so calling, iterating and closing must share one
+        thread's contextvars.
+        """
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(" ", 1)[0]),
+                          [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]]
+            return lambda data: None
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            status, headers = started
+            if any(name == b"content-length" for name, _ in headers):
+                content = b"".join(result)
+                emit({"type": "http.response.start", "status": status, "headers": headers})
+                emit({"type": "http.response.body", "body": content})
+                return
+            # Streaming (export, ...): gửi từng chunk, chờ client nhận xong
+            emit({"type": "http.response.start", "status": status, "headers": headers})
+            for chunk in result:
+                if chunk:
+                    emit({"type": "http.response.body", "body": chunk, "more_body": True})
+            emit({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    async def call_wsgi(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self._run_wsgi, build_environ(scope, bytes(body)), send, loop)
+        except OSError:
+            pass  # client đóng connection giữa chừng
+
+    async def stream(self, scope, receive, send):
+        """Native SSE; False when at capacity so the Flask route answers (503)"""
+        started = time.perf_counter()
+        symbols = parse_qs(scope["query_string"].decode("latin-1")).get("symbol", [None])[0]
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # event loop đã dừng
+
+        subscription = trade_stream.subscribe(api_server.stream_symbols(symbols),
+                                              PRODUCTION_CONFIG["stream_queue_size"], notify)
+        if subscription is None:
+            return False
+
+        headers = [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"),
+                   (b"x-accel-buffering", b"no")]
+        if PRODUCTION_CONFIG["enable_cors"]:
+            headers += [(b"access-control-allow-origin", b"*"),
+                        (b"access-control-allow-headers", b"Content-Type,Authorization"),
+                        (b"access-control-allow-methods", b"GET,POST,OPTIONS")]
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            api_server.REQUESTS.labels("/api/stream", "200").inc()
+            api_server.REQUEST_SECONDS.labels("/api/stream").observe(time.perf_counter() - started)
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+
+            reported_drops = 0
+            while not disconnected.done():
+                wake.clear()
+                batch = subscription.get_batch(0)
+                if not batch:
+                    waiter = asyncio.ensure_future(wake.wait())
+                    await asyncio.wait({waiter, disconnected}, timeout=PRODUCTION_CONFIG["stream_heartbeat"],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    if disconnected.done():
+                        break
+                    batch = subscription.get_batch(0)
+                dropped = subscription.dropped - reported_drops
+                reported_drops += dropped
+                await send({"type": "http.response.body", "more_body": True,
+                            "body": api_server.stream_events(batch, dropped).encode("utf-8")})
+        except OSError:
+            pass  # client đóng connection
+        finally:
+            disconnected.cancel()
+            trade_stream.unsubscribe(subscription)
+        return True
+
+    async def _wait_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+app = AsgiServer(api_server.app, PRODUCTION_CONFIG["asgi_threads"])
+
+if __name__ == '__main__':
+    if uvicorn is None:
+        sys.exit("uvicorn package is required for ASGI mode (pip install uvicorn)")
+    logger.info("Starting ASGI API server on 0.0.0.0:5000...")
+    uvicorn.run("asgi_server:app", host="0.0.0.0", port=5000, workers=4, log_level="info")
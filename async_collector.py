@@ -0,0 +1,169 @@
+import asyncio
+import json
+import random
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import websockets
+except ImportError:  # Chỉ cần cho async mode
+    websockets = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RECONNECTS = metrics.counter("collector_reconnects_total", "WebSocket reconnects", ("shard",))
+
+
+class SubscriptionLimiter:
+    """Token bucket shared by all connections (subscribe messages per second)"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncBitgetCollector:
+    """Asyncio front end for BitgetDataCollectorProduction.
+
+    Symbols are spread over ``connections`` WebSocket connections. Each
+    connection subscribes in batches (rate limited), reconnects on its own
+    with jittered exponential backoff, and pushes raw messages into a
+    bounded queue. A single consumer drains the queue in batches and hands
+    them to the collector on a worker thread, so disk work never runs on
+    the event loop and a full queue slows the readers down instead of
+    growing memory.
+    """
+
+    def __init__(self, collector, connections=4, subscribe_batch=10, subscribe_rate=5.0,
+                 queue_size=10000, drain_batch=500, max_backoff=60.0):
+        if websockets is None:
+            raise RuntimeError("websockets package is required for async mode (pip install websockets)")
+        self.collector = collector
+        self.connections = max(1, min(connections, len(collector.symbols)))
+        self.subscribe_batch = subscribe_batch
+        self.subscribe_rate = subscribe_rate
+        self.queue_size = queue_size
+        self.drain_batch = drain_batch
+        self.max_backoff = max_backoff
+
+        self.queue = None
+        self.limiter = None
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collector-ingest")
+        self.sockets = {}
+        self.reconnects = [0] * self.connections
+
+    def shards(self):
+        """Round-robin split of the symbol list across connections"""
+        symbols = self.collector.symbols
+        return [symbols[i::self.connections] for i in range(self.connections)]
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.limiter = SubscriptionLimiter(self.subscribe_rate)
+        tasks = [asyncio.create_task(self._consume(), name="consumer")]
+        for shard_id, symbols in enumerate(self.shards()):
+            tasks.append(asyncio.create_task(self._connection(shard_id, symbols), name=f"shard-{shard_id}"))
+        logger.info(f"[PRODUCTION] Async collector: {self.connections} connections, "
+                    f"{len(self.collector.symbols)} symbols")
+        try:
+            while self.collector.is_running:
+                await asyncio.sleep(0.5)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True)
+
+    async def _connection(self, shard_id, symbols):
+        attempt = 0
+        while self.collector.is_running:
+            try:
+                async with websockets.connect(self.collector.ws_url, ping_interval=30, ping_timeout=10,
+                                              max_queue=1024) as ws:
+                    self.sockets[shard_id] = ws
+                    attempt = 0
+                    logger.info(f"[PRODUCTION] Shard {shard_id} connected ({len(symbols)} symbols)")
+                    self.collector.guard.expect_resync(symbols)
+                    await self._subscribe(ws, symbols)
+                    async for message in ws:
+                        # Queue đầy -> chờ (backpressure) thay vì tăng bộ nhớ
+                        await self.queue.put(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Shard {shard_id} connection error: {e}")
+            finally:
+                self.sockets.pop(shard_id, None)
+
+            if not self.collector.is_running:
+                break
+            attempt += 1
+            self.reconnects[shard_id] += 1
+            RECONNECTS.labels(str(shard_id)).inc()
+            delay = min(self.max_backoff, 2 ** min(attempt, 6)) * random.uniform(0.5, 1.0)
+            logger.info(f"Shard {shard_id} reconnecting in {delay:.1f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def _subscribe(self, ws, symbols):
+        """Send batched subscribe messages within the shared rate limit"""
+        for i in range(0, len(symbols), self.subscribe_batch):
+            await self.limiter.acquire()
+            batch = symbols[i:i + self.subscribe_batch]
+            await ws.send(json.dumps({
+                "op": "subscribe",
+                "args": self.collector.subscription_args(batch)
+            }))
+
+    def resubscribe(self, symbol, channel):
+        """Unsubscribe + subscribe one channel (called from the ingest thread)"""
+        for shard_id, symbols in enumerate(self.shards()):
+            ws = self.sockets.get(shard_id)
+            if symbol in symbols and ws is not None and self.loop is not None:
+                asyncio.run_coroutine_threadsafe(self._resubscribe(ws, symbol, channel), self.loop)
+                return
+
+    async def _resubscribe(self, ws, symbol, channel):
+        arg = {"instType": "SPOT", "channel": channel, "instId": symbol}
+        try:
+            await ws.send(json.dumps({"op": "unsubscribe", "args": [arg]}))
+            await self.limiter.acquire()
+            await ws.send(json.dumps({"op": "subscribe", "args": [arg]}))
+        except Exception as e:
+            logger.warning(f"Resubscribe {channel} {symbol} failed: {e}")
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            messages = [await self.queue.get()]
+            while len(messages) < self.drain_batch:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await loop.run_in_executor(self.executor, self._process, messages)
+
+    def _process(self, messages):
+        for message in messages:
+            self.collector.handle_message(message)
+
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
@@ -0,0 +1,497 @@
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from column_store import read_header
+from mock_bitget_server import RESULT_PREFIX as MOCK_RESULT_PREFIX, replay_symbols, synthetic_symbols
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTOR_RESULT_PREFIX = "COLLECTOR_RESULT "
+
+DEFAULT_ENDPOINTS = [
+    "/api/trading/latest?limit=100",
+    "/api/trading/stats",
+    "/api/trading/symbol/BTCUSDT?limit=100",
+    "/api/candles/BTCUSDT?interval=1m&limit=60",
+    "/api/analytics/BTCUSDT?interval=1m",
+]
+
+# Metrics compared against a baseline: name -> True if higher is better
+TRACKED = {
+    "ingest.trades_per_s": True,
+    "latency_ms.p50": False,
+    "latency_ms.p99": False,
+    "persistence.max_flush_ms": False,
+    "api.p50_ms": False,
+    "api.p99_ms": False,
+    "api.requests_per_s": True,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))], 3)
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def read_result(output, prefix):
+    for line in reversed(output.splitlines()):
+        if line.startswith(prefix):
+            return json.loads(line[len(prefix):])
+    return None
+
+
+def run_collector(args):
+    """Child process: run the real collector against the mock for ``duration`` seconds"""
+    import data_collector
+
+    collector = data_collector.BitgetDataCollectorProduction()
+    collector.ws_url = args.ws_url
+    collector.symbols = args.symbol_list.split(",") if args.symbol_list else synthetic_symbols(args.symbols)
+    collector.metrics_interval = 5
+    started = time.perf_counter()
+    # Benchmark dừng collector bằng SIGTERM sau khi mock đã dừng gửi; duration chỉ là giới hạn an toàn
+    signal.signal(signal.SIGTERM, lambda sig, frame: threading.Thread(target=collector.stop).start())
+    stopper = threading.Timer(args.duration, collector.stop)
+    stopper.daemon = True
+    stopper.start()
+    collector.start(mode=args.mode, connections=args.connections)
+    stopper.cancel()
+    print(COLLECTOR_RESULT_PREFIX + json.dumps({
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "persisted": collector.column_store.count,
+        "duplicates": collector.guard.duplicates(),
+        "book_resyncs": collector.books.resyncs,
+        "books": len(collector.books.books),
+        "writer": collector.writer.metrics()
+    }), flush=True)
+
+
+class ApiLoad:
+    """Concurrent keep-alive HTTP clients hitting a list of endpoints"""
+
+    def __init__(self, port, endpoints, clients):
+        self.port = port
+        self.endpoints = endpoints
+        self.clients = clients
+        self.timings = {endpoint: [] for endpoint in endpoints}
+        self.errors = 0
+        self.running = False
+        self.threads = []
+        self.started = None
+        self.stopped = None
+
+    def _client(self, offset):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        i = offset
+        while self.running:
+            endpoint = self.endpoints[i % len(self.endpoints)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request("GET", endpoint)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    self.errors += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+                continue
+            self.timings[endpoint].append((time.perf_counter() - started) * 1000)
+        conn.close()
+
+    def start(self):
+        self.running = True
+        self.started = time.perf_counter()
+        self.threads = [threading.Thread(target=self._client, args=(i,), daemon=True) for i in range(self.clients)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=15)
+        self.stopped = time.perf_counter()
+
+    def report(self):
+        everything = [t for timings in self.timings.values() for t in timings]
+        elapsed = (self.stopped or time.perf_counter()) - self.started
+        return {
+            "clients": self.clients,
+            "requests": len(everything),
+            "errors": self.errors,
+            "requests_per_s": round(len(everything) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": percentile(everything, 50),
+            "p99_ms": percentile(everything, 99),
+            "endpoints": {
+                endpoint: {
+                    "requests": len(timings),
+                    "p50_ms": percentile(timings, 50),
+                    "p99_ms": percentile(timings, 99)
+                } for endpoint, timings in self.timings.items()
+            }
+        }
+
+
+class StreamLoad:
+    """Idle-heavy SSE clients held open during the run (they occupy server threads on gunicorn)"""
+
+    def __init__(self, port, clients):
+        self.port = port
+        self.clients = clients
+        self.connected = 0
+        self.events = 0
+        self.errors = 0
+        self.running = False
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _client(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request("GET", "/api/stream")
+            response = conn.getresponse()
+            if response.status != 200:
+                raise http.client.HTTPException(f"status {response.status}")
+            with self.lock:
+                self.connected += 1
+            while self.running:
+                try:
+                    line = response.fp.readline()
+                except socket.timeout:
+                    continue
+                if not line:
+                    break
+                if line.startswith(b"event: trade"):
+                    with self.lock:
+                        self.events += 1
+        except (OSError, http.client.HTTPException):
+            with self.lock:
+                self.errors += 1
+        finally:
+            conn.close()
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._client, daemon=True) for _ in range(self.clients)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=10)
+
+    def report(self):
+        return {"clients": self.clients, "connected": self.connected, "events": self.events, "errors": self.errors}
+
+
+def sample_latency(port, samples, running, interval=0.1):
+    """Age of the newest trade visible through the API (exchange ts -> visible)"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    while running.is_set():
+        try:
+            conn.request("GET", "/api/trading/latest?limit=1")
+            body = json.loads(conn.getresponse().read())
+            data = body.get("data") or []
+            if data:
+                # Records giữ format gốc: {"timestamp", "symbol", "data": {..., "ts"}}
+                samples.append(time.time() * 1000 - int(data[-1]["data"]["ts"]))
+        except (OSError, ValueError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        time.sleep(interval)
+    conn.close()
+
+
+def sample_ingest(columns_dir, counts, running, interval=1.0):
+    while running.is_set():
+        try:
+            counts.append((time.perf_counter(), read_header(columns_dir)))
+        except ValueError:
+            pass
+        time.sleep(interval)
+
+
+def wait_for_http(port, path="/api/health", timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def api_command(port, server, workers):
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                "--worker-class", "gthread", "--threads", os.environ.get("API_THREADS", "32"), "--log-level", "warning", "api_server:app"]
+    if server == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+                "--log-level", "warning", "--no-access-log", "asgi_server:app"]
+    return [sys.executable, "-c",
+            f"import api_server; api_server.app.run(host='127.0.0.1', port={port}, threaded=True, use_reloader=False)"]
+
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    ws_port, api_port = free_port(), free_port()
+    log = open(os.path.join(workdir, "benchmark_processes.log"), "w")
+    processes = []
+
+    def spawn(command, capture=False):
+        process = subprocess.Popen(command, cwd=workdir, env=env, text=True,
+                                   stdout=subprocess.PIPE if capture else log, stderr=log)
+        processes.append(process)
+        return process
+
+    print(f"Benchmark workdir: {workdir}")
+    try:
+        return measure(args, workdir, spawn, ws_port, api_port)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        log.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure(args, workdir, spawn, ws_port, api_port):
+    mock_command = [sys.executable, os.path.join(REPO_DIR, "mock_bitget_server.py"), "--port", str(ws_port),
+                    "--rate", str(args.rate), "--trades-per-msg", str(args.trades_per_msg),
+                    "--book-rate", str(args.book_rate)]
+    if args.replay:
+        mock_command += ["--replay", os.path.abspath(args.replay), "--speed", str(args.speed)]
+    mock = spawn(mock_command, capture=True)
+    time.sleep(1.0)
+
+    collector_command = [sys.executable, os.path.join(REPO_DIR, "benchmark.py"), "_collector",
+                         "--ws-url", f"ws://127.0.0.1:{ws_port}", "--symbols", str(args.symbols),
+                         "--connections", str(args.connections), "--mode", args.mode,
+                         "--duration", str(args.warmup + args.duration + 60)]
+    if args.replay:
+        collector_command += ["--symbol-list", ",".join(replay_symbols(args.replay))]
+    collector = spawn(collector_command, capture=True)
+    api = spawn(api_command(api_port, args.server, args.workers))
+    if not wait_for_http(api_port):
+        raise RuntimeError("API server did not start, see benchmark_processes.log")
+
+    running = threading.Event()
+    running.set()
+    latency, counts = [], []
+    samplers = [
+        threading.Thread(target=sample_latency, args=(api_port, latency, running), daemon=True),
+        threading.Thread(target=sample_ingest, args=(os.path.join(workdir, "trade_columns"), counts, running), daemon=True),
+    ]
+    time.sleep(args.warmup)
+    streams = StreamLoad(api_port, args.stream_clients)
+    streams.start()
+    for thread in samplers:
+        thread.start()
+    load = ApiLoad(api_port, args.endpoints or DEFAULT_ENDPOINTS, args.clients)
+    load.start()
+    time.sleep(args.duration)
+    load.stop()
+    streams.stop()
+    running.clear()
+
+    # Dừng exchange trước, chờ collector ghi nốt rồi mới dừng collector
+    mock.send_signal(signal.SIGINT)
+    mock_out, _ = mock.communicate(timeout=30)
+    time.sleep(2.0)
+    collector.send_signal(signal.SIGTERM)
+    collector_out, _ = collector.communicate(timeout=120)
+    api.terminate()
+    api.wait(timeout=30)
+
+    collector_result = read_result(collector_out, COLLECTOR_RESULT_PREFIX) or {}
+    mock_result = read_result(mock_out, MOCK_RESULT_PREFIX) or {}
+    rates = [(c2 - c1) / (t2 - t1) for (t1, c1), (t2, c2) in zip(counts, counts[1:]) if t2 > t1]
+    persisted = collector_result.get("persisted", 0)
+    writer = collector_result.get("writer", {})
+    sizes = {name: dir_size(os.path.join(workdir, name))
+             for name in ("trade_log", "trade_columns", "candles")}
+
+    report = {
+        "config": {
+            "rate": args.rate, "trades_per_msg": args.trades_per_msg, "symbols": args.symbols,
+            "connections": args.connections, "mode": args.mode, "replay": args.replay,
+            "duration_s": args.duration, "server": args.server, "workers": args.workers,
+            "stream_clients": args.stream_clients, "book_rate": args.book_rate
+        },
+        "exchange": mock_result,
+        "ingest": {
+            "persisted": persisted,
+            "duplicates": collector_result.get("duplicates"),
+            "dropped": writer.get("dropped"),
+            "trades_per_s": round(sum(rates) / len(rates), 1) if rates else 0.0,
+            "peak_trades_per_s": round(max(rates), 1) if rates else 0.0,
+            "loss": (mock_result.get("sent_trades", 0) - persisted) if mock_result else None
+        },
+        "latency_ms": {
+            "samples": len(latency),
+            "p50": percentile(latency, 50),
+            "p99": percentile(latency, 99),
+            "max": round(max(latency), 3) if latency else None
+        },
+        "persistence": {
+            "flushes": writer.get("flushes"),
+            "last_flush_ms": writer.get("last_flush_ms"),
+            "max_flush_ms": writer.get("max_flush_ms"),
+            "max_queue_depth": writer.get("max_queue_depth"),
+            "blocked": writer.get("blocked"),
+            "bytes": sizes,
+            "bytes_per_trade": round(sum(sizes.values()) / persisted, 1) if persisted else None
+        },
+        "books": {
+            "deltas_per_s": args.book_rate,
+            "sent_messages": mock_result.get("sent_book_messages"),
+            "books": collector_result.get("books"),
+            "resyncs": collector_result.get("book_resyncs")
+        },
+        "api": load.report(),
+        "streams": streams.report()
+    }
+    return report
+
+
+def flatten(report, name):
+    value = report
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report, baseline, tolerance):
+    """Print tracked metrics against a baseline; returns the number of regressions"""
+    regressions = 0
+    print(f"\n{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, higher_is_better in TRACKED.items():
+        old, new = flatten(baseline, name), flatten(report, name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressions += bool(flag)
+        print(f"{name:<28}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def print_report(report):
+    ingest, latency, persistence, api = report["ingest"], report["latency_ms"], report["persistence"], report["api"]
+    print("\n=== Benchmark ===")
+    print(f"Exchange sent:  {report['exchange'].get('sent_trades')} trades "
+          f"({report['exchange'].get('msgs_per_s')} msgs/s)")
+    print(f"Ingest:         {ingest['trades_per_s']} trades/s avg, {ingest['peak_trades_per_s']} peak, "
+          f"{ingest['persisted']} persisted, {ingest['dropped']} dropped, {ingest['duplicates']} duplicates")
+    print(f"E2E latency:    p50 {latency['p50']} ms, p99 {latency['p99']} ms, max {latency['max']} ms "
+          f"({latency['samples']} samples)")
+    books = report.get("books") or {}
+    if books.get("deltas_per_s"):
+        print(f"Order books:    {books['sent_messages']} msgs sent ({books['deltas_per_s']:g} deltas/s), "
+              f"{books['books']} books, {books['resyncs']} checksum resyncs")
+    else:
+        print("Order books:    off (--book-rate 0: mock only acks the books channel, no book ingest measured)")
+    print(f"Persistence:    max flush {persistence['max_flush_ms']} ms, max queue {persistence['max_queue_depth']}, "
+          f"{persistence['bytes_per_trade']} bytes/trade on disk")
+    print(f"API:            {api['requests_per_s']} req/s, p50 {api['p50_ms']} ms, p99 {api['p99_ms']} ms, "
+          f"{api['errors']} errors ({api['clients']} clients)")
+    for endpoint, stats in api["endpoints"].items():
+        print(f"  {endpoint:<45} p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms ({stats['requests']} req)")
+    streams = report.get("streams") or {}
+    if streams.get("clients"):
+        print(f"SSE streams:    {streams['connected']}/{streams['clients']} connected, "
+              f"{streams['events']} trade events, {streams['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark: mock exchange -> collector -> API")
+    sub = parser.add_subparsers(dest="command")
+
+    child = sub.add_parser("_collector", help=argparse.SUPPRESS)
+    child.add_argument("--ws-url", required=True)
+    child.add_argument("--symbols", type=int, default=10)
+    child.add_argument("--symbol-list")
+    child.add_argument("--connections", type=int, default=4)
+    child.add_argument("--mode", default="async")
+    child.add_argument("--duration", type=float, default=30)
+
+    parser.add_argument("--rate", type=float, default=5000, help="Exchange messages per second")
+    parser.add_argument("--trades-per-msg", type=int, default=1)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--mode", choices=["async", "thread"], default="async")
+    parser.add_argument("--replay", help="Replay an NDJSON(.gz) export instead of synthetic trades")
+    parser.add_argument("--speed", type=float, default=10.0, help="Replay speed (multiple of real time)")
+    parser.add_argument("--book-rate", type=float, default=200,
+                        help="Order book deltas per second sent by the mock (0 = books only acked)")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent API clients")
+    parser.add_argument("--endpoints", nargs="*", help="API paths to load (default: hot read endpoints)")
+    parser.add_argument("--stream-clients", type=int, default=0, help="SSE clients held open during the run")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn", "flask"],
+                        default="gunicorn" if shutil.which("gunicorn") else "flask")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--workdir", help="Data directory (default: temporary, removed afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the data directory")
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --json report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    if args.command == "_collector":
+        run_collector(args)
+        return
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import mmap
+import os
+import struct
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Interval name -> length in ms. Each interval is rolled up from the previous one.
+INTERVALS = {
+    "1m": 60 * 1000,
+    "5m": 5 * 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "4h": 4 * 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+INTERVAL_NAMES = list(INTERVALS)
+
+# open_ts, open, high, low, close, volume, quote_volume, trades
+CANDLE_FORMAT = "<qddddddq"
+CANDLE_SIZE = struct.calcsize(CANDLE_FORMAT)
+
+
+def bucket_start(ts, interval_ms):
+    return ts - ts % interval_ms
+
+
+def candle_path(candles_dir, symbol, interval):
+    return os.path.join(candles_dir, f"{symbol}_{interval}.bin")
+
+
+class Candle:
+    """OHLCV candle, updated in place as trades or finer candles arrive"""
+
+    __slots__ = ("open_ts", "open", "high", "low", "close", "volume", "quote_volume", "trades")
+
+    def __init__(self, open_ts, price=None):
+        self.open_ts = open_ts
+        self.open = price
+        self.high = price
+        self.low = price
+        self.close = price
+        self.volume = 0.0
+        self.quote_volume = 0.0
+        self.trades = 0
+
+    def add_trade(self, price, size):
+        if self.open is None:
+            self.open = self.high = self.low = price
+        elif price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += size
+        self.quote_volume += price * size
+        self.trades += 1
+
+    def merge(self, other):
+        """Fold a later, finer candle into this one"""
+        if other.open is None:
+            return
+        if self.open is None:
+            self.open, self.high, self.low = other.open, other.high, other.low
+        else:
+            self.high = max(self.high, other.high)
+            self.low = min(self.low, other.low)
+        self.close = other.close
+        self.volume += other.volume
+        self.quote_volume += other.quote_volume
+        self.trades += other.trades
+
+    def pack(self):
+        return struct.pack(CANDLE_FORMAT, self.open_ts, self.open, self.high, self.low,
+                           self.close, self.volume, self.quote_volume, self.trades)
+
+    @classmethod
+    def unpack(cls, raw, offset=0):
+        candle = cls(0)
+        (candle.open_ts, candle.open, candle.high, candle.low, candle.close,
+         candle.volume, candle.quote_volume, candle.trades) = struct.unpack_from(CANDLE_FORMAT, raw, offset)
+        return candle
+
+    def to_dict(self, closed=True):
+        return {
+            "open_time": self.open_ts,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "quote_volume": self.quote_volume,
+            "trades": self.trades,
+            "closed": closed
+        }
+
+
+def read_candles(candles_dir, symbol, interval, from_ts=None, to_ts=None, limit=None):
+    """Read closed candles with from_ts <= open_ts <= to_ts.
+
+    Candle files are fixed-width and sorted by open_ts, so the range is
+    located by bisecting the memory-mapped file. With ``limit`` the newest
+    candles in the range are returned.
+    """
+    path = candle_path(candles_dir, symbol, interval)
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            count = size // CANDLE_SIZE
+            if count == 0:
+                return []
+            mm = mmap.mmap(f.fileno(), count * CANDLE_SIZE, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return []
+
+    try:
+        open_times = OpenTimes(mm, count)
+        start = bisect_left(open_times, from_ts) if from_ts is not None else 0
+        stop = bisect_left(open_times, to_ts + 1) if to_ts is not None else count
+        if limit is not None and stop - start > limit:
+            start = stop - limit
+        return [Candle.unpack(mm, i * CANDLE_SIZE) for i in range(start, stop)]
+    finally:
+        mm.close()
+
+
+def candle_points(candles, interval_ms):
+    """Stand-in ticks (ts, price, size lists) for chart downsampling from candles.
+
+    Each candle becomes open, low/high (high first on a down candle) and
+    close spread over its interval, with the whole volume on the close.
+    """
+    ts, prices, sizes = [], [], []
+    for candle in candles:
+        start = candle.open_ts
+        middle = (candle.low, candle.high) if candle.close >= candle.open else (candle.high, candle.low)
+        ts.extend((start, start + interval_ms // 3, start + 2 * interval_ms // 3, start + interval_ms - 1))
+        prices.extend((candle.open, middle[0], middle[1], candle.close))
+        sizes.extend((0.0, 0.0, 0.0, candle.volume))
+    return ts, prices, sizes
+
+
+class OpenTimes:
+    """Sequence of open_ts values of a candle file, for bisect"""
+
+    def __init__(self, raw, count):
+        self.raw = raw
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<q", self.raw, i * CANDLE_SIZE)[0]
+
+
+class CandleAggregator:
+    """Streaming OHLCV aggregator (data collector side).
+
+    Trades update the open 1m candle. When a candle closes it is appended
+    to its file and folded into the next coarser interval, so 5m..1d
+    candles are built from finer candles, never from raw ticks.
+    """
+
+    def __init__(self, candles_dir):
+        self.candles_dir = candles_dir
+        self.open_candles = {}   # (symbol, interval) -> Candle
+        self.files = {}
+
+    def _file(self, symbol, interval):
+        key = (symbol, interval)
+        f = self.files.get(key)
+        if f is None:
+            f = self.files[key] = open(candle_path(self.candles_dir, symbol, interval), 'ab')
+            size = f.tell()
+            if size % CANDLE_SIZE:
+                # Bỏ record ghi dở do crash
+                f.truncate(size - size % CANDLE_SIZE)
+                f.seek(0, os.SEEK_END)
+        return f
+
+    def restore(self, symbols):
+        """Rebuild open coarse candles from persisted finer candles.
+
+        Complete buckets missing from a coarser file (e.g. after a crash)
+        are written out as well.
+        """
+        os.makedirs(self.candles_dir, exist_ok=True)
+        for symbol in symbols:
+            for level in range(1, len(INTERVAL_NAMES)):
+                interval = INTERVAL_NAMES[level]
+                interval_ms = INTERVALS[interval]
+                last = read_candles(self.candles_dir, symbol, interval, limit=1)
+                resume_from = last[0].open_ts + interval_ms if last else None
+                finer = read_candles(self.candles_dir, symbol, INTERVAL_NAMES[level - 1], from_ts=resume_from)
+                for candle in finer:
+                    self._roll_up(symbol, level, candle, cascade=False)
+                self.flush()
+
+    def last_closed_end(self, symbol):
+        """End of the newest persisted 1m candle (trades before it are counted)"""
+        last = read_candles(self.candles_dir, symbol, "1m", limit=1)
+        return last[0].open_ts + INTERVALS["1m"] if last else 0
+
+    def add_trade(self, symbol, ts, price, size):
+        key = (symbol, "1m")
+        candle = self.open_candles.get(key)
+        start = bucket_start(ts, INTERVALS["1m"])
+        if candle is None:
+            candle = self.open_candles[key] = Candle(start)
+        elif start > candle.open_ts:
+            self._close(symbol, 0, candle)
+            self._advance(symbol, start)
+            candle = self.open_candles[key] = Candle(start)
+        # Trade đến trễ (start < open_ts) được tính vào candle đang mở
+        candle.add_trade(price, size)
+
+    def _advance(self, symbol, ts):
+        """Close coarser candles whose bucket ended before ``ts``.
+
+        Without this a 1d candle would only close once the first 4h candle
+        of the next day closes.
+        """
+        for level in range(1, len(INTERVAL_NAMES)):
+            interval = INTERVAL_NAMES[level]
+            candle = self.open_candles.get((symbol, interval))
+            if candle is not None and bucket_start(ts, INTERVALS[interval]) > candle.open_ts:
+                del self.open_candles[(symbol, interval)]
+                self._close(symbol, level, candle)
+
+    def _close(self, symbol, level, candle, cascade=True):
+        """Persist a closed candle and fold it into the next interval"""
+        self._file(symbol, INTERVAL_NAMES[level]).write(candle.pack())
+        if cascade and level + 1 < len(INTERVAL_NAMES):
+            self._roll_up(symbol, level + 1, candle)
+
+    def _roll_up(self, symbol, level, finer, cascade=True):
+        interval = INTERVAL_NAMES[level]
+        key = (symbol, interval)
+        start = bucket_start(finer.open_ts, INTERVALS[interval])
+        candle = self.open_candles.get(key)
+        if candle is not None and start > candle.open_ts:
+            self._close(symbol, level, candle, cascade)
+            candle = None
+        if candle is None:
+            candle = self.open_candles[key] = Candle(start)
+        candle.merge(finer)
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.files = {}
@@ -0,0 +1,56 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson là optional, fallback sang stdlib json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Chỉ cần cho Accept: application/msgpack
+    msgpack = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+HAS_MSGPACK = msgpack is not None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj):
+        """Compact UTF-8 JSON bytes"""
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        """Parse JSON from bytes or str"""
+        return orjson.loads(data)
+else:
+    def dumps(obj):
+        """Compact UTF-8 JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(data):
+        """Parse JSON from bytes or str"""
+        return json.loads(data)
+
+
+def dumps_msgpack(obj):
+    """MessagePack bytes (requires the msgpack package)"""
+    if msgpack is None:
+        raise RuntimeError("msgpack package is not installed (pip install msgpack)")
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def loads_msgpack(data):
+    if msgpack is None:
+        raise RuntimeError("msgpack package is not installed (pip install msgpack)")
+    return msgpack.unpackb(data, raw=False)
+
+
+def encode(obj, mimetype=JSON_MIMETYPE):
+    """Serialize for a negotiated response mimetype"""
+    if mimetype == MSGPACK_MIMETYPE:
+        return dumps_msgpack(obj)
+    return dumps(obj)
@@ -0,0 +1,473 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import logging
+from array import array
+from datetime import datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width columns: name -> array typecode
+COLUMNS = {
+    "ts": "q",        # exchange timestamp (ms)
+    "symbol": "H",    # symbol id, see symbols.json
+    "price": "d",
+    "size": "d",
+    "side": "B",      # 0 unknown, 1 buy, 2 sell
+    "trade_id": "q",
+}
+
+HEADER_MAGIC = b"TRCOL001"
+HEADER_FORMAT = "<8sQ"  # magic, committed row count
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Sau compaction: generation của column files, first row còn giữ (rows trước đó là sparse hole)
+EXTENT_FORMAT = "<QQ"
+EXTENT_SIZE = struct.calcsize(EXTENT_FORMAT)
+COPY_CHUNK = 1024 * 1024
+
+SIDES = {"buy": 1, "sell": 2}
+SIDE_NAMES = {0: None, 1: "buy", 2: "sell"}
+
+
+def column_path(store_dir, name):
+    return os.path.join(store_dir, f"{name}.col")
+
+
+def encode_side(side):
+    return SIDES.get(str(side).lower(), 0) if side else 0
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def format_decimal(value):
+    """Float as a plain decimal string: repr digits, never exponent notation (1e-05 -> 0.00001)"""
+    text = repr(value)
+    if 'e' in text:
+        text = format(Decimal(text), 'f')
+    return text
+
+
+def read_header(store_dir):
+    """Return the committed row count (0 if the store does not exist)"""
+    return read_extent(store_dir)[0]
+
+
+def read_extent(store_dir):
+    """(committed row count, generation, first kept row); headers written before compaction have no extent"""
+    try:
+        with open(os.path.join(store_dir, "header"), 'rb') as f:
+            raw = f.read(HEADER_SIZE + EXTENT_SIZE)
+    except FileNotFoundError:
+        return 0, 0, 0
+    if len(raw) < HEADER_SIZE:
+        return 0, 0, 0
+    magic, count = struct.unpack_from(HEADER_FORMAT, raw)
+    if magic != HEADER_MAGIC:
+        raise ValueError(f"Invalid column store header in {store_dir}")
+    if len(raw) < HEADER_SIZE + EXTENT_SIZE:
+        return count, 0, 0
+    generation, first_row = struct.unpack_from(EXTENT_FORMAT, raw, HEADER_SIZE)
+    return count, generation, first_row
+
+
+def load_symbols(store_dir):
+    try:
+        with open(os.path.join(store_dir, "symbols.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def copy_rows(source, target, itemsize, start, stop):
+    """Copy rows [start, stop) of one column file to the same offsets in ``target``"""
+    offset, end = start * itemsize, stop * itemsize
+    while offset < end:
+        source.seek(offset)
+        data = source.read(min(COPY_CHUNK, end - offset))
+        if not data:
+            break
+        target.seek(offset)  # seek qua phần đã drop: file sparse, không chiếm disk
+        target.write(data)
+        offset += len(data)
+
+
+class ColumnStoreWriter:
+    """Append trades to fixed-width column files (data collector side).
+
+    Rows are buffered in typed arrays and written at ``count * itemsize``.
+    The header row count is only advanced after the column data is
+    fsync'd, so readers never see a partially written row.
+
+    ``drop_before()`` frees rows older than the hot window by rewriting the
+    files sparse: kept rows stay at the same offsets, so row numbers held
+    by API indexes and cursors never change.
+    """
+
+    def __init__(self, store_dir, flush_batch=50, grow_records=65536):
+        self.store_dir = store_dir
+        self.flush_batch = flush_batch
+        self.grow_records = grow_records
+
+        self.count = 0
+        self.capacity = 0
+        self.generation = 0
+        self.first_row = 0
+        self.files = {}
+        self.buffers = {name: array(code) for name, code in COLUMNS.items()}
+        self.symbols = []
+        self.symbol_ids = {}
+        self.lock = threading.Lock()  # flush (writer thread) vs drop_before (retention thread)
+
+    def open(self):
+        """Open column files; rows past the committed count are discarded"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.count, self.generation, self.first_row = read_extent(self.store_dir)
+        self.symbols = load_symbols(self.store_dir)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        capacities = []
+        for name, code in COLUMNS.items():
+            path = column_path(self.store_dir, name)
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")  # compaction bị ngắt giữa chừng
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            f = open(path, 'r+b')
+            self.files[name] = f
+            f.seek(0, os.SEEK_END)
+            capacities.append(f.tell() // array(code).itemsize)
+        self.capacity = min(capacities) if capacities else 0
+
+        if self.capacity < self.count:
+            # Column files shorter than the header: trust the columns
+            logger.warning(f"Column store header ahead of data ({self.count} > {self.capacity}), repairing")
+            self.count = self.capacity
+        # Readers re-map khi generation đổi: phủ cả files thay bởi compaction bị ngắt giữa chừng
+        self.generation += 1
+        self._write_header()
+        logger.info(f"Column store opened: {self.store_dir} ({self.count} rows, {len(self.symbols)} symbols)")
+
+    def symbol_id(self, symbol):
+        """Return the interned id for a symbol, registering it if new"""
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+            self._write_symbols()
+        return symbol_id
+
+    def _write_symbols(self):
+        path = os.path.join(self.store_dir, "symbols.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.symbols, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append_trade(self, trade):
+        """Buffer one pre-parsed Trade (symbol_id must come from symbol_id())"""
+        buffers = self.buffers
+        buffers["ts"].append(trade.ts)
+        buffers["symbol"].append(trade.symbol_id)
+        buffers["price"].append(trade.price)
+        buffers["size"].append(trade.size)
+        buffers["side"].append(trade.side)
+        buffers["trade_id"].append(trade.trade_id)
+
+        if len(buffers["ts"]) >= self.flush_batch:
+            self.flush()
+
+    def _ensure_capacity(self, rows):
+        if rows <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < rows:
+            new_capacity += self.grow_records
+        for name, code in COLUMNS.items():
+            self.files[name].truncate(new_capacity * array(code).itemsize)
+        self.capacity = new_capacity
+
+    def flush(self):
+        """Write buffered rows, fsync them, then commit the new row count"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        pending = len(self.buffers["ts"])
+        if pending == 0 or not self.files:
+            return
+
+        self._ensure_capacity(self.count + pending)
+        for name, buffer in self.buffers.items():
+            f = self.files[name]
+            f.seek(self.count * buffer.itemsize)
+            f.write(buffer.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            del buffer[:]
+
+        self.count += pending
+        self._write_header()
+
+    def read_tail(self, count):
+        """Newest ``count`` committed rows as {column: array}, read straight from the files"""
+        start = max(self.count - count, self.first_row)
+        columns = {}
+        for name, code in COLUMNS.items():
+            column = array(code)
+            f = self.files[name]
+            f.seek(start * column.itemsize)
+            column.frombytes(f.read((self.count - start) * column.itemsize))
+            columns[name] = column
+        return columns
+
+    def drop_before(self, cutoff_ts):
+        """Free the rows before the first one with ts >= ``cutoff_ts``; returns rows dropped.
+
+        The kept rows are copied into sparse ``.tmp`` files at their current
+        offsets without holding the lock; only rows committed meanwhile are
+        copied under it, right before the files are swapped. The header first
+        announces the new first row (readers drop index entries below it
+        while the old files still hold the data), then the generation bump
+        makes readers re-map the new files.
+        """
+        with self.lock:
+            start, stop = self.first_row, self.count
+        first_row = self._first_row_at(cutoff_ts, start, stop)
+        if first_row <= start:
+            return 0
+
+        targets = {}
+        try:
+            for name in COLUMNS:
+                path = column_path(self.store_dir, name)
+                targets[name] = open(path + ".tmp", 'wb')
+                with open(path, 'rb') as source:  # handle riêng: writer thread vẫn seek/write self.files
+                    copy_rows(source, targets[name], array(COLUMNS[name]).itemsize, first_row, stop)
+            with self.lock:
+                for name, target in targets.items():
+                    itemsize = array(COLUMNS[name]).itemsize
+                    copy_rows(self.files[name], target, itemsize, stop, self.count)
+                    target.truncate(self.capacity * itemsize)
+                    target.flush()
+                    os.fsync(target.fileno())
+                self.first_row = first_row
+                self._write_header()
+                for name, target in targets.items():
+                    path = column_path(self.store_dir, name)
+                    os.replace(path + ".tmp", path)
+                    self.files[name].close()
+                    self.files[name] = open(path, 'r+b')
+                self.generation += 1
+                self._write_header()
+        finally:
+            for target in targets.values():
+                target.close()
+        logger.info(f"Column store: dropped {first_row - start} rows before ts {cutoff_ts}")
+        return first_row - start
+
+    def _first_row_at(self, cutoff_ts, start, stop):
+        """First row in [start, stop) with ts >= cutoff_ts (rows are appended in arrival order)"""
+        itemsize = array(COLUMNS["ts"]).itemsize
+        with open(column_path(self.store_dir, "ts"), 'rb') as f:
+            row = start
+            while row < stop:
+                stamps = array(COLUMNS["ts"])
+                f.seek(row * itemsize)
+                stamps.frombytes(f.read(min(COPY_CHUNK // itemsize, stop - row) * itemsize))
+                for i, ts in enumerate(stamps):
+                    if ts >= cutoff_ts:
+                        return row + i
+                row += len(stamps)
+        return stop
+
+    def _write_header(self):
+        path = os.path.join(self.store_dir, "header")
+        mode = 'r+b' if os.path.exists(path) else 'wb'
+        with open(path, mode) as f:
+            f.write(struct.pack(HEADER_FORMAT, HEADER_MAGIC, self.count) +
+                    struct.pack(EXTENT_FORMAT, self.generation, self.first_row))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+
+class ColumnStoreReader:
+    """Read-only, memory-mapped view of the column store (API side).
+
+    Every worker maps the same files, so the data lives once in the page
+    cache. ``refresh()`` only re-maps when the writer has grown or replaced
+    the files. Rows before ``first_row`` were dropped by compaction.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.count = 0
+        self.generation = 0
+        self.first_row = 0
+        self.maps = {}
+        self.columns = {}
+        self.symbols = []
+        self.capacity = 0
+
+    def refresh(self):
+        """Pick up newly committed rows; returns the previous row count"""
+        previous = self.count
+        count, generation, self.first_row = read_extent(self.store_dir)
+        if count > self.capacity or generation != self.generation:
+            self._remap()
+            self.generation = generation
+        self.count = min(count, self.capacity)
+        if self.count > previous and not self._symbols_cover_new_rows(previous):
+            self.symbols = load_symbols(self.store_dir)
+        return previous
+
+    def _symbols_cover_new_rows(self, start):
+        column = self.columns.get("symbol")
+        if column is None:
+            return False
+        top = len(self.symbols)
+        for i in range(start, self.count):
+            if column[i] >= top:
+                return False
+        return True
+
+    def _remap(self):
+        maps = {}
+        columns = {}
+        capacity = None
+        for name, code in COLUMNS.items():
+            path = column_path(self.store_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    itemsize = array(code).itemsize
+                    size -= size % itemsize
+                    if size == 0:
+                        capacity = 0
+                        break
+                    mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                capacity = 0
+                break
+            maps[name] = mm
+            columns[name] = memoryview(mm).cast(code)
+            rows = size // itemsize
+            capacity = rows if capacity is None else min(capacity, rows)
+
+        if not capacity:
+            self.maps, self.columns, self.capacity = {}, {}, 0
+            return
+        # Old maps are released once no memoryview references them
+        self.maps = maps
+        self.columns = columns
+        self.capacity = capacity
+
+    def column(self, name):
+        return self.columns[name]
+
+    def symbol_name(self, symbol_id):
+        if symbol_id < len(self.symbols):
+            return self.symbols[symbol_id]
+        return "Unknown"
+
+    def record(self, row):
+        """Materialize one row in the API record format"""
+        columns = self.columns
+        ts = columns["ts"][row]
+        return {
+            "timestamp": datetime.fromtimestamp(ts / 1000).isoformat() if ts else None,
+            "symbol": self.symbol_name(columns["symbol"][row]),
+            "data": {
+                "price": format_decimal(columns["price"][row]),
+                "size": format_decimal(columns["size"][row]),
+                "side": SIDE_NAMES.get(columns["side"][row]),
+                "tradeId": str(columns["trade_id"][row]),
+                "ts": str(ts)
+            }
+        }
+
+    def view(self, start=0, stop=None):
+        return ColumnView(self, start, self.count if stop is None else stop)
+
+    def size_bytes(self):
+        """Disk usage of the column files (the dropped prefix is a sparse hole)"""
+        return sum(
+            os.stat(column_path(self.store_dir, name)).st_blocks * 512
+            for name in COLUMNS if os.path.exists(column_path(self.store_dir, name))
+        )
+
+
+class ColumnView:
+    """List-like window of rows; records are only built when accessed"""
+
+    def __init__(self, reader, start, stop):
+        self.reader = reader
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            rows = range(self.start, self.stop)[key]
+            return [self.reader.record(row) for row in rows]
+        rows = range(self.start, self.stop)
+        return self.reader.record(rows[key])
+
+    def __iter__(self):
+        for row in range(self.start, self.stop):
+            yield self.reader.record(row)
+
+
+class RowsView:
+    """List-like window over an array of row numbers (e.g. a symbol index)"""
+
+    def __init__(self, reader, rows, start, stop):
+        self.reader = reader
+        self.rows = rows
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, key):
+        positions = range(self.start, self.stop)[key]
+        if isinstance(key, slice):
+            return [self.reader.record(self.rows[i]) for i in positions]
+        return self.reader.record(self.rows[positions])
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.reader.record(self.rows[i])
@@ -6,9 +6,24 @@ import logging
 from logging.handlers import RotatingFileHandler
 import signal
 import sys
-from datetime import datetime
+import asyncio
+import argparse
+from collections import deque
 import os
 
+from trade_log import TradeLog
+from retention import RetentionManager
+from column_store import ColumnStoreWriter, SIDE_NAMES
+from candles import CandleAggregator
+from trade_record import Trade
+from trade_guard import TradeGuard
+from async_collector import AsyncBitgetCollector, websockets
+from trade_writer import TradeWriter
+from trade_stream import TradePublisher
+from order_book import OrderBooks
+import codec
+import metrics
+
 # Cấu hình logging cho production
 logging.basicConfig(
     level=logging.INFO,
@@ -20,15 +35,87 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Prometheus metrics (scrape qua exporter port của collector)
+MESSAGES = metrics.counter("collector_messages_total", "Trade push messages received", ("symbol",))
+TRADES = metrics.counter("collector_trades_total", "New trades accepted after de-dup", ("symbol",))
+PARSE_SECONDS = metrics.histogram("collector_parse_seconds", "JSON decode and Trade parsing time per message")
+PERSIST_SECONDS = metrics.histogram("collector_persist_seconds", "Writer batch save time (trade log, columns, candles)")
+PERSIST_BATCH = metrics.histogram("collector_persist_batch_trades", "Trades per writer batch",
+                                  buckets=metrics.COUNT_BUCKETS)
+RECONNECTS = metrics.counter("collector_reconnects_total", "WebSocket reconnects", ("shard",))
+BOOK_MESSAGES = metrics.counter("collector_book_messages_total", "Order book pushes received", ("symbol",))
+
+def last_index(keys, key):
+    """Position of the last occurrence of ``key``, or None"""
+    for i in range(len(keys) - 1, -1, -1):
+        if keys[i] == key:
+            return i
+    return None
+
 class BitgetDataCollectorProduction:
     def __init__(self):
         self.ws = None
         self.is_running = False
-        self.data_file = "trading_data.json"
-        self.trading_data = []
-        self.max_records = 10000  # Giới hạn cao cho production
+        self.data_file = "trading_data.json"  # Legacy JSON file, migrated on startup
+        self.log_dir = "trade_log"
+        self.columns_dir = "trade_columns"
+        self.candles_dir = "candles"
+        self.max_records = 10000  # Số trades (Trade objects) giữ trong bộ nhớ
+        self.trading_data = deque(maxlen=self.max_records)
+        self.trade_log = TradeLog(
+            self.log_dir,
+            segment_max_bytes=16 * 1024 * 1024,
+            fsync_batch=5000,    # Writer thread fsync theo batch, đây chỉ là giới hạn an toàn
+            fsync_interval=5.0,
+            max_segments=None    # RetentionManager archive segments thay vì xoá
+        )
+        # Columnar store đọc bởi API workers qua mmap
+        self.column_store = ColumnStoreWriter(self.columns_dir, flush_batch=5000)
+        # Tiered retention: raw segments -> gzip archives theo ngày/symbol -> chỉ còn candles
+        self.archive_dir = "trade_archive"
+        self.retention = RetentionManager(
+            self.trade_log,
+            self.archive_dir,
+            hot_days=7,           # raw ticks trong trade log và column store
+            archive_days=365,     # archives nén, sau đó chỉ giữ candles
+            interval=3600,        # compaction mỗi giờ, chạy ở background thread
+            column_store=self.column_store
+        )
+        # OHLCV candles 1m -> 5m -> 15m -> 1h -> 4h -> 1d
+        self.candles = CandleAggregator(self.candles_dir)
         self.reconnect_count = 0
         self.max_reconnects = 100  # Cho phép reconnect nhiều lần
+        # Bitget WebSocket URL - V2 API
+        self.ws_url = os.environ.get("BITGET_WS_URL", "wss://ws.bitget.com/v2/ws/public")
+        self.async_collector = None
+        # Writer thread: ingest chỉ đẩy vào ring buffer, disk I/O chạy riêng
+        self.writer = TradeWriter(
+            self.persist_batch,
+            capacity=65536,
+            flush_records=500,    # flush khi đủ 500 trades
+            flush_interval=0.5,   # hoặc mỗi 0.5 giây
+            block_timeout=1.0     # ring đầy: chờ tối đa 1s rồi drop
+        )
+        self.metrics_interval = 60
+        # De-dup theo tradeId + phát hiện gaps sau reconnect
+        self.gaps_file = "gaps.json"
+        self.guard = TradeGuard(window=4096, gaps_file=self.gaps_file)
+        # Live stream cho API workers (SSE) qua Unix socket
+        self.stream_socket = "trade_stream.sock"
+        self.publisher = TradePublisher(self.stream_socket)
+        # L2 order books (snapshot + deltas, checksum), snapshot gọn ghi ra disk cho API
+        self.book_channel = "books"   # None = chỉ collect trades
+        self.books_dir = "order_books"
+        self.books = OrderBooks(
+            self.books_dir,
+            snapshot_depth=200,       # levels mỗi bên được persist
+            snapshot_interval=1.0,
+            on_resync=self.resync_book
+        )
+        # Prometheus exporter (0 = tắt); mặc định chỉ nghe trên loopback
+        self.metrics_port = int(os.environ.get("COLLECTOR_METRICS_PORT", "9101"))
+        self.metrics_host = os.environ.get("COLLECTOR_METRICS_HOST", "127.0.0.1")
+        self.register_metrics()
         
         # Theo dõi nhiều symbol cho production
         self.symbols = [
@@ -36,49 +123,167 @@ class BitgetDataCollectorProduction:
             "BNBUSDT", "XRPUSDT", "MATICUSDT", "LINKUSDT", "AVAXUSDT"
         ]
         
+    def register_metrics(self):
+        """Gauges read from collector state at scrape time"""
+        metrics.gauge("collector_writer_queue_depth", "Trades waiting in the writer ring buffer",
+                      func=self.writer.depth)
+        metrics.gauge("collector_ingest_queue_depth", "Raw messages waiting for the async consumer",
+                      func=lambda: self.async_collector.queue_depth() if self.async_collector else 0)
+        metrics.counter("collector_writer_dropped_total", "Trades dropped because the writer ring was full",
+                        func=lambda: self.writer.dropped)
+        metrics.counter("collector_writer_blocked_total", "Submits that had to wait for ring space",
+                        func=lambda: self.writer.blocked)
+        metrics.counter("collector_duplicate_trades_total", "Trades skipped as already seen",
+                        func=self.guard.duplicates)
+        metrics.gauge("collector_gaps", "Recorded gaps in gaps.json", func=lambda: len(self.guard.gaps))
+        metrics.counter("collector_book_resyncs_total", "Order book checksum mismatches (resubscribed)",
+                        func=lambda: self.books.resyncs)
+        metrics.gauge("collector_stream_clients", "API workers connected to the trade stream",
+                      func=lambda: len(self.publisher.clients))
+    
     def load_existing_data(self):
-        """Load existing data from file"""
+        """Open the trade log (with crash recovery) and load recent records"""
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self.trading_data = json.load(f)
-                logger.info(f"Loaded {len(self.trading_data)} records from file")
-        except FileNotFoundError:
-            self.trading_data = []
-            logger.info("Creating new data file for production")
+            self.trade_log.open()
+            self.column_store.open()
+            self.migrate_legacy_file()
+            self.reconcile_columns()
+            if self.trade_log.clean_start and self.column_store.count > 0:
+                # Shutdown sạch: column store khớp với log, đọc binary thay vì parse JSON
+                columns = self.column_store.read_tail(self.max_records)
+                self.trading_data.extend(map(Trade, columns["ts"], columns["symbol"], columns["price"],
+                                             columns["size"], columns["side"], columns["trade_id"]))
+                source = "column store"
+            else:
+                symbol_id = self.column_store.symbol_id
+                self.trading_data.extend(
+                    Trade.from_record(record, symbol_id)
+                    for record in self.trade_log.read_tail(self.max_records)
+                )
+                source = "trade log"
+            logger.info(f"Loaded {len(self.trading_data)} records from {source}")
+            symbols = self.column_store.symbols
+            for trade in self.trading_data:
+                self.guard.seed(symbols[trade.symbol_id], trade.trade_id, trade.ts)
+            self.restore_candles()
         except Exception as e:
             logger.error(f"Error loading data: {e}")
-            self.trading_data = []
+            self.trading_data.clear()
+    
+    def migrate_legacy_file(self):
+        """Import the old trading_data.json into the trade log once"""
+        if not os.path.exists(self.data_file) or self.trade_log.active_size > 0:
+            return
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            symbols = self.column_store.symbols
+            for record in records:
+                trade = Trade.from_record(record, self.column_store.symbol_id)
+                self.trade_log.append(trade.to_record(symbols))
+            self.trade_log.flush()
+            os.rename(self.data_file, self.data_file + ".migrated")
+            logger.info(f"Migrated {len(records)} records from {self.data_file} to trade log")
+        except Exception as e:
+            logger.error(f"Error migrating legacy data file: {e}")
+    
+    def reconcile_columns(self, window=100000):
+        """Make the column store match the trade log after a crash between their flushes.
+
+        The store's last trade is looked up in the log tail and the log
+        records after it are replayed into the store. If the log does not
+        have it, the store got ahead: the store rows after the log's last
+        trade are appended to the log (both stores stay append-only).
+        """
+        if self.column_store.count == 0:
+            self.backfill_columns()
+            return
+        if self.trade_log.clean_start:
+            return  # stop() đóng column store trước khi ghi clean marker của trade log
+        symbol_id = self.column_store.symbol_id
+        records = self.trade_log.read_tail(window)
+        log_trades = [Trade.from_record(record, symbol_id) for record in records]
+        tail = self.column_store.read_tail(window)
+        store_keys = list(zip(tail["symbol"], tail["trade_id"]))
+        if not store_keys:
+            return
+        if log_trades and (log_trades[-1].symbol_id, log_trades[-1].trade_id) == store_keys[-1]:
+            return
+
+        log_keys = [(trade.symbol_id, trade.trade_id) for trade in log_trades]
+        position = last_index(log_keys, store_keys[-1])
+        if position is not None:
+            missing = log_trades[position + 1:]
+            for trade in missing:
+                self.column_store.append_trade(trade)
+            self.column_store.flush()
+            logger.warning(f"Column store was behind the trade log: replayed {len(missing)} trades")
+            return
+
+        position = last_index(store_keys, log_keys[-1]) if log_keys else None
+        if position is None:
+            logger.error(f"Column store and trade log share no trade in their last {window} records, not reconciled")
+            return
+        symbols = self.column_store.symbols
+        extra = [Trade(*row) for row in zip(*(tail[name][position + 1:] for name in
+                                              ("ts", "symbol", "price", "size", "side", "trade_id")))]
+        for trade in extra:
+            self.trade_log.append(trade.to_record(symbols))
+        self.trade_log.flush()
+        logger.warning(f"Trade log was behind the column store: appended {len(extra)} trades")
+
+    def backfill_columns(self):
+        """Build the column store from the trade log when it is empty"""
+        count = 0
+        for record in self.trade_log.iter_records():
+            self.column_store.append_trade(Trade.from_record(record, self.column_store.symbol_id))
+            count += 1
+        self.column_store.flush()
+        if count:
+            logger.info(f"Backfilled column store with {count} records from trade log")
+    
+    def restore_candles(self):
+        """Rebuild open candles from candle files and recent trades"""
+        self.candles.restore(self.symbols)
+        symbols = self.column_store.symbols
+        closed_end = {symbol: self.candles.last_closed_end(symbol) for symbol in self.symbols}
+        for trade in self.trading_data:
+            symbol = symbols[trade.symbol_id]
+            if trade.ts >= closed_end.get(symbol, 0):
+                self.candles.add_trade(symbol, trade.ts, trade.price, trade.size)
+    
+    def persist_batch(self, trades):
+        """Writer thread: append a batch to every store, then flush once"""
+        started = time.perf_counter()
+        symbols = self.column_store.symbols
+        for trade in trades:
+            self.trade_log.append(trade.to_record(symbols))
+            self.column_store.append_trade(trade)
+            self.candles.add_trade(symbols[trade.symbol_id], trade.ts, trade.price, trade.size)
+        self.save_data()
+        PERSIST_SECONDS.observe(time.perf_counter() - started)
+        PERSIST_BATCH.observe(len(trades))
     
     def save_data(self):
-        """Save data to file with rotation"""
+        """Flush pending trade log and column writes to disk (writer thread)"""
         try:
-            # Rotate data để tránh file quá lớn
-            if len(self.trading_data) > self.max_records:
-                # Backup file cũ
-                backup_file = f"trading_data_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                if os.path.exists(self.data_file):
-                    os.rename(self.data_file, backup_file)
-                    logger.info(f"Backed up old data to {backup_file}")
-                
-                # Giữ lại 80% records mới nhất
-                keep_records = int(self.max_records * 0.8)
-                self.trading_data = self.trading_data[-keep_records:]
-                logger.info(f"Rotated data, keeping {keep_records} latest records")
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.trading_data, f, indent=2, ensure_ascii=False)
-            
-            # Log statistics
-            if len(self.trading_data) % 100 == 0:  # Log mỗi 100 records
-                logger.info(f"Saved {len(self.trading_data)} records to file")
-                
+            self.trade_log.flush()
+            self.column_store.flush()
+            self.candles.flush()
         except Exception as e:
             logger.error(f"Error saving data: {e}")
     
     def on_message(self, ws, message):
         """Handle WebSocket messages"""
+        self.handle_message(message)
+    
+    def handle_message(self, message):
+        """Process one raw message (shared by thread and async modes)"""
         try:
-            data = json.loads(message)
+            if message == 'pong':
+                return
+            started = time.perf_counter()
+            data = codec.loads(message)
             
             # Handle subscription responses
             if 'event' in data:
@@ -89,45 +294,68 @@ class BitgetDataCollectorProduction:
                     logger.error(f"Subscription error: {data}")
                 return
             
-            # Handle trade data
+            # Handle trade / order book data
             if 'data' in data and 'arg' in data:
                 arg = data['arg']
                 symbol = arg.get('instId', 'Unknown')
+                if arg.get('channel') == self.book_channel:
+                    BOOK_MESSAGES.labels(symbol).inc()
+                    self.books.handle(symbol, data.get('action'), data['data'])
+                    return
                 trades = data['data']
                 
-                for trade in trades:
-                    trade_record = {
-                        "timestamp": datetime.now().isoformat(),
-                        "symbol": symbol,
-                        "data": {
-                            "price": trade.get('price'),
-                            "size": trade.get('size'),
-                            "side": trade.get('side'),
-                            "tradeId": trade.get('tradeId'),
-                            "ts": trade.get('ts')
-                        }
-                    }
-                    
-                    self.trading_data.append(trade_record)
-                    
-                    # Log chỉ trades lớn để tránh spam
-                    try:
-                        size_float = float(trade.get('size', 0))
-                        price_float = float(trade.get('price', 0))
-                        value = size_float * price_float
-                        
-                        if value > 1000:  # Log trades > $1000
-                            logger.info(f"[PRODUCTION] Large trade: {symbol} - ${value:.2f} - {trade.get('side')}")
-                    except:
-                        pass
-                
-                # Save data periodically
-                if len(self.trading_data) % 50 == 0:  # Save every 50 trades
-                    self.save_data()
+                self.process_trades(symbol, trades, started)
                 
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
+    def process_trades(self, symbol, trades, started=None):
+        """Parse the trades of one push message and hand them to the writer"""
+        symbol_id = self.column_store.symbol_id(symbol)
+        symbols = self.column_store.symbols
+        # Chỉ build records khi có API worker đang nghe
+        streaming = bool(self.publisher.clients)
+        published = []
+        
+        # Parse một lần, dùng Trade object cho mọi bước sau; bỏ trades đã nhận
+        parsed = [Trade.from_bitget(raw, symbol_id) for raw in trades]
+        if started is not None:
+            PARSE_SECONDS.observe(time.perf_counter() - started)
+        MESSAGES.labels(symbol).inc()
+        fresh = self.guard.filter(symbol, parsed)
+        TRADES.labels(symbol).inc(len(fresh))
+        for trade in fresh:
+            self.trading_data.append(trade)
+            self.writer.submit(trade)
+            if streaming:
+                published.append(trade.to_record(symbols))
+            
+            # Log chỉ trades lớn để tránh spam
+            value = trade.notional
+            if value > 1000:  # Log trades > $1000
+                logger.info(f"[PRODUCTION] Large trade: {symbol} - ${value:.2f} - {SIDE_NAMES.get(trade.side)}")
+        
+        if published:
+            self.publisher.publish(published)
+    
+    def subscription_args(self, symbols):
+        """Subscribe args for the trade channel (and the order book channel) of symbols"""
+        channels = ["trade"] + ([self.book_channel] if self.book_channel else [])
+        return [{"instType": "SPOT", "channel": channel, "instId": symbol}
+                for symbol in symbols for channel in channels]
+    
+    def resync_book(self, symbol):
+        """Resubscribe the book channel to get a fresh snapshot after a checksum mismatch"""
+        if self.async_collector is not None:
+            self.async_collector.resubscribe(symbol, self.book_channel)
+        elif self.ws and self.is_running:
+            arg = {"instType": "SPOT", "channel": self.book_channel, "instId": symbol}
+            try:
+                self.ws.send(json.dumps({"op": "unsubscribe", "args": [arg]}))
+                self.ws.send(json.dumps({"op": "subscribe", "args": [arg]}))
+            except Exception as e:
+                logger.error(f"Error resubscribing order book {symbol}: {e}")
+    
     def on_error(self, ws, error):
         """Handle WebSocket errors"""
         logger.error(f"WebSocket error: {error}")
@@ -139,6 +367,7 @@ class BitgetDataCollectorProduction:
         # Auto-reconnect with exponential backoff
         if self.is_running and self.reconnect_count < self.max_reconnects:
             self.reconnect_count += 1
+            RECONNECTS.labels("0").inc()
             wait_time = min(60, 2 ** min(self.reconnect_count, 6))  # Max 60s wait
             logger.info(f"Reconnecting in {wait_time} seconds... (attempt {self.reconnect_count})")
             threading.Timer(wait_time, self.connect).start()
@@ -150,16 +379,13 @@ class BitgetDataCollectorProduction:
         """Handle WebSocket open"""
         logger.info("[PRODUCTION] WebSocket connected successfully")
         self.reconnect_count = 0  # Reset reconnect counter
+        self.guard.expect_resync(self.symbols)
         
-        # Subscribe to trades for each symbol
+        # Subscribe to trades (and order book) for each symbol
         for i, symbol in enumerate(self.symbols):
             subscribe_msg = {
                 "op": "subscribe",
-                "args": [{
-                    "instType": "SPOT",
-                    "channel": "trade", 
-                    "instId": symbol
-                }]
+                "args": self.subscription_args([symbol])
             }
             
             # Send subscription with delay to avoid rate limiting
@@ -175,11 +401,8 @@ class BitgetDataCollectorProduction:
         try:
             logger.info("[PRODUCTION] Connecting to Bitget WebSocket...")
             
-            # Bitget WebSocket URL - V2 API
-            ws_url = "wss://ws.bitget.com/v2/ws/public"
-            
             self.ws = websocket.WebSocketApp(
-                ws_url,
+                self.ws_url,
                 on_message=self.on_message,
                 on_error=self.on_error,
                 on_close=self.on_close,
@@ -198,8 +421,8 @@ class BitgetDataCollectorProduction:
                 # Retry connection after delay
                 threading.Timer(10.0, self.connect).start()
     
-    def start(self):
-        """Start the data collector"""
+    def start(self, mode="async", connections=4):
+        """Start the data collector (async sharded connections or legacy thread mode)"""
         try:
             self.is_running = True
             
@@ -210,25 +433,44 @@ class BitgetDataCollectorProduction:
             logger.info("BITGET DATA COLLECTOR - PRODUCTION MODE")
             logger.info("=" * 60)
             logger.info(f"Tracking symbols: {', '.join(self.symbols)}")
-            logger.info(f"Data file: {self.data_file}")
-            logger.info(f"Max records: {self.max_records}")
-            logger.info(f"Auto-rotation enabled")
+            logger.info(f"Trade log: {self.log_dir}/")
+            logger.info(f"Max records in memory: {self.max_records}")
+            logger.info(f"Segment rollover enabled")
+            logger.info(f"Retention: {self.retention.hot_days}d raw, {self.retention.archive_days}d archived ({self.archive_dir}/)")
             logger.info(f"Production logging enabled")
+            logger.info(f"Collector mode: {mode}")
             logger.info("=" * 60)
             
-            # Start periodic data save (every 5 minutes)
-            def periodic_save():
+            # Writer thread flush theo size/time, không còn periodic save
+            self.writer.start()
+            self.retention.start()
+            if self.book_channel:
+                self.books.start()
+            try:
+                self.publisher.start()
+            except OSError as e:
+                logger.error(f"Trade stream disabled: {e}")
+            if self.metrics_port:
+                try:
+                    metrics.start_http_server(self.metrics_port, self.metrics_host)
+                except OSError as e:
+                    logger.error(f"Metrics exporter disabled: {e}")
+            
+            def log_writer_metrics():
                 while self.is_running:
-                    time.sleep(300)  # 5 minutes
+                    time.sleep(self.metrics_interval)
                     if self.is_running:
-                        self.save_data()
-                        logger.info(f"Periodic save: {len(self.trading_data)} records in memory")
+                        logger.info(f"Writer metrics: {self.writer.metrics()}, duplicates: {self.guard.duplicates()}")
             
-            save_thread = threading.Thread(target=periodic_save, daemon=True)
-            save_thread.start()
+            metrics_thread = threading.Thread(target=log_writer_metrics, daemon=True)
+            metrics_thread.start()
             
             # Connect to WebSocket
-            self.connect()
+            if mode == "async":
+                self.async_collector = AsyncBitgetCollector(self, connections=connections)
+                asyncio.run(self.async_collector.run())
+            else:
+                self.connect()
             
         except Exception as e:
             logger.error(f"Error starting collector: {e}")
@@ -241,8 +483,16 @@ class BitgetDataCollectorProduction:
         if self.ws:
             self.ws.close()
         
-        # Final data save
-        self.save_data()
+        self.publisher.stop()
+        self.retention.stop()
+        self.books.stop()
+        
+        # Final data save: drain writer trước khi đóng files
+        self.writer.stop()
+        # Column store trước: clean marker của trade log chỉ có khi cả hai đã flush xong
+        self.column_store.close()
+        self.trade_log.close()
+        self.candles.close()
         logger.info("Production data collector stopped!")
 
 def signal_handler(sig, frame):
@@ -252,6 +502,14 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bitget data collector - production")
+    parser.add_argument("--mode", choices=["async", "thread"],
+                        default="async" if websockets is not None else "thread",
+                        help="async: sharded asyncio connections, thread: legacy websocket-client")
+    parser.add_argument("--connections", type=int, default=4,
+                        help="Number of WebSocket connections in async mode")
+    args = parser.parse_args()
+    
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -259,7 +517,7 @@ if __name__ == "__main__":
     collector = BitgetDataCollectorProduction()
     
     try:
-        collector.start()
+        collector.start(mode=args.mode, connections=args.connections)
     except KeyboardInterrupt:
         collector.stop()
     except Exception as e:
@@ -0,0 +1,447 @@
+import glob
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+from array import array
+
+try:
+    import zstandard
+except ImportError:  # zstd là optional, gzip luôn có sẵn
+    zstandard = None
+
+import codec
+from column_store import COLUMNS, SIDES, SIDE_NAMES, format_decimal
+from trade_log import TradeLog
+from trade_record import compact_record
+from retention import TradeArchive
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    # format -> (file extension, mimetype)
+    "ndjson": ("ndjson", "application/x-ndjson"),
+    "csv": ("csv", "text/csv"),
+    "columnar": ("trcol", "application/octet-stream"),
+}
+COMPRESSIONS = {
+    # compression -> (file extension suffix, mimetype)
+    "none": ("", None),
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd"),
+}
+
+CSV_HEADER = b"ts,symbol,price,size,side,tradeId\n"
+CHUNK_BYTES = 64 * 1024     # output is yielded in chunks of about this size
+BLOCK_ROWS = 8192           # rows per columnar block
+SEGMENT_SKEW_MS = 60000     # trades arrive at most this far out of ts order
+
+# Columnar block: magic, row count, byte length of the block's symbol table (JSON list)
+BLOCK_MAGIC = b"TRBLK001"
+BLOCK_HEADER_FORMAT = "<8sII"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+
+
+class TradeExporter:
+    """Stream trade history from old JSON backups, archives and the trade log.
+
+    Records are produced lazily, one segment line at a time, and encoded
+    into fixed-size chunks, so memory stays constant whatever the range.
+    For a past, bounded range the output only depends on which files hold
+    it; ``source_tag()`` fingerprints those files so the API can serve byte
+    ranges for resumed downloads and detect when retention moved them.
+    """
+
+    def __init__(self, log_dir, archive_dir=None, legacy_patterns=()):
+        self.trade_log = TradeLog(log_dir)
+        self.archive = TradeArchive(archive_dir) if archive_dir else None
+        self.legacy_patterns = legacy_patterns
+
+    # ------------------------------------------------------------------
+    # Record sources
+    # ------------------------------------------------------------------
+    def legacy_files(self):
+        """Old full-array JSON files (trading_data.json and its backups), oldest first"""
+        paths = set()
+        for pattern in self.legacy_patterns:
+            paths.update(glob.glob(pattern))
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def iter_legacy(self, before_ts):
+        """Records from legacy files older than the archives and trade log.
+
+        Backups are overlapping snapshots of the same rolling window, so a
+        per-symbol (ts, tradeId) watermark drops what an older file already
+        produced.
+        """
+        watermarks = {}
+        for path in self.legacy_files():
+            try:
+                # Legacy files là một JSON array (tối đa max_records records)
+                with open(path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping unreadable backup {path}: {e}")
+                continue
+            for record in records:
+                record = compact_record(record)
+                if before_ts is not None and record["ts"] >= before_ts:
+                    continue
+                key = (record["ts"], record["tradeId"])
+                if key <= watermarks.get(record["symbol"], (-1, -1)):
+                    continue
+                watermarks[record["symbol"]] = key
+                yield record
+
+    def log_segments(self, from_ts=None, to_ts=None, skip=()):
+        """Trade log segments that can hold trades in the range"""
+        segments = [index for index in self.trade_log.list_segments() if index not in skip]
+        first_ts = [None] * len(segments)
+
+        def segment_start(i):
+            if first_ts[i] is None:
+                record = self.trade_log.first_record(segments[i])
+                first_ts[i] = compact_record(record)["ts"] if record else 0
+            return first_ts[i]
+
+        selected = []
+        for i, index in enumerate(segments):
+            if to_ts is not None and segment_start(i) > to_ts + SEGMENT_SKEW_MS:
+                break
+            # Segment kế tiếp đã bắt đầu trước from -> segment này nằm ngoài range
+            if (from_ts is not None and i + 1 < len(segments) and
+                    segment_start(i + 1) < from_ts - SEGMENT_SKEW_MS):
+                continue
+            selected.append(index)
+        return selected
+
+    def iter_log(self, from_ts=None, to_ts=None, skip=()):
+        """Records from the trade log, skipping segments outside the range"""
+        for index in self.log_segments(from_ts, to_ts, skip):
+            for record in self.trade_log.iter_segment(index):
+                yield compact_record(record)
+
+    def source_tag(self, symbols=None, from_ts=None, to_ts=None):
+        """Fingerprint of the legacy files, archives and log segments an export reads"""
+        manifest = self.archive.load_manifest() if self.archive else None
+        archived = set(manifest["pending_segments"]) if manifest else set()
+        archive = []
+        if manifest:
+            for _, entries in self.archive.select(symbols, from_ts, to_ts, manifest):
+                archive.extend((entry["file"], entry["records"]) for entry in entries)
+        sources = {
+            "legacy": [(path, os.path.getmtime(path), os.path.getsize(path)) for path in self.legacy_files()],
+            "archive": archive,
+            "log": self.log_segments(from_ts, to_ts, archived),
+        }
+        return hashlib.sha1(json.dumps(sources, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+
+    def iter_records(self, symbols=None, from_ts=None, to_ts=None):
+        """All matching records: legacy backups, cold archives, then the trade log"""
+        manifest = self.archive.load_manifest() if self.archive else None
+        # Segments đã archive nhưng chưa kịp xoá: chỉ đọc bản archive
+        archived = set(manifest["pending_segments"]) if manifest else set()
+        segments = [index for index in self.trade_log.list_segments() if index not in archived]
+        first = self.trade_log.first_record(segments[0]) if segments else None
+        history_start = compact_record(first)["ts"] if first else None
+        if manifest:
+            archive_start = self.archive.first_ts(manifest)
+            if archive_start is not None:
+                history_start = archive_start if history_start is None else min(history_start, archive_start)
+
+        sources = []
+        if history_start is None or from_ts is None or from_ts < history_start:
+            sources.append(self.iter_legacy(history_start))
+        if manifest:
+            sources.append(self.archive.iter_records(symbols, from_ts, to_ts, manifest))
+        sources.append(self.iter_log(from_ts, to_ts, archived))
+
+        for source in sources:
+            for record in source:
+                ts = record["ts"]
+                if from_ts is not None and ts < from_ts:
+                    continue
+                if to_ts is not None and ts > to_ts:
+                    continue
+                if symbols is not None and str(record["symbol"]).upper() not in symbols:
+                    continue
+                yield record
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+    def stream(self, fmt="ndjson", compression="gzip", symbols=None, from_ts=None, to_ts=None):
+        """Yield encoded (and compressed) output chunks"""
+        records = self.iter_records(symbols, from_ts, to_ts)
+        if fmt == "csv":
+            chunks = encode_csv(records)
+        elif fmt == "columnar":
+            chunks = encode_columnar(records)
+        else:
+            chunks = encode_ndjson(records)
+        return compress(chunks, compression)
+
+
+def _batched(lines):
+    """Join encoded lines into chunks of about CHUNK_BYTES"""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def encode_ndjson(records):
+    return _batched(codec.dumps(record) + b"\n" for record in records)
+
+
+def encode_csv(records):
+    yield CSV_HEADER
+    yield from _batched(
+        f"{r['ts']},{r['symbol']},{format_decimal(float(r['price']))},{format_decimal(float(r['size']))},"
+        f"{r['side'] or ''},{r['tradeId']}\n"
+        .encode('utf-8')
+        for r in records
+    )
+
+
+def encode_columnar(records):
+    """Self-contained column blocks (row groups), each with its own symbol table"""
+    columns = {name: array(code) for name, code in COLUMNS.items()}
+    symbol_ids = {}
+    for record in records:
+        symbol = record["symbol"]
+        symbol_id = symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = symbol_ids[symbol] = len(symbol_ids)
+        columns["ts"].append(record["ts"])
+        columns["symbol"].append(symbol_id)
+        columns["price"].append(float(record["price"]))
+        columns["size"].append(float(record["size"]))
+        columns["side"].append(SIDES.get(str(record["side"]).lower(), 0) if record["side"] else 0)
+        columns["trade_id"].append(record["tradeId"])
+        if len(columns["ts"]) >= BLOCK_ROWS:
+            yield _columnar_block(columns, symbol_ids)
+            columns = {name: array(code) for name, code in COLUMNS.items()}
+            symbol_ids = {}
+    if len(columns["ts"]):
+        yield _columnar_block(columns, symbol_ids)
+
+
+def _columnar_block(columns, symbol_ids):
+    symbols = json.dumps(list(symbol_ids)).encode('utf-8')
+    parts = [struct.pack(BLOCK_HEADER_FORMAT, BLOCK_MAGIC, len(columns["ts"]), len(symbols)), symbols]
+    parts.extend(columns[name].tobytes() for name in COLUMNS)
+    return b"".join(parts)
+
+
+def read_columnar(f):
+    """Decode a columnar export (uncompressed file object) into trade dicts"""
+    while True:
+        header = f.read(BLOCK_HEADER_SIZE)
+        if len(header) < BLOCK_HEADER_SIZE:
+            return
+        magic, rows, symbols_len = struct.unpack(BLOCK_HEADER_FORMAT, header)
+        if magic != BLOCK_MAGIC:
+            raise ValueError("Invalid columnar export block")
+        symbols = json.loads(f.read(symbols_len))
+        columns = {}
+        for name, code in COLUMNS.items():
+            column = array(code)
+            column.frombytes(f.read(rows * column.itemsize))
+            columns[name] = column
+        for i in range(rows):
+            yield {
+                "ts": columns["ts"][i],
+                "symbol": symbols[columns["symbol"][i]],
+                "price": columns["price"][i],
+                "size": columns["size"][i],
+                "side": SIDE_NAMES.get(columns["side"][i]),
+                "tradeId": columns["trade_id"][i]
+            }
+
+
+def compress(chunks, compression):
+    """Stream-compress chunks; gzip header uses mtime 0 so output is reproducible"""
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard package is not installed (pip install zstandard)")
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+SPOOL_SUFFIX = ".spool"
+SPOOL_PARTIAL = ".part"     # export still being encoded (by this or another worker)
+SPOOL_STALE_SECONDS = 60    # a .part untouched this long was left by a dead worker
+
+
+class SpoolCache:
+    """Encoded exports kept on disk for ranged (resumed) downloads.
+
+    The first ranged request of an export starts encoding it into
+    ``directory`` on a background thread, under a name built from the
+    request and its source ETag; the request waits up to ``wait`` seconds
+    and otherwise gets ``None`` (the API answers 503 + Retry-After), so a
+    large export never holds a worker past proxy timeouts. Later ranges of
+    that export, from any worker, read the finished file. A new ETag
+    replaces the request's older file, and the rest are evicted least
+    recently used first beyond ``max_bytes`` or ``max_age`` seconds. Each
+    response reads through its own handle, so eviction never cuts one short.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3, max_age=3600.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._jobs = {}     # path -> Event, encodes running in this process
+        self._lock = threading.Lock()
+
+    def _paths(self, request_key, etag):
+        prefix = hashlib.sha1(repr(request_key).encode('utf-8')).hexdigest()[:20]
+        name = f"{prefix}-{hashlib.sha1(etag.encode('utf-8')).hexdigest()[:12]}{SPOOL_SUFFIX}"
+        return os.path.join(self.directory, name), prefix
+
+    def _lookup(self, path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)   # mtime = lần dùng gần nhất, cho LRU
+        except FileNotFoundError:
+            pass             # worker khác vừa evict: handle vẫn đọc được
+        return f, os.fstat(f.fileno()).st_size
+
+    def open(self, request_key, etag, chunks, valid=None, wait=None):
+        """(file, size) of the spooled export, or None while it is still being encoded.
+
+        On a miss ``chunks()`` is encoded in the background; ``valid()``
+        (if given) is checked once it is written and a False result
+        discards the file (the sources changed meanwhile). Waits up to
+        ``wait`` seconds (None = until done) for an encode of this process;
+        one running in another worker is not waited for.
+        """
+        path, prefix = self._paths(request_key, etag)
+        spooled = self._lookup(path)
+        if spooled is not None:
+            return spooled
+        done = self._start(path, prefix, chunks, valid)
+        if done is not None:
+            done.wait(wait)
+        return self._lookup(path)
+
+    def _start(self, path, prefix, chunks, valid):
+        """Event set when this process's encode of ``path`` ends; None if another worker runs it"""
+        with self._lock:
+            done = self._jobs.get(path)
+            if done is not None:
+                return done
+            os.makedirs(self.directory, exist_ok=True)
+            partial = path + SPOOL_PARTIAL
+            try:
+                fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(partial).st_mtime < SPOOL_STALE_SECONDS:
+                        return None
+                except FileNotFoundError:
+                    pass    # worker kia vừa xong (hoặc bỏ): thử lại ở request sau
+                else:
+                    _remove(partial)
+                return None
+            done = self._jobs[path] = threading.Event()
+        threading.Thread(target=self._encode, args=(fd, path, prefix, chunks, valid, done),
+                         name="export-spool", daemon=True).start()
+        return done
+
+    def _encode(self, fd, path, prefix, chunks, valid, done):
+        partial = path + SPOOL_PARTIAL
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks():
+                    out.write(chunk)
+            if valid is not None and not valid():
+                _remove(partial)
+            else:
+                os.replace(partial, path)
+                self.evict(keep=path, prefix=prefix)
+        except Exception as e:
+            logger.error(f"Error spooling export {os.path.basename(path)}: {e}")
+            _remove(partial)
+        finally:
+            with self._lock:
+                del self._jobs[path]
+            done.set()
+
+    def discard(self, request_key, etag):
+        """Remove an export spooled from sources that changed while it was encoded"""
+        _remove(self._paths(request_key, etag)[0])
+
+    def evict(self, keep=None, prefix=None):
+        """Drop older versions of ``prefix``, stale files, then the LRU beyond max_bytes"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if path == keep:
+                entries.append((float("inf"), stat.st_size, path))
+            elif (prefix and name.startswith(prefix + "-")) or now - stat.st_mtime > self.max_age:
+                # Cả tmp files của encode bị ngắt (worker chết): encode đang chạy thì vừa mới ghi
+                _remove(path)
+            elif name.endswith(SPOOL_SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes or path == keep:
+                break
+            _remove(path)
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read_range(f, start, stop):
+    """Yield bytes [start, stop) of a spooled file, closing it at the end"""
+    try:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(CHUNK_BYTES, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
@@ -0,0 +1,375 @@
+import os
+import threading
+import time
+import weakref
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: 0.1ms .. 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes: 256 .. 4M
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Records per batch: 1 .. 100k
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+class _Retire:
+    """Sentinel kept in a thread's local slot; freed (and finalized) when the thread exits"""
+
+    __slots__ = ("__weakref__",)
+
+
+class _Cells:
+    """Per-thread cells of one metric; each thread only ever writes its own cell.
+
+    Updates are plain adds without a lock (the GIL makes a single-writer
+    ``cell[i] += n`` safe); readers sum every cell at scrape time. The lock
+    is only taken when a thread creates its cell and when it exits: its
+    totals are then folded into ``base`` and the cell is dropped, so
+    thread-per-request servers do not grow the cell list.
+    """
+
+    __slots__ = ("_local", "_cells", "_base", "_lock", "_width", "_next_key")
+
+    def __init__(self, width):
+        self._local = threading.local()
+        self._cells = {}
+        self._base = [0] * width
+        self._lock = threading.Lock()
+        self._width = width
+        self._next_key = 0
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self._width
+            with self._lock:
+                key = self._next_key
+                self._next_key += 1
+                self._cells[key] = cell
+            sentinel = _Retire()
+            weakref.finalize(sentinel, self._retire, key)
+            self._local.sentinel = sentinel
+            self._local.cell = cell
+            return cell
+
+    def _retire(self, key):
+        with self._lock:
+            cell = self._cells.pop(key, None)
+            if cell is not None:
+                self._base = [total + value for total, value in zip(self._base, cell)]
+
+    def totals(self):
+        with self._lock:
+            cells = [self._base] + list(self._cells.values())
+        return [sum(values) for values in zip(*cells)]
+
+    def __len__(self):
+        return len(self._cells)
+
+
+class Counter:
+    """Monotonic counter; inc() adds to the calling thread's cell without a lock"""
+
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+
+    @property
+    def value(self):
+        return self._cells.totals()[0]
+
+
+class Gauge:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+
+class Histogram:
+    """Fixed buckets allocated up front; observe() is a bisect and two adds to a per-thread cell"""
+
+    __slots__ = ("bounds", "_cells")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # len(bounds) + 1 buckets (+Inf), rồi sum
+        self._cells = _Cells(len(bounds) + 2)
+
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self):
+        """(bucket counts, sum) summed over every thread's cell"""
+        totals = self._cells.totals()
+        return totals[:-1], float(totals[-1])
+
+
+class Family:
+    """A named metric with optional labels; children are created on first use"""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=None, func=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.func = func
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def _new_child(self):
+        if self.kind == "counter":
+            return Counter()
+        if self.kind == "gauge":
+            return Gauge()
+        return Histogram(self.buckets)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self._new_child()
+        return child
+
+    def samples(self, extra_labels=None):
+        """Prometheus sample lines for this family"""
+        extra = tuple((extra_labels or {}).items())
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception as e:
+                logger.debug(f"Metric callback {self.name} failed: {e}")
+                return []
+            if isinstance(value, dict):
+                # {label value: metric value} cho callback có một label
+                return [f"{self.name}{_labels(extra + ((self.labelnames[0], key),))} {_number(v)}"
+                        for key, v in value.items()]
+            return [f"{self.name}{_labels(extra)} {_number(value)}"]
+
+        lines = []
+        for values, child in list(self.children.items()):
+            labels = extra + tuple(zip(self.labelnames, values))
+            if self.kind == "histogram":
+                counts, total = child.snapshot()
+                cumulative = 0
+                for bound, count in zip(self.bounds_with_inf(), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+            else:
+                lines.append(f"{self.name}{_labels(labels)} {_number(child.value)}")
+        return lines
+
+    def bounds_with_inf(self):
+        return [_number(bound) for bound in self.buckets] + ["+Inf"]
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Registry:
+    """Process-wide metric registry; registering a name twice returns the same metric"""
+
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _register(self, kind, name, documentation, labelnames=(), buckets=None, func=None):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = Family(kind, name, documentation, labelnames, buckets, func)
+            elif func is not None:
+                family.func = func
+        # Không có label: trả về metric luôn để hot path khỏi phải gọi labels()
+        if not family.labelnames and func is None:
+            return family.labels()
+        return family
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self._register("counter", name, documentation, labelnames, func=func)
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._register("gauge", name, documentation, labelnames, func=func)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register("histogram", name, documentation, labelnames, tuple(buckets))
+
+    def collect(self, extra_labels=None):
+        """[(name, kind, help, sample lines)] for rendering or merging across processes"""
+        return [(family.name, family.kind, family.documentation, family.samples(extra_labels))
+                for family in list(self.families.values())]
+
+    def render(self, extra_labels=None):
+        return render(self.collect(extra_labels))
+
+
+def render(collected):
+    """Prometheus text exposition format"""
+    lines = []
+    for name, kind, documentation, samples in collected:
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def merge(*collections):
+    """Merge collect() results of several processes, one block per metric name"""
+    merged = {}
+    for collected in collections:
+        for name, kind, documentation, samples in collected:
+            if name in merged:
+                merged[name][3].extend(samples)
+            else:
+                merged[name] = [name, kind, documentation, list(samples)]
+    return list(merged.values())
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class WorkerSnapshots:
+    """Share metrics between gunicorn workers through small JSON files.
+
+    Each worker writes its own samples (labelled ``worker=<pid>``) every
+    ``interval`` seconds; whichever worker serves /metrics merges its live
+    samples with the other workers' recent snapshots.
+    """
+
+    def __init__(self, snapshot_dir, registry=REGISTRY, interval=5.0, max_age=30.0):
+        self.snapshot_dir = snapshot_dir
+        self.registry = registry
+        self.interval = interval
+        self.max_age = max_age
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def labels(self):
+        return {"worker": str(os.getpid())}
+
+    def ensure_started(self):
+        """Started lazily so every gunicorn worker gets its own thread after fork"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            self.thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+            self.thread.start()
+
+    def _path(self, pid):
+        return os.path.join(self.snapshot_dir, f"worker_{pid}.json")
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"Error writing metrics snapshot: {e}")
+            time.sleep(self.interval)
+
+    def write(self):
+        path = self._path(os.getpid())
+        with open(path + ".tmp", 'wb') as f:
+            f.write(codec.dumps(self.registry.collect(self.labels())))
+        os.replace(path + ".tmp", path)
+
+    def render(self):
+        """Live samples of this worker plus fresh snapshots of the others"""
+        collections = [self.registry.collect(self.labels())]
+        own = os.path.basename(self._path(os.getpid()))
+        now = time.time()
+        try:
+            names = os.listdir(self.snapshot_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name == own or not name.startswith("worker_") or not name.endswith(".json"):
+                continue
+            path = os.path.join(self.snapshot_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)  # worker đã chết
+                    continue
+                with open(path, 'rb') as f:
+                    collections.append(codec.loads(f.read()))
+            except (OSError, ValueError):
+                continue
+        return render(merge(*collections))
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics from a daemon thread (collector side exporter)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics exporter listening on {host}:{port}/metrics")
+    return server
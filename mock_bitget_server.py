@@ -0,0 +1,352 @@
+import asyncio
+import argparse
+import gzip
+import json
+import random
+import signal
+import time
+import logging
+
+import websockets
+
+import codec
+from order_book import OrderBook
+from trade_record import compact_record
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RESULT_PREFIX = "MOCK_RESULT "
+
+
+def synthetic_symbols(count):
+    """Symbol names for synthetic streams: the real 10 first, then SYM0011USDT, ..."""
+    base = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "ADAUSDT", "DOTUSDT",
+            "BNBUSDT", "XRPUSDT", "MATICUSDT", "LINKUSDT", "AVAXUSDT"]
+    return base[:count] + [f"SYM{i:04d}USDT" for i in range(len(base) + 1, count + 1)]
+
+
+def open_replay(path):
+    """Iterate records of an NDJSON file (plain or .gz: /api/export output, trade log segments)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield compact_record(codec.loads(line))
+
+
+def replay_symbols(path, scan=100000):
+    """Symbols found in the first ``scan`` records of a replay file"""
+    symbols = []
+    for i, record in enumerate(open_replay(path)):
+        if i >= scan:
+            break
+        if record["symbol"] not in symbols:
+            symbols.append(record["symbol"])
+    return symbols
+
+
+class MockBook:
+    """Synthetic L2 book of one symbol on a fixed price grid.
+
+    The state is kept in an OrderBook, so every push carries the same
+    checksum (top 25 levels) the exchange would send.
+    """
+
+    def __init__(self, symbol, depth=50, price_tick=0.01):
+        self.symbol = symbol
+        self.depth = depth
+        self.price_tick = price_tick
+        self.mid = random.randint(100000, 2000000)  # giá giữa, tính theo số ticks
+        self.seq = 0
+        self.book = OrderBook(symbol)
+        self.book.apply("snapshot", {
+            "bids": [[self.price(self.mid - i), self.size()] for i in range(1, depth + 1)],
+            "asks": [[self.price(self.mid + i), self.size()] for i in range(1, depth + 1)]
+        })
+
+    def price(self, level):
+        return f"{level * self.price_tick:.2f}"
+
+    @staticmethod
+    def size():
+        return f"{random.uniform(0.001, 5):.4f}"
+
+    def data(self, bids, asks, now_ms):
+        self.seq += 1
+        return {"asks": asks, "bids": bids, "checksum": self.book.checksum(), "seq": self.seq, "ts": str(now_ms)}
+
+    def snapshot(self, now_ms):
+        book = self.book
+        bids = [list(book.bids[-key]) for key in book.bid_keys]
+        asks = [list(book.asks[key]) for key in book.ask_keys]
+        return self.data(bids, asks, now_ms)
+
+    def update(self, now_ms, changes=3):
+        """Change a few levels near the top (size updates, removals, new levels)"""
+        bids, asks = [], []
+        for _ in range(random.randint(1, changes)):
+            side, sign = random.choice(((bids, -1), (asks, 1)))
+            level = self.mid + sign * random.randint(1, self.depth + 5)
+            side.append([self.price(level), "0" if random.random() < 0.25 else self.size()])
+        self.book.apply("update", {"bids": bids, "asks": asks})
+        return self.data(bids, asks, now_ms)
+
+
+class MockBitgetServer:
+    """Local stand-in for the Bitget v2 public WebSocket (trade and books channels).
+
+    Accepts the same subscribe/unsubscribe/ping protocol as the exchange.
+    Trades are either synthetic (``rate`` messages/s spread over all
+    connections and their subscribed symbols) or replayed from a recorded
+    NDJSON file at ``speed`` times real time. Every trade carries ts = send
+    time, so consumers can measure end-to-end latency. A ``books``
+    subscription gets a snapshot, then ``book_rate`` checksummed deltas/s
+    are spread over all subscribed books (0 = books are only acked).
+    """
+
+    def __init__(self, rate=1000, trades_per_msg=1, replay=None, speed=1.0, tick=0.01, book_rate=200):
+        self.rate = rate
+        self.trades_per_msg = trades_per_msg
+        self.replay = replay
+        self.speed = speed
+        self.tick = tick
+        self.book_rate = book_rate
+        self.connections = {}   # websocket -> list of subscribed symbols
+        self.book_subscribers = {}  # symbol -> set of websockets subscribed to its book
+        self.books = {}
+        self.trade_ids = {}
+        self.prices = {}
+        self.sent_messages = 0
+        self.sent_trades = 0
+        self.sent_book_messages = 0
+        self.started = None
+
+    async def handler(self, ws):
+        subscribed = []
+        self.connections[ws] = subscribed
+        logger.info(f"Client connected ({len(self.connections)} total)")
+        try:
+            async for message in ws:
+                if message == "ping":
+                    await ws.send("pong")
+                    continue
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    continue
+                op = request.get("op")
+                if op in ("subscribe", "unsubscribe"):
+                    for arg in request.get("args", []):
+                        await ws.send(json.dumps({"event": op, "arg": arg}))
+                        channel = arg.get("channel", "trade")
+                        symbol = arg.get("instId")
+                        if channel == "trade" and op == "subscribe":
+                            subscribed.append(symbol)
+                        elif channel == "books":
+                            await self.subscribe_book(ws, symbol, op == "subscribe")
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.pop(ws, None)
+            for subscribers in self.book_subscribers.values():
+                subscribers.discard(ws)
+
+    async def subscribe_book(self, ws, symbol, subscribe):
+        """Register (or drop) a books subscriber; a new subscriber first gets a snapshot"""
+        subscribers = self.book_subscribers.setdefault(symbol, set())
+        if not subscribe:
+            subscribers.discard(ws)
+            return
+        if not self.book_rate:
+            return  # books tắt: chỉ ack như trước
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = MockBook(symbol)
+        # Snapshot và đăng ký cùng một bước (không await ở giữa): không lỡ delta nào
+        message = self.book_push(symbol, "snapshot", book.snapshot(int(time.time() * 1000)))
+        subscribers.add(ws)
+        await self.send_book(ws, message)
+
+    def make_trade(self, symbol, now_ms, price=None, size=None, side=None):
+        trade_id = self.trade_ids.get(symbol, 10 ** 17) + 1
+        self.trade_ids[symbol] = trade_id
+        if price is None:
+            price = self.prices.get(symbol) or random.uniform(10, 200)
+            price = max(price * (1 + random.gauss(0, 0.0005)), 0.01)
+            self.prices[symbol] = price
+        return {
+            "ts": str(now_ms),
+            "price": f"{price:.4f}",
+            "size": f"{size if size is not None else random.uniform(0.001, 5):.4f}",
+            "side": side or random.choice(("buy", "sell")),
+            "tradeId": str(trade_id)
+        }
+
+    @staticmethod
+    def push(symbol, trades):
+        return json.dumps({
+            "action": "update",
+            "arg": {"instType": "SPOT", "channel": "trade", "instId": symbol},
+            "data": trades,
+            "ts": int(time.time() * 1000)
+        })
+
+    @staticmethod
+    def book_push(symbol, action, data):
+        return json.dumps({
+            "action": action,
+            "arg": {"instType": "SPOT", "channel": "books", "instId": symbol},
+            "data": [data],
+            "ts": int(time.time() * 1000)
+        })
+
+    async def send_book(self, ws, message):
+        try:
+            await ws.send(message)
+        except websockets.ConnectionClosed:
+            return
+        self.sent_book_messages += 1
+
+    async def send(self, ws, symbol, trades):
+        try:
+            await ws.send(self.push(symbol, trades))
+        except websockets.ConnectionClosed:
+            return
+        self.sent_messages += 1
+        self.sent_trades += len(trades)
+
+    async def run_synthetic(self):
+        """Send ``rate`` msgs/s, round-robin over each connection's symbols"""
+        budget = 0.0
+        cursors = {}
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.perf_counter()
+            budget = min(budget + (now - last) * self.rate, self.rate)  # tối đa 1s backlog
+            last = now
+            active = [(ws, symbols) for ws, symbols in list(self.connections.items()) if symbols]
+            if not active or budget < 1:
+                continue
+            share = int(budget) // len(active)
+            now_ms = int(time.time() * 1000)
+            for ws, symbols in active:
+                cursor = cursors.get(ws, 0)
+                for i in range(share):
+                    symbol = symbols[(cursor + i) % len(symbols)]
+                    trades = [self.make_trade(symbol, now_ms) for _ in range(self.trades_per_msg)]
+                    await self.send(ws, symbol, trades)
+                cursors[ws] = cursor + share
+            budget -= share * len(active)
+
+    async def run_books(self):
+        """Send ``book_rate`` book deltas/s, round-robin over the subscribed books"""
+        budget = 0.0
+        cursor = 0
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.perf_counter()
+            budget = min(budget + (now - last) * self.book_rate, self.book_rate)
+            last = now
+            symbols = [symbol for symbol, subscribers in self.book_subscribers.items() if subscribers]
+            if not symbols or budget < 1:
+                continue
+            now_ms = int(time.time() * 1000)
+            for i in range(int(budget)):
+                symbol = symbols[(cursor + i) % len(symbols)]
+                message = self.book_push(symbol, "update", self.books[symbol].update(now_ms))
+                for ws in list(self.book_subscribers[symbol]):
+                    await self.send_book(ws, message)
+            cursor += int(budget)
+            budget -= int(budget)
+
+    async def run_replay(self):
+        """Replay recorded trades with their original spacing divided by ``speed``"""
+        while not self.connections:
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1.0)  # chờ subscriptions
+        first_ts = None
+        start = time.perf_counter()
+        pending = {}
+        for record in open_replay(self.replay):
+            if first_ts is None:
+                first_ts = record["ts"]
+            due = (record["ts"] - first_ts) / 1000 / self.speed
+            delay = due - (time.perf_counter() - start)
+            if delay > self.tick:
+                await self.flush_replay(pending)
+                pending = {}
+                await asyncio.sleep(delay)
+            symbol = record["symbol"]
+            pending.setdefault(symbol, []).append(record)
+        await self.flush_replay(pending)
+        logger.info("Replay finished")
+
+    async def flush_replay(self, pending):
+        now_ms = int(time.time() * 1000)
+        for symbol, records in pending.items():
+            receivers = [ws for ws, symbols in list(self.connections.items()) if symbol in symbols]
+            if not receivers:
+                continue
+            trades = [self.make_trade(symbol, now_ms, record["price"], record["size"], record["side"])
+                      for record in records]
+            for ws in receivers:
+                for i in range(0, len(trades), 100):
+                    await self.send(ws, symbol, trades[i:i + 100])
+
+    async def report(self, interval=5.0):
+        previous = 0
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"Sent {self.sent_messages} msgs / {self.sent_trades} trades / {self.sent_book_messages} book msgs "
+                        f"({(self.sent_messages - previous) / interval:.0f} msgs/s, {len(self.connections)} connections)")
+            previous = self.sent_messages
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return {
+            "sent_messages": self.sent_messages,
+            "sent_trades": self.sent_trades,
+            "sent_book_messages": self.sent_book_messages,
+            "elapsed_s": round(elapsed, 3),
+            "msgs_per_s": round(self.sent_messages / elapsed, 1) if elapsed else 0.0
+        }
+
+    async def serve(self, host, port, duration=None):
+        stop = asyncio.get_running_loop().create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        async with websockets.serve(self.handler, host, port, max_queue=None, compression=None):
+            logger.info(f"Mock Bitget server on ws://{host}:{port} "
+                        f"({'replay ' + self.replay if self.replay else f'{self.rate} msgs/s synthetic'})")
+            self.started = time.perf_counter()
+            tasks = [asyncio.create_task(self.run_replay() if self.replay else self.run_synthetic()),
+                     asyncio.create_task(self.report())]
+            if self.book_rate:
+                tasks.append(asyncio.create_task(self.run_books()))
+            try:
+                await asyncio.wait_for(stop, duration)
+            except asyncio.TimeoutError:
+                pass
+            for task in tasks:
+                task.cancel()
+        print(RESULT_PREFIX + json.dumps(self.summary()), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Bitget WebSocket server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=1000, help="Synthetic messages per second (all connections)")
+    parser.add_argument("--trades-per-msg", type=int, default=1)
+    parser.add_argument("--replay", help="NDJSON(.gz) file of trades to replay instead of synthetic data")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed as a multiple of real time")
+    parser.add_argument("--book-rate", type=float, default=200,
+                        help="Order book deltas per second over all books subscriptions (0 = only ack them)")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    server = MockBitgetServer(args.rate, args.trades_per_msg, args.replay, args.speed, book_rate=args.book_rate)
+    asyncio.run(server.serve(args.host, args.port, args.duration))
@@ -0,0 +1,202 @@
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+from bisect import bisect_left, insort
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_LEVELS = 25    # Bitget checksum covers the first 25 levels of each side
+
+# Compact snapshot: magic, exchange ts, seq, bid levels, ask levels; then (price, size) float64 pairs
+BOOK_MAGIC = b"TRBOOK01"
+BOOK_HEADER_FORMAT = "<8sqqII"
+BOOK_HEADER_SIZE = struct.calcsize(BOOK_HEADER_FORMAT)
+LEVEL_SIZE = 16
+
+
+class OrderBook:
+    """L2 book of one symbol maintained from snapshot + delta pushes.
+
+    Each side is a dict price -> (price string, size string) plus a sorted
+    list of price keys (bids negated), so best-first reads are a slice of
+    that list and an update is one bisect. The exchange strings are kept
+    because the checksum is computed over them.
+    """
+
+    __slots__ = ("symbol", "bids", "asks", "bid_keys", "ask_keys", "ts", "seq", "valid", "dirty")
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = {}
+        self.asks = {}
+        self.bid_keys = []   # -price, tăng dần => best bid trước
+        self.ask_keys = []   # price, tăng dần => best ask trước
+        self.ts = 0
+        self.seq = 0
+        self.valid = False
+        self.dirty = False
+
+    def apply(self, action, data):
+        """Apply one push; returns False when the checksum does not match"""
+        if action == "snapshot":
+            self.bids.clear()
+            self.asks.clear()
+            self.bid_keys.clear()
+            self.ask_keys.clear()
+            self.valid = True
+        elif not self.valid:
+            return True  # chờ snapshot mới sau resync
+        _apply_levels(self.bids, self.bid_keys, data.get("bids", ()), -1.0)
+        _apply_levels(self.asks, self.ask_keys, data.get("asks", ()), 1.0)
+        self.ts = int(data.get("ts") or 0)
+        self.seq = int(data.get("seq") or 0)
+        self.dirty = True
+
+        expected = data.get("checksum")
+        if expected and self.checksum() != int(expected):
+            self.valid = False
+            return False
+        return True
+
+    def checksum(self):
+        """Signed CRC32 of 'bid1p:bid1s:ask1p:ask1s:...' over the top 25 levels"""
+        parts = []
+        bids = self.bid_keys
+        asks = self.ask_keys
+        for i in range(CHECKSUM_LEVELS):
+            if i < len(bids):
+                parts.extend(self.bids[-bids[i]])
+            if i < len(asks):
+                parts.extend(self.asks[asks[i]])
+        value = zlib.crc32(":".join(parts).encode('utf-8'))
+        return value - (1 << 32) if value >= (1 << 31) else value
+
+    def top(self, depth):
+        """Best ``depth`` levels per side as (price, size) floats, O(depth)"""
+        bids = [(-key, float(self.bids[-key][1])) for key in self.bid_keys[:depth]]
+        asks = [(key, float(self.asks[key][1])) for key in self.ask_keys[:depth]]
+        return bids, asks
+
+
+def _apply_levels(levels, keys, updates, sign):
+    for price_text, size_text in updates:
+        price = float(price_text)
+        if float(size_text) == 0:
+            if levels.pop(price, None) is not None:
+                del keys[bisect_left(keys, sign * price)]
+        else:
+            if price not in levels:
+                insort(keys, sign * price)
+            levels[price] = (price_text, size_text)
+
+
+class OrderBooks:
+    """Per-symbol order books plus a thread persisting compact snapshots.
+
+    ``handle`` runs on the ingest thread; every ``snapshot_interval`` the
+    books that changed are written (top ``snapshot_depth`` levels) to
+    ``books_dir/<SYMBOL>.book``, which is what the API serves.
+    """
+
+    def __init__(self, books_dir, snapshot_depth=200, snapshot_interval=1.0, on_resync=None):
+        self.books_dir = books_dir
+        self.snapshot_depth = snapshot_depth
+        self.snapshot_interval = snapshot_interval
+        self.on_resync = on_resync
+        self.books = {}
+        self.resyncs = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.is_running = False
+
+    def handle(self, symbol, action, data):
+        """Apply the data items of one books push"""
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = OrderBook(symbol)
+            was_valid = book.valid
+            for item in data:
+                if not book.apply(action, item):
+                    break
+            failed = not book.valid and (was_valid or action == "snapshot")
+        # Chỉ resubscribe một lần; các updates tiếp theo bị bỏ qua tới khi có snapshot mới
+        if failed:
+            self.resyncs += 1
+            logger.warning(f"[PRODUCTION] Order book checksum mismatch for {symbol}, resubscribing")
+            if self.on_resync is not None:
+                self.on_resync(symbol)
+
+    def start(self):
+        os.makedirs(self.books_dir, exist_ok=True)
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="order-book-snapshots", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.is_running:
+            time.sleep(self.snapshot_interval)
+            self.persist()
+
+    def persist(self):
+        """Write snapshots of the valid books that changed since the last call"""
+        pending = []
+        with self.lock:
+            for book in self.books.values():
+                if book.dirty and book.valid:
+                    book.dirty = False
+                    pending.append((book.symbol, book.ts, book.seq) + book.top(self.snapshot_depth))
+        for symbol, ts, seq, bids, asks in pending:
+            try:
+                write_book(self.books_dir, symbol, ts, seq, bids, asks)
+            except OSError as e:
+                logger.error(f"Error saving order book {symbol}: {e}")
+
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None:
+            self.persist()
+
+
+def _book_path(books_dir, symbol):
+    return os.path.join(books_dir, f"{symbol.upper()}.book")
+
+
+def write_book(books_dir, symbol, ts, seq, bids, asks):
+    path = _book_path(books_dir, symbol)
+    levels = [value for level in bids + asks for value in level]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(BOOK_HEADER_FORMAT, BOOK_MAGIC, ts, seq, len(bids), len(asks)))
+        f.write(struct.pack(f"<{len(levels)}d", *levels))
+    os.replace(tmp_path, path)
+
+
+def read_book(books_dir, symbol, depth):
+    """Best ``depth`` levels of a persisted book, reading only those bytes.
+
+    Returns (ts, seq, bids, asks, file mtime) or None if there is no book.
+    """
+    try:
+        with open(_book_path(books_dir, symbol), 'rb') as f:
+            header = f.read(BOOK_HEADER_SIZE)
+            if len(header) < BOOK_HEADER_SIZE:
+                return None
+            magic, ts, seq, bid_count, ask_count = struct.unpack(BOOK_HEADER_FORMAT, header)
+            if magic != BOOK_MAGIC:
+                raise ValueError(f"Invalid order book file for {symbol}")
+            bids = _read_levels(f, min(depth, bid_count))
+            f.seek(BOOK_HEADER_SIZE + bid_count * LEVEL_SIZE)
+            asks = _read_levels(f, min(depth, ask_count))
+            mtime = os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        return None
+    return ts, seq, bids, asks, mtime
+
+
+def _read_levels(f, count):
+    values = struct.unpack(f"<{count * 2}d", f.read(count * LEVEL_SIZE))
+    return [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
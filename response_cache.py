@@ -0,0 +1,67 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """One serialized response body for a given data version"""
+
+    __slots__ = ("tag", "body", "mimetype", "gzip_body")
+
+    def __init__(self, tag, body, mimetype):
+        self.tag = tag
+        self.body = body
+        self.mimetype = mimetype
+        self.gzip_body = None
+
+
+class ResponseCache:
+    """LRU of pre-serialized response bodies keyed by endpoint + query args.
+
+    An entry is only reused while its ``tag`` (the data version) matches;
+    the gzip variant is compressed once, on first request, and kept next
+    to the plain body.
+    """
+
+    def __init__(self, max_entries=256, gzip_min_bytes=1024, gzip_level=6):
+        self.max_entries = max_entries
+        self.gzip_min_bytes = gzip_min_bytes
+        self.gzip_level = gzip_level
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, tag):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.tag != tag:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, tag, body, mimetype):
+        entry = CachedResponse(tag, body, mimetype)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def gzipped(self, entry):
+        """Compressed body, or None when the body is too small to bother"""
+        if len(entry.body) < self.gzip_min_bytes:
+            return None
+        if entry.gzip_body is None:
+            entry.gzip_body = gzip.compress(entry.body, self.gzip_level)
+        return entry.gzip_body
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
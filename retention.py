@@ -0,0 +1,255 @@
+import gzip
+import heapq
+import os
+import shutil
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+import codec
+from trade_record import compact_record
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def day_of(ts):
+    """UTC day (YYYY-MM-DD) of an exchange ts in ms"""
+    return datetime.fromtimestamp(ts / 1000, timezone.utc).strftime("%Y-%m-%d")
+
+
+def day_start(day):
+    """Exchange ts (ms) at 00:00 UTC of a YYYY-MM-DD day"""
+    return int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class TradeArchive:
+    """Compressed cold tier: archive/<day>/<SYMBOL>/<segment>.ndjson.gz.
+
+    Every file is written once (tmp + rename) from one sealed trade log
+    segment, so re-running an interrupted compaction just rewrites the
+    same files. ``manifest.json`` indexes files by day and symbol with
+    record counts and ts bounds, and lists segments that are archived but
+    not yet deleted from the trade log.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    # ------------------------------------------------------------------
+    # Read side (safe for the API server)
+    # ------------------------------------------------------------------
+    def manifest_path(self):
+        return os.path.join(self.archive_dir, MANIFEST_NAME)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path(), 'rb') as f:
+                return codec.loads(f.read())
+        except FileNotFoundError:
+            return {"days": {}, "pending_segments": []}
+
+    def first_ts(self, manifest=None):
+        """Oldest archived trade ts, or None"""
+        manifest = manifest or self.load_manifest()
+        for day in sorted(manifest["days"]):
+            entries = [entry for files in manifest["days"][day].values() for entry in files]
+            if entries:
+                return min(entry["first_ts"] for entry in entries)
+        return None
+
+    def select(self, symbols=None, from_ts=None, to_ts=None, manifest=None):
+        """(day, [file entries]) overlapping the range, oldest day first"""
+        manifest = manifest or self.load_manifest()
+        for day in sorted(manifest["days"]):
+            start = day_start(day)
+            if from_ts is not None and start + DAY_MS <= from_ts:
+                continue
+            if to_ts is not None and start > to_ts:
+                break
+            entries = []
+            for symbol, files in manifest["days"][day].items():
+                if symbols is not None and symbol.upper() not in symbols:
+                    continue
+                for entry in files:
+                    if from_ts is not None and entry["last_ts"] < from_ts:
+                        continue
+                    if to_ts is not None and entry["first_ts"] > to_ts:
+                        continue
+                    entries.append(entry)
+            yield day, entries
+
+    def iter_records(self, symbols=None, from_ts=None, to_ts=None, manifest=None):
+        """Archived records day by day, merged across files in ts order"""
+        for _, entries in self.select(symbols, from_ts, to_ts, manifest):
+            streams = [self._iter_file(os.path.join(self.archive_dir, entry["file"])) for entry in entries]
+            yield from heapq.merge(*streams, key=lambda record: record["ts"])
+
+    def _iter_file(self, path):
+        try:
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    yield codec.loads(line)
+        except FileNotFoundError:
+            # File vừa bị expire bởi compaction
+            return
+
+    # ------------------------------------------------------------------
+    # Write side (compaction job in the data collector)
+    # ------------------------------------------------------------------
+    def save_manifest(self, manifest):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = self.manifest_path() + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(codec.dumps(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path())
+
+    def archive_segment(self, trade_log, index, manifest):
+        """Split one sealed segment into per-day/per-symbol gzip files"""
+        writers = {}
+        try:
+            for record in trade_log.iter_segment(index):
+                record = compact_record(record)
+                ts = record["ts"]
+                key = (day_of(ts), record["symbol"])
+                writer = writers.get(key)
+                if writer is None:
+                    relative = os.path.join(key[0], key[1], f"{index:06d}.ndjson.gz")
+                    path = os.path.join(self.archive_dir, relative)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = writers[key] = {
+                        "file": relative,
+                        "handle": gzip.GzipFile(path + ".tmp", 'wb', compresslevel=6, mtime=0),
+                        "records": 0, "first_ts": ts, "last_ts": ts
+                    }
+                writer["handle"].write(codec.dumps(record) + b"\n")
+                writer["records"] += 1
+                writer["first_ts"] = min(writer["first_ts"], ts)
+                writer["last_ts"] = max(writer["last_ts"], ts)
+        finally:
+            for writer in writers.values():
+                writer["handle"].close()
+
+        total = 0
+        for (day, symbol), writer in writers.items():
+            path = os.path.join(self.archive_dir, writer["file"])
+            os.replace(path + ".tmp", path)
+            files = manifest["days"].setdefault(day, {}).setdefault(symbol, [])
+            files[:] = [entry for entry in files if entry["segment"] != index]
+            files.append({
+                "file": writer["file"],
+                "segment": index,
+                "records": writer["records"],
+                "first_ts": writer["first_ts"],
+                "last_ts": writer["last_ts"],
+                "bytes": os.path.getsize(path)
+            })
+            total += writer["records"]
+        return total
+
+    def expire(self, manifest, before_day):
+        """Delete archived days older than ``before_day`` (candles stay)"""
+        removed = []
+        for day in sorted(manifest["days"]):
+            if day >= before_day:
+                break
+            shutil.rmtree(os.path.join(self.archive_dir, day), ignore_errors=True)
+            del manifest["days"][day]
+            removed.append(day)
+        return removed
+
+
+class RetentionManager:
+    """Background compaction of the trade log into tiers.
+
+    - hot: raw segments in the trade log for ``hot_days``, and the rows of
+      ``column_store`` (the API's mmap store) for the same window
+    - cold: per-day/per-symbol gzip archives until ``archive_days``
+    - beyond that only the candle files are kept
+    Runs on its own thread every ``interval`` seconds, never on ingest.
+    """
+
+    def __init__(self, trade_log, archive_dir, hot_days=7, archive_days=365, interval=3600, column_store=None):
+        self.trade_log = trade_log
+        self.column_store = column_store
+        self.archive = TradeArchive(archive_dir)
+        self.hot_days = hot_days
+        self.archive_days = archive_days
+        self.interval = interval
+        self.is_running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.last_run = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.is_running:
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Retention compaction failed: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def compact(self, now=None):
+        """Archive sealed segments older than the hot window, expire old archives"""
+        now = time.time() if now is None else now
+        manifest = self.archive.load_manifest()
+        hot_cutoff = now - self.hot_days * 86400
+
+        # Segments đã archive nhưng chưa xoá (crash giữa chừng)
+        for index in list(manifest["pending_segments"]):
+            self._remove_segment(index, manifest)
+
+        active = self.trade_log.active_index
+        for index in self.trade_log.list_segments():
+            if index == active or (self.thread is not None and not self.is_running):
+                break
+            try:
+                # mtime = lần ghi cuối, mọi trade trong segment đều cũ hơn
+                if os.path.getmtime(self.trade_log.segment_path(index)) >= hot_cutoff:
+                    break
+            except FileNotFoundError:
+                continue
+            started = time.time()
+            count = self.archive.archive_segment(self.trade_log, index, manifest)
+            manifest["pending_segments"].append(index)
+            self.archive.save_manifest(manifest)
+            self._remove_segment(index, manifest)
+            logger.info(f"Archived segment {index:06d}: {count} trades in {time.time() - started:.1f}s")
+
+        if self.column_store is not None:
+            # Rows cũ hơn hot window vẫn có trong archives
+            self.column_store.drop_before(int(hot_cutoff * 1000))
+
+        if self.archive_days is not None:
+            before_day = (datetime.fromtimestamp(now, timezone.utc) - timedelta(days=self.archive_days)).strftime("%Y-%m-%d")
+            removed = self.archive.expire(manifest, before_day)
+            if removed:
+                logger.info(f"Expired archives for {len(removed)} days (candles kept): {removed[0]} .. {removed[-1]}")
+        self.archive.save_manifest(manifest)
+        self.last_run = now
+
+    def _remove_segment(self, index, manifest):
+        try:
+            os.remove(self.trade_log.segment_path(index))
+        except FileNotFoundError:
+            pass
+        manifest["pending_segments"].remove(index)
+        self.archive.save_manifest(manifest)
+
+    def stop(self):
+        self.is_running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+            self.thread = None
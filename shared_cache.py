@@ -0,0 +1,209 @@
+import fcntl
+import glob
+import os
+import time
+import zlib
+import logging
+
+import metrics
+from column_store import read_extent
+from trade_cache import TradeCache, Snapshot, load_stats, split_indexes, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "leader.lock"
+PUBLISH_BUDGET = 0.05   # leader dành tối đa ~5% thời gian cho việc ghi snapshot
+
+PUBLISH_SECONDS = metrics.histogram("shared_cache_publish_seconds", "Leader: refresh + snapshot write time")
+LOAD_SECONDS = metrics.histogram("shared_cache_load_seconds", "Time to map a new snapshot generation")
+
+
+def default_snapshot_dir(columns_dir):
+    """tmpfs when available, so snapshot pages never touch the disk.
+
+    The name is derived from the column store path so two deployments on
+    one host (e.g. a benchmark next to production) never share a loader.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        key = zlib.crc32(os.path.abspath(columns_dir).encode('utf-8'))
+        return os.path.join("/dev/shm", f"trading_api_cache_{key:08x}")
+    return "cache_snapshots"
+
+
+class SharedTradeCache(TradeCache):
+    """TradeCache shared by all gunicorn workers through snapshot files.
+
+    One worker holds an flock on ``leader.lock`` and is the only loader:
+    it refreshes a private TradeCache and publishes its indexes and
+    aggregates as an immutable, generation-numbered snapshot file. Every
+    worker (the leader included) serves requests from the newest snapshot
+    mapped read-only, so the indexes exist once in the page cache however
+    many workers there are, and all workers agree on the data version.
+    If the leader dies its lock is released and the next worker to poll
+    takes over.
+
+    Every generation is a full copy of the indexes (about 16 bytes per
+    cached row per index it is in: ~15 MB and ~10 ms for 200k rows), so
+    the leader publishes at most every ``publish_interval`` seconds and
+    backs off further when writing takes more than PUBLISH_BUDGET of its
+    time. Trades arriving in between show up in the next generation.
+    """
+
+    def __init__(self, columns_dir, max_records, refresh_interval=1.0, snapshot_dir=None, keep=3,
+                 checkpoint_path=None, checkpoint_interval=60.0, startup_wait=10.0,
+                 large_trade_usd=1000.0, large_trade_max=100000, publish_interval=1.0):
+        super().__init__(columns_dir, max_records, refresh_interval, checkpoint_path, checkpoint_interval,
+                         large_trade_usd, large_trade_max)
+        self.publish_interval = publish_interval
+        self.next_publish = 0.0
+        self.columns_dir = columns_dir
+        self.startup_wait = startup_wait
+        self.snapshot_dir = snapshot_dir or default_snapshot_dir(columns_dir)
+        self.keep = keep
+        self.generation = 0
+        self.snapshot = None
+        self.builder = None       # TradeCache riêng, chỉ có ở leader
+        self.lock_fd = None
+        self.published_version = -1
+        self.published_first_row = -1
+
+    @property
+    def is_leader(self):
+        return self.builder is not None
+
+    def _snapshot_path(self, generation):
+        return os.path.join(self.snapshot_dir, f"gen_{generation:012d}.snap")
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.snapshot_dir, CURRENT_FILE), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def try_lead(self):
+        """Take the loader role if no other worker holds it (non-blocking)"""
+        if self.builder is not None:
+            return True
+        if self.lock_fd is None:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            self.lock_fd = os.open(os.path.join(self.snapshot_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        for path in glob.glob(os.path.join(self.snapshot_dir, "*.tmp")):
+            os.remove(path)  # leader trước chết giữa chừng
+        self.builder = TradeCache(self.columns_dir, self.max_records, self.refresh_interval,
+                                  self.checkpoint_path, self.checkpoint_interval,
+                                  self.large_trade_usd, self.large_trade_max)
+        self.published_version = -1
+        self.published_first_row = -1
+        logger.info(f"Worker {os.getpid()} is now the cache loader")
+        # Generation hiện tại (tmpfs) hoặc checkpoint trên disk: chỉ ingest phần đuôi
+        current = self._current_generation()
+        self.builder.warm_start([self._snapshot_path(current)] if current else [])
+        return True
+
+    def publish(self):
+        """Leader: refresh the private cache and write a new generation if it changed"""
+        started = time.time()
+        self.builder.refresh()
+        self.builder.maybe_checkpoint()
+        if (self.builder.version, self.builder.first_row) == (self.published_version, self.published_first_row):
+            return
+        if started < self.next_publish:
+            return
+        generation = max(self._current_generation(), self.generation) + 1
+        write_snapshot(self._snapshot_path(generation), generation, self.builder)
+        current = os.path.join(self.snapshot_dir, CURRENT_FILE)
+        with open(current + ".tmp", 'w') as f:
+            f.write(str(generation))
+        os.replace(current + ".tmp", current)
+        self.published_version = self.builder.version
+        self.published_first_row = self.builder.first_row
+        duration = time.time() - started
+        self.next_publish = started + max(self.publish_interval, duration / PUBLISH_BUDGET)
+        PUBLISH_SECONDS.observe(duration)
+
+        # Workers khác có thể còn map bản cũ: unlink không ảnh hưởng tới mmap đang mở
+        for old in sorted(glob.glob(os.path.join(self.snapshot_dir, "gen_*.snap")))[:-self.keep]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    def load_latest(self):
+        """Map the newest published generation; returns True if it changed"""
+        generation = self._current_generation()
+        if generation == 0 or generation == self.generation:
+            return False
+        started = time.time()
+        snapshot = Snapshot(self._snapshot_path(generation))
+        meta = snapshot.meta
+        if meta.get("large_trade_usd") != self.large_trade_usd:
+            raise ValueError(f"generation {generation} uses another large-trade threshold")
+        if meta.get("first_row", 0) < read_extent(self.store.store_dir)[2]:
+            # Retention vừa drop rows: giữ mmaps cũ tới khi leader publish indexes đã bỏ chúng
+            return False
+        # Column mmaps phải phủ ít nhất các rows trong snapshot
+        self.store.refresh()
+        if self.store.count < meta["version"]:
+            return False
+
+        symbol_stats = load_stats(meta["symbol_stats"])
+
+        with self.lock:
+            # Indexes trước, version sau cùng: reader thấy version mới thì indexes đã sẵn
+            (self.symbol_index, self.all_index,
+             self.large_index, self.all_large_index) = split_indexes(snapshot.indexes)
+            self.symbol_lookup = meta["symbol_lookup"]
+            self.symbol_stats = symbol_stats
+            self.total_trades = meta["total_trades"]
+            self.total_volume = meta["total_volume"]
+            self.last_ts = meta["last_ts"]
+            self.last_update = meta["last_update"]
+            self.snapshot = snapshot
+            self.first_row = meta.get("first_row", 0)
+            self.generation = snapshot.generation
+            self.version = meta["version"]
+        LOAD_SECONDS.observe(time.time() - started)
+        return True
+
+    def load(self):
+        """Map the current generation; a follower waits briefly for the loader's first one"""
+        self.refresh()
+        deadline = time.time() + self.startup_wait
+        while self.generation == 0 and not self.is_leader and time.time() < deadline:
+            time.sleep(0.05)
+            self.refresh()
+        logger.info(f"Loaded cache generation {self.generation} ({self.version} records)")
+
+    def refresh(self):
+        """Leader publishes, then every worker maps the newest generation"""
+        started = time.time()
+        previous = self.version
+        try:
+            if self.try_lead():
+                self.publish()
+        except OSError as e:
+            logger.error(f"Error publishing cache snapshot: {e}")
+        try:
+            self.load_latest()
+        except (OSError, ValueError) as e:
+            # Generation vừa bị xoá hoặc đang ghi dở: thử lại ở lần poll sau
+            logger.debug(f"Cache snapshot not loaded: {e}")
+        self.last_refresh = time.time()
+        self.refresh_duration = self.last_refresh - started
+        return self.version - previous
+
+    def maybe_checkpoint(self):
+        """Checkpoints are written by the loader's private cache (see publish)"""
+
+    def stop(self):
+        super().stop()
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)  # nhả leader lock cho worker khác
+            self.lock_fd = None
+            self.builder = None
@@ -32,7 +32,9 @@ SERVER_IP=$(curl -s ifconfig.me)
 
 # Start API server with Gunicorn for production
 echo "Starting API server with Gunicorn..."
-nohup gunicorn --bind 0.0.0.0:5000 --workers 4 --timeout 120 --log-level info --access-logfile logs/api_access.log --error-logfile logs/api_error.log api_server:app > logs/api_server_stdout.log 2>&1 &
+# API_THREADS cũng giới hạn số SSE clients mỗi worker (threads - 8, phần còn lại cho REST)
+export API_THREADS=${API_THREADS:-32}
+nohup gunicorn --bind 0.0.0.0:5000 --workers 4 --worker-class gthread --threads $API_THREADS --timeout 120 --log-level info --access-logfile logs/api_access.log --error-logfile logs/api_error.log api_server:app > logs/api_server_stdout.log 2>&1 &
 API_PID=$!
 
 # Save PID
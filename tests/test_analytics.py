@@ -0,0 +1,107 @@
+import math
+import random
+from array import array
+from types import SimpleNamespace
+
+import pytest
+
+import analytics
+from analytics import AnalyticsEngine, python_summary
+from column_store import ColumnStoreReader, ColumnStoreWriter
+from trade_record import Trade
+
+np = pytest.importorskip("numpy")
+analytics.load_numpy()
+
+
+def close_enough(a, b, rel=1e-6):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(close_enough(a[k], b[k], rel) for k in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(close_enough(x, y, rel) for x, y in zip(a, b))
+    if a is None or b is None:
+        return a is b
+    return math.isclose(a, b, rel_tol=rel, abs_tol=1e-9)
+
+
+def synthetic_series(count, seed=7):
+    rng = random.Random(seed)
+    ts, prices, sizes = [], [], []
+    t, price = 1700000000000, 100.0
+    for _ in range(count):
+        t += rng.randint(1, 3000)
+        price = max(price * (1 + rng.gauss(0, 0.001)), 0.01)
+        ts.append(t)
+        prices.append(price)
+        sizes.append(rng.uniform(0.001, 5))
+    return ts, prices, sizes
+
+
+def numpy_summary(ts, prices, sizes, window, interval_ms):
+    return analytics.numpy_summary(np.array(ts, dtype=np.int64), np.array(prices, dtype=np.float64),
+                                   np.array(sizes, dtype=np.float64), window, interval_ms)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 25, 5000])
+def test_summary_backends_match(count):
+    ts, prices, sizes = synthetic_series(count)
+    expected = python_summary(ts, prices, sizes, 20, 60000)
+    assert close_enough(expected, numpy_summary(ts, prices, sizes, 20, 60000))
+    assert expected["trades"] == count
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("count,points", [(0, 200), (1, 200), (2, 3), (150, 200), (5000, 200), (5000, 3)])
+def test_downsample_backends_match(method, count, points):
+    ts, prices, sizes = synthetic_series(count)
+    expected = AnalyticsEngine(None, use_numpy=False).downsample(ts, prices, sizes, points, method)
+    actual = AnalyticsEngine(None).downsample(ts, prices, sizes, points, method)
+    assert close_enough(expected, actual)
+
+    out_ts, _, volumes = expected
+    if method == "lttb":
+        assert len(out_ts) == min(count, max(points, 3))
+    else:
+        assert len(out_ts) <= max(points, 4)  # ít nhất 1 bucket (min + max) cùng first/last
+    assert out_ts == sorted(out_ts)
+    if count:
+        assert out_ts[0] == ts[0] and out_ts[-1] == ts[-1]
+        assert math.isclose(sum(volumes), sum(sizes), rel_tol=1e-9)
+    else:
+        assert expected == ([], [], [])
+
+
+def test_numpy_columns_follow_store_remaps(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000, grow_records=256)
+    writer.open()
+    reader = ColumnStoreReader(str(tmp_path))
+    engine = AnalyticsEngine(reader)
+    count = 0
+    for _ in range(6):
+        # Mỗi vòng vượt capacity (remap) hoặc drop (file mới): arrays phải được dựng lại
+        for _ in range(300):
+            writer.append_trade(Trade(1000 + count, writer.symbol_id("BTCUSDT"), float(count), 1.0, 0, count))
+            count += 1
+        writer.flush()
+        if count == 1200:
+            writer.drop_before(1000 + 600)
+        reader.refresh()
+        rows = array('q', range(count - 250, count))
+        ts, prices, _ = engine.load(rows, 0, 250)
+        assert len(engine._numpy_columns()["ts"]) >= reader.capacity
+        assert prices.tolist() == [float(r) for r in range(count - 250, count)]
+        assert ts.tolist() == [1000 + r for r in range(count - 250, count)]
+    writer.close()
+
+
+def test_numpy_columns_are_not_keyed_on_a_reused_id():
+    def columns(base):
+        return {"ts": array('q', [base, base + 1]), "price": array('d', [base, base + 1.0]),
+                "size": array('d', [1.0, 1.0])}
+
+    store = SimpleNamespace(columns=columns(100))
+    engine = AnalyticsEngine(store)
+    assert engine.load(array('q', [0, 1]), 0, 2)[0].tolist() == [100, 101]
+    store.columns = None          # dict cũ được free trước khi tạo dict mới: id thường được dùng lại
+    store.columns = columns(200)
+    assert engine.load(array('q', [0, 1]), 0, 2)[0].tolist() == [200, 201]
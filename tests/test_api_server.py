@@ -0,0 +1,448 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("flask")
+
+import codec
+from analytics import AnalyticsEngine
+from column_store import ColumnStoreWriter
+from export import SpoolCache
+from response_cache import ResponseCache
+from trade_cache import TradeCache
+from trade_record import Trade
+
+
+@pytest.fixture(scope="module")
+def api_server(tmp_path_factory):
+    # api_server mở api_server.log và metrics_snapshots/ theo đường dẫn tương đối lúc import
+    directory = tmp_path_factory.mktemp("api_server")
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import api_server
+    finally:
+        os.chdir(cwd)
+    api_server.worker_metrics.snapshot_dir = str(directory / "metrics_snapshots")
+    return api_server
+
+
+@pytest.fixture
+def api(api_server, tmp_path, monkeypatch):
+    """Test client over a fresh column store in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    columns_dir = str(tmp_path / "trade_columns")
+    writer = ColumnStoreWriter(columns_dir, flush_batch=100000)
+    writer.open()
+    cache = TradeCache(columns_dir, max_records=1000, refresh_interval=3600,
+                       large_trade_usd=api_server.PRODUCTION_CONFIG["large_trade_usd"])
+    monkeypatch.setattr(api_server, "trade_cache", cache)
+    monkeypatch.setattr(api_server, "analytics", AnalyticsEngine(cache.store))
+    monkeypatch.setattr(api_server, "response_cache", ResponseCache())
+    monkeypatch.setitem(api_server.data_cache, "stats_version", -1)
+
+    added = []
+
+    def add(ts, symbol, price=100.0, size=1.0, trade_id=None):
+        trade_id = len(added) if trade_id is None else trade_id
+        added.append(trade_id)
+        writer.append_trade(Trade(ts, writer.symbol_id(symbol), price, size, 1, trade_id))
+
+    def commit():
+        writer.flush()
+        cache.refresh()
+
+    yield SimpleNamespace(module=api_server, client=api_server.app.test_client(),
+                          writer=writer, cache=cache, add=add, commit=commit)
+    cache.stop()
+    writer.close()
+
+
+def test_latest_limit_is_clamped(api):
+    for i in range(50):
+        api.add(1700000000000 + i * 1000, "BTCUSDT")
+    api.commit()
+    for limit, expected in (("0", 1), ("-5", 1), ("10", 10), ("100000", 50)):
+        body = api.client.get(f"/api/trading/latest?limit={limit}").get_json()
+        assert body["total_records"] == expected
+
+
+def test_msgpack_is_negotiated_from_accept(api, monkeypatch):
+    pytest.importorskip("msgpack")
+    for i in range(20):
+        api.add(1700000000000 + i * 1000, "BTCUSDT")
+    api.commit()
+    as_json = api.client.get("/api/trading/latest?limit=5")
+    packed = api.client.get("/api/trading/latest?limit=5", headers={"Accept": "application/msgpack"})
+    assert as_json.mimetype == codec.JSON_MIMETYPE and packed.mimetype == codec.MSGPACK_MIMETYPE
+    body, unpacked = as_json.get_json(), codec.loads_msgpack(packed.get_data())
+    assert unpacked["data"] == body["data"] and unpacked["total_records"] == 5
+    assert packed.headers["ETag"] != as_json.headers["ETag"]  # cached body khác nhau theo mimetype
+
+    preferred = api.client.get("/api/trading/latest?limit=5",
+                               headers={"Accept": "application/json;q=0.5, application/msgpack"})
+    assert preferred.mimetype == codec.MSGPACK_MIMETYPE
+    wildcard = api.client.get("/api/trading/latest?limit=5", headers={"Accept": "*/*"})
+    assert wildcard.mimetype == codec.JSON_MIMETYPE
+
+    # Server không có msgpack: luôn trả JSON
+    monkeypatch.setattr(codec, "HAS_MSGPACK", False)
+    fallback = api.client.get("/api/trading/latest?limit=4", headers={"Accept": "application/msgpack"})
+    assert fallback.mimetype == codec.JSON_MIMETYPE and len(fallback.get_json()["data"]) == 4
+
+
+def test_json_provider_goes_through_codec(api_server):
+    provider = api_server.app.json
+    assert provider.dumps({"price": 1.5, "note": "giá"}) == codec.dumps({"price": 1.5, "note": "giá"}).decode()
+    assert provider.loads(b'{"a":[1,2]}') == {"a": [1, 2]}
+    with api_server.app.test_request_context(headers={"Accept": "application/msgpack"}):
+        response = provider.response({"ok": True})
+    expected = codec.MSGPACK_MIMETYPE if codec.HAS_MSGPACK else codec.JSON_MIMETYPE
+    assert response.mimetype == expected
+
+def test_etag_changes_when_retention_drops_rows(api):
+    for i in range(100):
+        api.add(i * 60000, "BTCUSDT")
+    api.commit()
+    first = api.client.get("/api/trading?limit=1000")
+    etag = first.headers["ETag"]
+    assert len(first.get_json()["data"]) == 100
+    assert api.client.get("/api/trading?limit=1000", headers={"If-None-Match": etag}).status_code == 304
+
+    # version và last_ts không đổi, nhưng view mất 40 rows đầu
+    api.writer.drop_before(40 * 60000)
+    api.cache.refresh()
+    second = api.client.get("/api/trading?limit=1000", headers={"If-None-Match": etag})
+    assert second.status_code == 200
+    assert second.headers["ETag"] != etag
+    assert len(second.get_json()["data"]) == 60
+
+
+@pytest.fixture
+def export_api(api, tmp_path, monkeypatch):
+    """Trade log with 3000 past trades behind /api/export"""
+    from export import TradeExporter
+    from trade_log import TradeLog
+    log = TradeLog(str(tmp_path / "trade_log"), segment_max_bytes=64 * 1024)
+    log.open()
+    for i in range(3000):
+        log.append({"ts": 1700000000000 + i * 1000, "symbol": "BTCUSDT" if i % 2 else "ETHUSDT",
+                    "price": 100.0 + i, "size": 0.5, "side": "buy", "tradeId": i})
+    log.close()
+    exporter = TradeExporter(str(tmp_path / "trade_log"), str(tmp_path / "trade_archive"))
+    monkeypatch.setattr(api.module, "exporter", exporter)
+    monkeypatch.setattr(api.module, "export_spool", SpoolCache(str(tmp_path / "export_spool")))
+    api.exporter = exporter
+    return api
+
+
+EXPORT_URL = "/api/export?format=csv&compression=gzip&from=1700000000000&to=1700002000000"
+
+
+def test_export_range_matches_full_body(export_api):
+    full = export_api.client.get(EXPORT_URL)
+    assert full.status_code == 200 and full.headers["Accept-Ranges"] == "bytes"
+    body = full.get_data()
+    etag = full.headers["ETag"]
+    assert len(body) > 1000
+
+    part = export_api.client.get(EXPORT_URL, headers={"Range": "bytes=100-599", "If-Range": etag})
+    assert part.status_code == 206
+    assert part.headers["Content-Range"] == f"bytes 100-599/{len(body)}"
+    assert part.get_data() == body[100:600]
+
+    tail = export_api.client.get(EXPORT_URL, headers={"Range": f"bytes={len(body) - 10}-"})
+    assert tail.status_code == 206 and tail.get_data() == body[-10:]
+
+
+def test_export_stale_if_range_returns_full_body(export_api):
+    body = export_api.client.get(EXPORT_URL).get_data()
+    response = export_api.client.get(EXPORT_URL, headers={"Range": "bytes=100-599", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert "Content-Range" not in response.headers
+    assert response.get_data() == body
+
+
+def test_export_unsatisfiable_range_returns_416(export_api):
+    size = len(export_api.client.get(EXPORT_URL).get_data())
+    response = export_api.client.get(EXPORT_URL, headers={"Range": f"bytes={size + 10}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_export_open_or_recent_range_has_no_byte_ranges(export_api):
+    full = export_api.client.get("/api/export?format=csv&compression=gzip&from=1700000000000")
+    ranged = export_api.client.get("/api/export?format=csv&compression=gzip&from=1700000000000",
+                                   headers={"Range": "bytes=0-99"})
+    assert full.headers["Accept-Ranges"] == "none" and "ETag" not in full.headers
+    assert ranged.status_code == 200 and ranged.get_data() == full.get_data()
+
+    recent = f"/api/export?from=1700000000000&to={int(time.time() * 1000)}"
+    assert export_api.client.get(recent).headers["Accept-Ranges"] == "none"
+
+
+def test_export_sources_changing_while_encoding_returns_503(export_api, monkeypatch):
+    tags = iter(["a", "b"])
+    monkeypatch.setattr(export_api.exporter, "source_tag", lambda *args: next(tags))
+    response = export_api.client.get(EXPORT_URL, headers={"Range": "bytes=0-99"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(export_api.module.PRODUCTION_CONFIG["export_spool_retry_after"])
+
+
+def test_export_slow_spool_answers_503_until_ready(export_api, monkeypatch):
+    body = export_api.client.get(EXPORT_URL).get_data()
+    monkeypatch.setitem(export_api.module.PRODUCTION_CONFIG, "export_spool_wait", 0.05)
+    release = threading.Event()
+    stream = export_api.exporter.stream
+    calls = []
+
+    def slow_stream(*args):
+        calls.append(args)
+        release.wait(5)  # export lớn: encode lâu hơn proxy timeout
+        yield from stream(*args)
+
+    monkeypatch.setattr(export_api.exporter, "stream", slow_stream)
+    for _ in range(2):
+        pending = export_api.client.get(EXPORT_URL, headers={"Range": "bytes=100-599"})
+        assert pending.status_code == 503 and "Retry-After" in pending.headers
+    assert len(calls) == 1  # request thứ hai không encode lại
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while True:
+        part = export_api.client.get(EXPORT_URL, headers={"Range": "bytes=100-599"})
+        if part.status_code == 206 or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    assert part.status_code == 206 and part.get_data() == body[100:600]
+    assert len(calls) == 1
+
+
+def test_export_resumes_reuse_the_spooled_file(export_api, monkeypatch):
+    body = export_api.client.get(EXPORT_URL).get_data()
+    stream = export_api.exporter.stream
+    calls = []
+    monkeypatch.setattr(export_api.exporter, "stream", lambda *args: calls.append(args) or stream(*args))
+
+    for start in (0, 1000, len(body) - 10):
+        part = export_api.client.get(EXPORT_URL, headers={"Range": f"bytes={start}-"})
+        assert part.status_code == 206 and part.get_data() == body[start:]
+    assert len(calls) == 1
+    other = export_api.client.get(EXPORT_URL.replace("format=csv", "format=ndjson"), headers={"Range": "bytes=0-9"})
+    assert other.status_code == 206 and len(calls) == 2
+
+    # Sources đổi (ETag mới): encode lại, bản cũ của cùng request bị xoá
+    monkeypatch.setattr(export_api.exporter, "source_tag", lambda *args: "changed")
+    assert export_api.client.get(EXPORT_URL, headers={"Range": "bytes=0-9"}).get_data() == body[:10]
+    assert len(calls) == 3
+    assert len(os.listdir(export_api.module.export_spool.directory)) == 2
+
+
+def test_export_sources_changing_while_encoding_discard_the_spool(export_api, monkeypatch):
+    tags = iter(["a", "b", "b", "b"])
+    monkeypatch.setattr(export_api.exporter, "source_tag", lambda *args: next(tags))
+    assert export_api.client.get(EXPORT_URL, headers={"Range": "bytes=0-99"}).status_code == 503
+    assert os.listdir(export_api.module.export_spool.directory) == []
+    assert export_api.client.get(EXPORT_URL, headers={"Range": "bytes=0-99"}).status_code == 206
+
+
+def test_export_over_archived_segments_returns_the_same_records(export_api, tmp_path):
+    import gzip
+    from retention import RetentionManager
+    url = "/api/export?format=ndjson&compression=gzip&from=1700000000000&to=1700002999000"
+    before = export_api.client.get(url)
+    body = gzip.decompress(before.get_data())  # đọc hết stream trước khi compact
+    log = export_api.exporter.trade_log
+    log.open()
+    assert len(log.list_segments()) > 2
+    manager = RetentionManager(log, str(tmp_path / "trade_archive"), hot_days=7, archive_days=None)
+    manager.compact(now=time.time() + 8 * 86400)
+    log.close()
+    assert log.list_segments() == [log.active_index]  # mọi segment đã seal đều nằm trong archive
+
+    after = export_api.client.get(url)
+    assert after.headers["ETag"] != before.headers["ETag"]
+    records = [codec.loads(line) for line in gzip.decompress(after.get_data()).splitlines()]
+    assert len(records) == 3000 and [record["tradeId"] for record in records] == list(range(3000))
+    assert gzip.decompress(after.get_data()) == body
+
+def test_spool_cache_evicts_least_recently_used(tmp_path):
+    cache = SpoolCache(str(tmp_path), max_bytes=250, max_age=3600)
+    now = time.time()
+    for age, key in ((30, "a"), (20, "b"), (0, "c")):
+        f, size = cache.open(key, "v1", lambda: [b"x" * 100])
+        f.close()
+        assert size == 100
+        path = cache._paths(key, "v1")[0]
+        os.utime(path, (now - age, now - age))
+    # "a" ít dùng nhất -> bị evict khi "c" vào
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(cache._paths(key, "v1")[0]) for key in "bc")
+
+    f, _ = cache.open("b", "v1", lambda: pytest.fail("b should be reused"))
+    stale = cache._paths("c", "v1")[0]
+    os.utime(stale, (now - 7200, now - 7200))  # quá max_age
+    os.utime(f.name, (now - 7200, now - 7200))
+    cache.evict()
+    assert os.listdir(str(tmp_path)) == []
+    assert f.read() == b"x" * 100  # file đang đọc vẫn đọc được sau khi bị evict
+    f.close()
+
+
+def test_batch_answers_mixed_queries_with_per_item_errors(api):
+    for i in range(60):
+        api.add(1700000000000 + i * 1000, "BTCUSDT" if i % 3 else "ETHUSDT", price=100.0 + i)
+    api.commit()
+    response = api.client.post("/api/batch", json={"queries": [
+        {"symbol": "btcusdt", "limit": 5},
+        {"symbol": "ETHUSDT", "type": "stats"},
+        {"symbol": "BTCUSDT", "type": "candles", "interval": "1m", "limit": 3},
+        {"symbol": "BTCUSDT", "type": "analytics", "window": 5},
+        {"symbol": "DOGEUSDT"},
+        {"symbol": "BTCUSDT", "type": "orders"},
+        {"symbol": "ETHUSDT", "limit": 0},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["version"] == 60
+    trades, stats, candles, analytics, unknown, bad_type, clamped = body["results"]
+
+    assert trades["status"] == "success" and trades["symbol"] == "BTCUSDT"
+    assert [record["data"]["tradeId"] for record in trades["data"]] == ["53", "55", "56", "58", "59"]
+    assert stats["stats"]["count"] == 20
+    assert candles["interval"] == "1m" and 1 <= candles["total_records"] <= 3
+    assert analytics["status"] == "success" and analytics["window"] == 5
+    assert unknown == {"status": "error", "index": 4, "message": "queries[4]: unknown symbol 'DOGEUSDT'"}
+    assert bad_type["status"] == "error" and bad_type["index"] == 5 and "invalid type" in bad_type["message"]
+    assert clamped["total_records"] == 1  # limit <= 0 không trả toàn bộ index
+
+
+def test_batch_runs_sub_queries_on_the_bounded_pool_in_order(api, monkeypatch):
+    for i in range(10):
+        api.add(1700000000000 + i * 1000, "BTCUSDT")
+    api.commit()
+    run = api.module.run_batch_query
+    active, peak, threads = [0], [0], set()
+    lock = threading.Lock()
+
+    def slow(query):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            threads.add(threading.current_thread().name)
+        time.sleep(0.05)  # vd. đọc candle files
+        with lock:
+            active[0] -= 1
+        return run(query)
+
+    monkeypatch.setattr(api.module, "run_batch_query", slow)
+    queries = [{"symbol": "BTCUSDT", "limit": limit} for limit in range(1, 13)]
+    body = api.client.post("/api/batch", json={"queries": queries}).get_json()
+    assert [result["total_records"] for result in body["results"]] == list(range(1, 11)) + [10, 10]
+    assert 1 < peak[0] <= api.module.PRODUCTION_CONFIG["batch_threads"]
+    assert all(name.startswith("api-batch") for name in threads)
+
+    monkeypatch.setattr(api.module, "run_batch_query", lambda query: 1 / 0)
+    # Body khác (response cache theo POST body): lỗi ngoài ValueError vẫn là 500
+    assert api.client.post("/api/batch", json={"queries": queries[:2]}).status_code == 500
+
+def test_batch_rejects_malformed_body(api):
+    assert api.client.post("/api/batch", json={"queries": []}).status_code == 400
+    assert api.client.post("/api/batch", data="not json", content_type="application/json").status_code == 400
+    too_many = [{"symbol": "BTCUSDT"}] * (api.module.PRODUCTION_CONFIG["batch_max_queries"] + 1)
+    assert api.client.post("/api/batch", json={"queries": too_many}).status_code == 400
+
+
+def test_large_trades_top_n_min_usd_and_window(api):
+    last_ts = 1700000000000 + 200 * 1000
+    notionals = {}
+    for i in range(200):
+        ts = 1700000000000 + (i + 1) * 1000
+        size = 10.0 + (i * 37) % 100      # 100 USD * size: 1000..10900 USD, thứ tự lẫn lộn
+        api.add(ts, "BTCUSDT" if i % 2 else "ETHUSDT", price=100.0, size=size)
+        notionals[i] = (ts, 100.0 * size, "BTCUSDT" if i % 2 else "ETHUSDT")
+    api.add(last_ts - 500, "BTCUSDT", price=100.0, size=1.0, trade_id=999)  # 100 USD: không được index
+    api.commit()
+
+    body = api.client.get("/api/trading/large?window=all&limit=5").get_json()
+    expected = sorted((value for _, value, _ in notionals.values()), reverse=True)[:5]
+    assert [record["notional_usd"] for record in body["data"]] == expected
+    assert body["total_matches"] == 200
+
+    by_time = api.client.get("/api/trading/large?window=all&sort=time&limit=3&symbol=ethusdt").get_json()
+    assert [record["data"]["ts"] for record in by_time["data"]] == [str(last_ts - 1000 * k) for k in (1, 3, 5)]
+
+    # Window 1m tính từ trade mới nhất: ts >= last_ts - 60000 + 1
+    window = api.client.get("/api/trading/large?window=1m&min_usd=5000&limit=1000").get_json()
+    inside = [value for ts, value, _ in notionals.values() if ts > last_ts - 60000 and value >= 5000]
+    assert body["filters"]["from"] is None and window["filters"]["from"] == last_ts - 60000 + 1
+    assert window["total_matches"] == len(inside)
+    assert sorted(record["notional_usd"] for record in window["data"]) == sorted(inside)
+    assert all(int(record["data"]["ts"]) > last_ts - 60000 for record in window["data"])
+
+
+@pytest.mark.parametrize("query", ["min_usd=abc", "min_usd=-5", "min_usd=nan", "min_usd=inf", "min_usd=10",
+                                   "window=2w", "sort=size"])
+def test_large_trades_rejects_invalid_parameters(api, query):
+    api.add(1700000000000, "BTCUSDT", price=100.0, size=50.0)
+    api.commit()
+    response = api.client.get(f"/api/trading/large?{query}")
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+def test_large_trades_on_empty_store(api):
+    body = api.client.get("/api/trading/large?window=all").get_json()
+    assert body["data"] == [] and body["total_matches"] == 0
+
+
+def test_stream_subscribers_leave_threads_for_rest(api_server):
+    config = api_server.PRODUCTION_CONFIG
+    assert config["stream_max_subscribers"] == config["worker_threads"] - config["stream_rest_threads"]
+
+
+SERIES_START = 1700006400000  # 00:00 UTC
+
+
+def add_ticks(api, count, step_ms=1000):
+    for i in range(count):
+        api.add(SERIES_START + i * step_ms, "BTCUSDT", price=100.0 + i % 7, size=0.5)
+    api.commit()
+
+
+def series(api, from_ts, to_ts, points=10):
+    response = api.client.get(f"/api/series/BTCUSDT?from={from_ts}&to={to_ts}&points={points}")
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_series_sparse_range_uses_cached_trades(api):
+    add_ticks(api, 100)
+    body = series(api, SERIES_START, SERIES_START + 99000)
+    assert body["source"] == "trades" and body["raw_points"] == 100
+    assert body["series"]["ts"][0] == SERIES_START and body["series"]["ts"][-1] == SERIES_START + 99000
+
+
+def test_series_dense_range_uses_candles_with_tick_edges(api, tmp_path):
+    from candles import CandleAggregator
+    add_ticks(api, 900)
+    from_ts, to_ts = SERIES_START + 30000, SERIES_START + 899000
+    # 870 ticks > 20 x 12 points, nhưng chưa có candles: chỉ còn ticks (points khác: không trúng response cache)
+    assert series(api, from_ts, to_ts, points=12)["source"] == "trades"
+
+    (tmp_path / "candles").mkdir()  # candles_dir tương đối, api đã chdir
+    aggregator = CandleAggregator(str(tmp_path / "candles"))
+    for i in range(900):
+        aggregator.add_trade("BTCUSDT", SERIES_START + i * 1000, 100.0 + i % 7, 0.5)
+    aggregator.add_trade("BTCUSDT", SERIES_START + 86400000, 100.0, 0.0)  # đóng mọi bucket
+    aggregator.close()
+
+    body = series(api, from_ts, to_ts)
+    # 5m candle duy nhất nằm trọn trong range, ticks cho phần đầu [from, +5m) và đuôi [+10m, to]
+    assert body["source"] == "candles_5m"
+    assert body["raw_points"] == 270 + 4 + 300
+    ts = body["series"]["ts"]
+    assert ts[0] == from_ts and ts[-1] == to_ts and ts == sorted(ts)
+    assert len(ts) <= 10
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+
+
+@pytest.fixture(scope="module")
+def asgi_server(tmp_path_factory):
+    # asgi_server import api_server, module này mở log/metrics theo đường dẫn tương đối
+    directory = tmp_path_factory.mktemp("asgi_server")
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import asgi_server
+    finally:
+        os.chdir(cwd)
+    return asgi_server
+
+
+def http_scope(path="/", method="GET", query_string=b"", headers=(), root_path=""):
+    return {
+        "type": "http", "http_version": "1.1", "scheme": "https", "method": method,
+        "path": path, "root_path": root_path, "query_string": query_string, "headers": list(headers),
+        "server": ("testserver", 8443), "client": ("10.0.0.7", 51234),
+    }
+
+
+def call(server, scope, chunks=(b"",), disconnect=False):
+    """Drive one ASGI request; returns every message the app sent"""
+    chunks = list(chunks)
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    if disconnect:
+        messages[-1] = {"type": "http.disconnect"}
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(server(scope, receive, send))
+    return sent
+
+
+def test_build_environ_maps_headers_query_and_body(asgi_server):
+    scope = http_scope("/api/v1/export/café", "POST", b"symbol=BTCUSDT&limit=5", root_path="/api/v1", headers=[
+        (b"content-type", b"application/json"),
+        (b"content-length", b"999"),         # lấy từ body thực tế
+        (b"x-forwarded-for", b"1.1.1.1"),
+        (b"X-Forwarded-For", b"2.2.2.2"),    # header lặp: nối bằng dấu phẩy
+        (b"accept-encoding", b"gzip"),
+    ])
+    environ = asgi_server.build_environ(scope, b'{"queries": []}')
+
+    assert environ["REQUEST_METHOD"] == "POST"
+    assert environ["SCRIPT_NAME"] == "/api/v1"
+    assert environ["PATH_INFO"] == "/export/café".encode("utf-8").decode("latin-1")
+    assert environ["QUERY_STRING"] == "symbol=BTCUSDT&limit=5"
+    assert environ["CONTENT_TYPE"] == "application/json"
+    assert environ["CONTENT_LENGTH"] == "15"
+    assert environ["wsgi.input"].read() == b'{"queries": []}'
+    assert environ["HTTP_X_FORWARDED_FOR"] == "1.1.1.1,2.2.2.2"
+    assert environ["HTTP_ACCEPT_ENCODING"] == "gzip"
+    assert "HTTP_CONTENT_TYPE" not in environ and "HTTP_CONTENT_LENGTH" not in environ
+    assert (environ["SERVER_NAME"], environ["SERVER_PORT"]) == ("testserver", "8443")
+    assert (environ["REMOTE_ADDR"], environ["REMOTE_PORT"]) == ("10.0.0.7", "51234")
+    assert environ["wsgi.url_scheme"] == "https"
+    assert environ["SERVER_PROTOCOL"] == "HTTP/1.1"
+
+
+def test_buffered_response_and_chunked_request_body(asgi_server):
+    def echo(environ, start_response):
+        body = json.dumps({
+            "body": environ["wsgi.input"].read().decode(),
+            "query": environ["QUERY_STRING"],
+        }).encode()
+        start_response("201 Created", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body[:5], body[5:]]
+
+    sent = call(asgi_server.AsgiServer(echo, threads=2), http_scope("/echo", "POST", b"a=1"),
+                [b'{"x":', b" 1", b"}"])
+    assert sent[0] == {"type": "http.response.start", "status": 201, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(sent[1]["body"])).encode())]}
+    # Content-Length có sẵn: một message body duy nhất, không more_body
+    assert len(sent) == 2 and "more_body" not in sent[1]
+    assert json.loads(sent[1]["body"]) == {"body": '{"x": 1}', "query": "a=1"}
+
+
+def test_streaming_response_runs_in_one_thread_and_closes(asgi_server):
+    threads = {}
+
+    class Body:
+        def __init__(self):
+            threads["call"] = threading.get_ident()
+
+        def __iter__(self):
+            threads["iterate"] = threading.get_ident()
+            yield b"first,"
+            yield b""           # chunk rỗng không được gửi
+            yield b"second"
+
+        def close(self):
+            threads["close"] = threading.get_ident()
+
+    def streaming(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/csv")])
+        return Body()
+
+    sent = call(asgi_server.AsgiServer(streaming, threads=2), http_scope("/export"))
+    assert sent[0]["status"] == 200
+    assert [(message["body"], message.get("more_body", False)) for message in sent[1:]] == [
+        (b"first,", True), (b"second", True), (b"", False)]
+    # stream_with_context cần call, iterate và close trên cùng một thread (contextvars)
+    assert threads.keys() == {"call", "iterate", "close"}
+    assert len(set(threads.values())) == 1 and threads["call"] != threading.get_ident()
+
+
+def test_streaming_response_closes_when_iteration_fails(asgi_server):
+    closed = []
+
+    class Body:
+        def __iter__(self):
+            yield b"partial"
+            raise OSError("client went away")
+
+        def close(self):
+            closed.append(True)
+
+    def failing(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/csv")])
+        return Body()
+
+    sent = call(asgi_server.AsgiServer(failing, threads=1), http_scope("/export"))
+    assert [message.get("body") for message in sent[1:]] == [b"partial"]
+    assert closed == [True]
+
+
+def test_disconnect_before_body_skips_the_app(asgi_server):
+    called = []
+
+    def app(environ, start_response):
+        called.append(True)
+        start_response("200 OK", [("Content-Length", "0")])
+        return [b""]
+
+    sent = call(asgi_server.AsgiServer(app, threads=1), http_scope("/upload", "POST"), [b"part", b"rest"],
+                disconnect=True)
+    assert sent == [] and called == []
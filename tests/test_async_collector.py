@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+
+from async_collector import AsyncBitgetCollector, SubscriptionLimiter
+from mock_bitget_server import MockBitgetServer, synthetic_symbols
+
+
+class Guard:
+    def __init__(self):
+        self.resyncs = []
+
+    def expect_resync(self, symbols=None):
+        self.resyncs.append(list(symbols))
+
+
+class Collector:
+    """The parts of BitgetDataCollectorProduction the async front end uses"""
+
+    def __init__(self, ws_url, symbols):
+        self.ws_url = ws_url
+        self.symbols = symbols
+        self.is_running = True
+        self.guard = Guard()
+        self.messages = []
+
+    def subscription_args(self, symbols):
+        return [{"instType": "SPOT", "channel": "trade", "instId": symbol} for symbol in symbols]
+
+    def handle_message(self, message):
+        self.messages.append(json.loads(message))
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run_against_mock(scenario, symbols=23, **options):
+    """Run ``scenario(server, collector, front)`` while the collector is connected to a mock server"""
+    async def main():
+        server = MockBitgetServer(book_rate=0)
+        async with websockets.serve(server.handler, "127.0.0.1", 0) as ws_server:
+            port = ws_server.sockets[0].getsockname()[1]
+            collector = Collector(f"ws://127.0.0.1:{port}", synthetic_symbols(symbols))
+            front = AsyncBitgetCollector(collector, **options)
+            running = asyncio.create_task(front.run())
+            try:
+                await scenario(server, collector, front)
+            finally:
+                collector.is_running = False
+                await running
+    asyncio.run(main())
+
+
+def subscribed(server):
+    return [symbol for symbols in server.connections.values() for symbol in symbols]
+
+
+def test_every_symbol_is_subscribed_once_across_shards():
+    async def scenario(server, collector, front):
+        started = time.monotonic()
+        await wait_for(lambda: len(subscribed(server)) == 23)
+        elapsed = time.monotonic() - started
+        assert sorted(subscribed(server)) == sorted(collector.symbols)
+        assert sorted(map(sorted, server.connections.values())) == sorted(map(sorted, front.shards()))
+        # Shards 6/6/6/5 symbols, batches of 3: 8 subscribe messages qua limiter chung 20/s
+        assert elapsed >= 7 / 20 * 0.9
+        assert sorted(symbol for resync in collector.guard.resyncs for symbol in resync) == \
+            sorted(collector.symbols)
+
+        # Trades đi qua queue tới collector
+        ws = next(iter(server.connections))
+        await server.send(ws, server.connections[ws][0], [server.make_trade(server.connections[ws][0], 1)])
+        await wait_for(lambda: any(message.get("action") == "update" for message in collector.messages))
+
+    run_against_mock(scenario, connections=4, subscribe_batch=3, subscribe_rate=20.0)
+
+
+def test_dropped_connection_reconnects_and_expects_resync():
+    async def scenario(server, collector, front):
+        await wait_for(lambda: len(subscribed(server)) == 23)
+        resyncs = len(collector.guard.resyncs)
+        ws, symbols = next(iter(server.connections.items()))
+        symbols = list(symbols)
+        await ws.close()
+
+        await wait_for(lambda: sum(front.reconnects) == 1)
+        await wait_for(lambda: len(server.connections) == 4 and len(subscribed(server)) == 23)
+        assert sorted(subscribed(server)) == sorted(collector.symbols)
+        shard = front.reconnects.index(1)
+        assert sorted(front.shards()[shard]) == sorted(symbols)
+        assert collector.guard.resyncs[resyncs:] == [front.shards()[shard]]
+
+    run_against_mock(scenario, connections=4, subscribe_batch=5, subscribe_rate=100.0, max_backoff=0.05)
+
+
+def test_subscription_limiter_spaces_acquires():
+    async def main():
+        limiter = SubscriptionLimiter(rate=50.0, burst=2)
+        stamps = []
+        for _ in range(12):
+            await limiter.acquire()
+            stamps.append(time.monotonic())
+        return stamps
+
+    stamps = asyncio.run(main())
+    # Burst 2 đi ngay, sau đó tối đa 50/s
+    assert stamps[1] - stamps[0] < 0.015
+    for i in range(2, len(stamps)):
+        assert stamps[i] - stamps[0] >= (i - 1) / 50.0 * 0.95
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+from candles import (CANDLE_SIZE, INTERVAL_NAMES, INTERVALS, Candle, CandleAggregator, bucket_start,
+                     candle_path, read_candles)
+
+DAY = INTERVALS["1d"]
+MINUTE = INTERVALS["1m"]
+START = 1700006400000  # 00:00 UTC, đầu một ngày
+
+
+def ohlcv(candle):
+    return (candle.open_ts, candle.open, candle.high, candle.low, candle.close,
+            candle.volume, candle.quote_volume, candle.trades)
+
+
+def expected_candles(trades, interval):
+    """Candles of one interval computed straight from (ts, price, size) ticks"""
+    candles = {}
+    for ts, price, size in trades:
+        start = bucket_start(ts, INTERVALS[interval])
+        candle = candles.get(start)
+        if candle is None:
+            candle = candles[start] = Candle(start)
+        candle.add_trade(price, size)
+    return [ohlcv(candles[start]) for start in sorted(candles)]
+
+
+def synthetic_trades(count, step_ms=7000):
+    # Giá dao động có đỉnh và đáy trong mỗi bucket
+    return [(START + i * step_ms, 100.0 + (i * 37) % 23 - (i % 5), 0.25 + i % 4) for i in range(count)]
+
+
+def close_all(aggregator, symbol, ts):
+    """Push one trade far in the future so every bucket before ``ts`` closes"""
+    aggregator.add_trade(symbol, ts, 1.0, 0.0)
+    aggregator.flush()
+
+
+@pytest.mark.parametrize("interval", INTERVAL_NAMES)
+def test_rollup_matches_candles_built_from_ticks(tmp_path, interval):
+    trades = synthetic_trades(30000)  # ~58 giờ
+    aggregator = CandleAggregator(str(tmp_path))
+    for ts, price, size in trades:
+        aggregator.add_trade("BTCUSDT", ts, price, size)
+    close_all(aggregator, "BTCUSDT", START + 10 * DAY)
+
+    actual = [ohlcv(candle) for candle in read_candles(str(tmp_path), "BTCUSDT", interval)]
+    expected = expected_candles(trades, interval)
+    assert [candle[0] for candle in actual] == [candle[0] for candle in expected]
+    for got, want in zip(actual, expected):
+        assert got[:5] == want[:5] and got[7] == want[7]
+        assert got[5:7] == pytest.approx(want[5:7])
+    aggregator.close()
+
+
+def test_advance_closes_coarse_candles_on_the_next_bucket(tmp_path):
+    aggregator = CandleAggregator(str(tmp_path))
+    aggregator.add_trade("BTCUSDT", START + 30000, 100.0, 1.0)
+    aggregator.add_trade("BTCUSDT", START + DAY + 10000, 105.0, 2.0)
+    aggregator.flush()
+
+    # Trade đầu tiên của ngày sau đóng luôn 5m..1d của ngày trước
+    for interval in INTERVAL_NAMES:
+        closed = read_candles(str(tmp_path), "BTCUSDT", interval)
+        assert [ohlcv(candle) for candle in closed] == [(START, 100.0, 100.0, 100.0, 100.0, 1.0, 100.0, 1)]
+    assert set(aggregator.open_candles) == {("BTCUSDT", "1m")}
+    assert aggregator.open_candles[("BTCUSDT", "1m")].open_ts == START + DAY
+    aggregator.close()
+
+
+def test_late_and_out_of_order_trades_fold_into_the_open_candle(tmp_path):
+    aggregator = CandleAggregator(str(tmp_path))
+    aggregator.add_trade("BTCUSDT", START + 10000, 100.0, 1.0)
+    aggregator.add_trade("BTCUSDT", START + MINUTE + 5000, 101.0, 1.0)   # đóng phút đầu
+    aggregator.add_trade("BTCUSDT", START + 20000, 90.0, 3.0)            # đến trễ một phút
+    aggregator.add_trade("BTCUSDT", START + MINUTE + 1000, 102.0, 1.0)   # lùi trong cùng phút
+    close_all(aggregator, "BTCUSDT", START + 10 * MINUTE)
+
+    minutes = [ohlcv(candle) for candle in read_candles(str(tmp_path), "BTCUSDT", "1m")]
+    assert minutes == [
+        (START, 100.0, 100.0, 100.0, 100.0, 1.0, 100.0, 1),
+        (START + MINUTE, 101.0, 102.0, 90.0, 102.0, 5.0, 473.0, 3),
+    ]
+    five = read_candles(str(tmp_path), "BTCUSDT", "5m")
+    assert [ohlcv(candle) for candle in five] == [(START, 100.0, 102.0, 90.0, 102.0, 6.0, 573.0, 4)]
+    aggregator.close()
+
+
+def write_partial(candles_dir, trades):
+    """Aggregate ``trades`` and stop without closing the open candles (process exit)"""
+    aggregator = CandleAggregator(candles_dir)
+    for ts, price, size in trades:
+        aggregator.add_trade("BTCUSDT", ts, price, size)
+    open_candles = {key: ohlcv(candle) for key, candle in aggregator.open_candles.items() if key[1] != "1m"}
+    aggregator.close()
+    return open_candles
+
+
+def replay_and_close(aggregator, trades):
+    # Collector replay các trades từ sau candle 1m cuối cùng đã ghi
+    closed_end = aggregator.last_closed_end("BTCUSDT")
+    assert closed_end == bucket_start(trades[-1][0], MINUTE)
+    for ts, price, size in trades:
+        if ts >= closed_end:
+            aggregator.add_trade("BTCUSDT", ts, price, size)
+    close_all(aggregator, "BTCUSDT", START + 10 * DAY)
+
+
+def test_restore_rebuilds_open_candles(tmp_path):
+    trades = synthetic_trades(3000)  # ~5.8 giờ
+    open_before = write_partial(str(tmp_path), trades)
+
+    after = CandleAggregator(str(tmp_path))
+    after.restore(["BTCUSDT"])
+    assert {key: ohlcv(candle) for key, candle in after.open_candles.items()} == open_before
+
+    replay_and_close(after, trades)
+    for interval in INTERVAL_NAMES:
+        actual = [ohlcv(candle) for candle in read_candles(str(tmp_path), "BTCUSDT", interval)]
+        assert [candle[:5] + candle[7:] for candle in actual] == \
+            [candle[:5] + candle[7:] for candle in expected_candles(trades, interval)]
+    after.close()
+
+
+def test_restore_writes_buckets_lost_in_a_crash(tmp_path):
+    trades = synthetic_trades(3000)
+    write_partial(str(tmp_path), trades)
+    # Crash trước khi 15m/1h được ghi: mất file 15m và một record 1h ghi dở
+    os.remove(candle_path(str(tmp_path), "BTCUSDT", "15m"))
+    with open(candle_path(str(tmp_path), "BTCUSDT", "1h"), 'ab') as f:
+        f.write(b"\0" * (CANDLE_SIZE // 2))
+
+    after = CandleAggregator(str(tmp_path))
+    after.restore(["BTCUSDT"])
+    assert len(read_candles(str(tmp_path), "BTCUSDT", "15m")) >= 3000 * 7000 // INTERVALS["15m"] - 1
+
+    replay_and_close(after, trades)
+    for interval in ("15m", "1h", "4h", "1d"):
+        actual = [ohlcv(candle) for candle in read_candles(str(tmp_path), "BTCUSDT", interval)]
+        assert [candle[:5] + candle[7:] for candle in actual] == \
+            [candle[:5] + candle[7:] for candle in expected_candles(trades, interval)]
+    after.close()
+
+
+def test_read_candles_range_and_limit(tmp_path):
+    aggregator = CandleAggregator(str(tmp_path))
+    for i in range(10):
+        aggregator.add_trade("ETHUSDT", START + i * MINUTE, 10.0 + i, 1.0)
+    close_all(aggregator, "ETHUSDT", START + DAY)
+    aggregator.close()
+
+    opens = lambda candles: [candle.open for candle in candles]
+    assert opens(read_candles(str(tmp_path), "ETHUSDT", "1m", START + 2 * MINUTE, START + 5 * MINUTE)) == \
+        [12.0, 13.0, 14.0, 15.0]
+    assert opens(read_candles(str(tmp_path), "ETHUSDT", "1m", from_ts=START + 1, limit=2)) == [18.0, 19.0]
+    assert read_candles(str(tmp_path), "SOLUSDT", "1m") == []
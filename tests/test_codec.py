@@ -0,0 +1,52 @@
+import importlib.util
+import sys
+
+import pytest
+
+import codec
+
+SAMPLE = {"symbol": "BTCUSDT", "price": 100.5, "size": 0.25, "ts": 1700000000000, "note": "giá",
+          "nested": {"bids": [[100.0, 1.5]], "ok": True, "none": None}}
+
+
+@pytest.fixture
+def stdlib_codec(monkeypatch):
+    """A fresh copy of codec imported as if orjson and msgpack were not installed"""
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    monkeypatch.setitem(sys.modules, "msgpack", None)
+    spec = importlib.util.find_spec("codec")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_dumps_is_compact_utf8_and_round_trips():
+    # Không có khoảng trắng, không escape \u
+    assert codec.dumps({"a": [1, 2.5], "b": "giá"}) == '{"a":[1,2.5],"b":"giá"}'.encode("utf-8")
+    data = codec.dumps(SAMPLE)
+    assert codec.loads(data) == SAMPLE
+    assert codec.loads(data.decode("utf-8")) == SAMPLE
+    assert codec.loads(codec.dumps({1: "a"})) == {"1": "a"}
+
+
+def test_stdlib_fallback_matches_the_default_backend(stdlib_codec):
+    assert stdlib_codec.JSON_BACKEND == "json" and not stdlib_codec.HAS_MSGPACK
+    assert stdlib_codec.dumps(SAMPLE) == codec.dumps(SAMPLE)
+    assert stdlib_codec.loads(codec.dumps(SAMPLE)) == SAMPLE
+    assert stdlib_codec.dumps({1: "a"}) == codec.dumps({1: "a"})
+    with pytest.raises(ValueError):
+        stdlib_codec.loads(b"not json")
+    assert stdlib_codec.encode(SAMPLE) == codec.dumps(SAMPLE)
+    with pytest.raises(RuntimeError, match="msgpack"):
+        stdlib_codec.encode(SAMPLE, stdlib_codec.MSGPACK_MIMETYPE)
+
+
+def test_invalid_json_raises_value_error():
+    with pytest.raises(ValueError):
+        codec.loads(b'{"torn')
+
+
+def test_msgpack_round_trips_to_the_same_data():
+    pytest.importorskip("msgpack")
+    packed = codec.encode(SAMPLE, codec.MSGPACK_MIMETYPE)
+    assert codec.loads_msgpack(packed) == SAMPLE == codec.loads(codec.encode(SAMPLE))
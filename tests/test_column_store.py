@@ -0,0 +1,86 @@
+from column_store import ColumnStoreReader, ColumnStoreWriter, read_extent
+from trade_cache import TradeCache, decode_cursor
+from trade_record import Trade
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def append(writer, ts, symbol, trade_id, price=100.0, size=1.0):
+    writer.append_trade(Trade(ts, writer.symbol_id(symbol), price, size, 1, trade_id))
+
+
+def test_drop_before_keeps_row_numbers_and_frees_disk(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000, grow_records=1024)
+    writer.open()
+    for i in range(20000):
+        append(writer, i * 60000, "BTCUSDT" if i % 2 else "ETHUSDT", i, size=1000.0 if i % 7 == 0 else 1.0)
+    writer.flush()
+
+    cache = TradeCache(str(tmp_path), max_records=15000, large_trade_max=100000)
+    cache.refresh()
+    reader = ColumnStoreReader(str(tmp_path))
+    reader.refresh()
+    before = reader.size_bytes()
+    _, _, cursor = cache.range_query("BTCUSDT", from_ts=16000 * 60000, limit=10)
+
+    dropped = writer.drop_before(10000 * 60000)
+    assert dropped == 10000
+    count, _, first_row = read_extent(str(tmp_path))
+    assert (count, first_row) == (20000, 10000)
+
+    # Rows mới sau compaction phải tới được readers (files đã bị thay)
+    append(writer, 20000 * 60000, "BTCUSDT", 20000)
+    writer.flush()
+    cache.refresh()
+    reader.refresh()
+
+    assert reader.size_bytes() < before
+    assert cache.first_row == 10000 and cache.version == 20001
+    assert reader.record(12345)["data"]["tradeId"] == "12345"
+    assert reader.record(20000)["data"]["tradeId"] == "20000"
+    for index in [cache.all_index, cache.all_large_index, *cache.symbol_index.values(), *cache.large_index.values()]:
+        rows, _, size = index.state
+        assert all(rows[i] >= 10000 for i in range(size))
+    large, _ = cache.large_trades(None, None, 0, 100000, False)
+    assert large and all(row >= 10000 and row % 7 == 0 for _, row in large)
+    assert int(cache.view()[0]["data"]["tradeId"]) >= 10000
+
+    # Cursor từ trước compaction vẫn trỏ đúng vị trí
+    rows, _, _ = cache.range_query("BTCUSDT", from_ts=16000 * 60000, cursor=decode_cursor(cursor), limit=1)
+    assert rows[0]["data"]["tradeId"] == "16021"
+    writer.close()
+
+
+def test_reopen_after_drop(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000)
+    writer.open()
+    for i in range(100):
+        append(writer, i * DAY_MS, "BTCUSDT", i)
+    writer.flush()
+    writer.drop_before(90 * DAY_MS)
+    writer.close()
+
+    writer = ColumnStoreWriter(str(tmp_path))
+    writer.open()
+    assert (writer.count, writer.first_row) == (100, 90)
+    assert list(writer.read_tail(1000)["trade_id"]) == list(range(90, 100))
+    assert writer.drop_before(0) == 0
+    writer.close()
+
+    cache = TradeCache(str(tmp_path), max_records=1000)
+    cache.refresh()
+    assert cache.total_trades == 10
+    assert [record["data"]["tradeId"] for record in cache.view()] == [str(i) for i in range(90, 100)]
+
+
+def test_records_never_use_exponent_notation(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000)
+    writer.open()
+    for i, (price, size) in enumerate([(0.00001234, 0.00001), (65000.5, 1e-08), (1e16, 2.0), (0.1, 100.0)]):
+        append(writer, 1000 + i, "BTCUSDT", i, price=price, size=size)
+    writer.flush()
+    reader = ColumnStoreReader(str(tmp_path))
+    reader.refresh()
+    writer.close()
+    assert [(reader.record(i)["data"]["price"], reader.record(i)["data"]["size"]) for i in range(4)] == [
+        ("0.00001234", "0.00001"), ("65000.5", "0.00000001"), ("10000000000000000", "2.0"), ("0.1", "100.0")]
@@ -0,0 +1,64 @@
+import threading
+import urllib.request
+
+from metrics import Registry, start_http_server
+
+
+def test_concurrent_updates_are_not_lost():
+    registry = Registry()
+    counter = registry.counter("test_total", "Test counter")
+    histogram = registry.histogram("test_seconds", "Test histogram", buckets=(0.5, 1.0))
+
+    def work():
+        for _ in range(20000):
+            counter.inc()
+            counter.inc(2)
+            histogram.observe(0.75)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 8 * 20000 * 3
+    counts, total = histogram.snapshot()
+    assert counts == [0, 8 * 20000, 0]
+    assert total == 8 * 20000 * 0.75
+    text = registry.render()
+    assert "test_total 480000" in text
+    assert 'test_seconds_bucket{le="+Inf"} 160000' in text
+
+
+def test_exporter_binds_loopback_by_default():
+    registry = Registry()
+    registry.counter("exported_total", "Test counter").inc(3)
+    server = start_http_server(0, registry=registry)
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert "exported_total 3" in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cells_of_exited_threads_are_folded_and_dropped():
+    registry = Registry()
+    counter = registry.counter("short_total", "Test counter")
+    histogram = registry.histogram("short_seconds", "Test histogram", buckets=(1.0,))
+    counter.inc(5)  # thread chính giữ cell của mình
+
+    def request():
+        counter.inc()
+        histogram.observe(0.5)
+
+    for _ in range(500):  # thread-per-request server
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+
+    assert counter.value == 505
+    assert histogram.snapshot() == ([500, 0], 250.0)
+    assert len(counter._cells) <= 2 and len(histogram._cells) <= 1
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from order_book import OrderBook, OrderBooks, read_book
+
+# Bitget books push (snapshot, rồi một delta); checksum là CRC32 có dấu của chuỗi
+# "bid1p:bid1s:ask1p:ask1s:bid2p:..." ghép từ đúng các strings exchange gửi
+SNAPSHOT = json.loads("""{
+  "action": "snapshot",
+  "arg": {"instType": "SPOT", "channel": "books", "instId": "BTCUSDT"},
+  "data": [{"asks": [["3366.8", "9.7345"], ["3368", "0.3911"]],
+            "bids": [["3366.1", "7.0737"], ["3366", "0.0148"]],
+            "checksum": 1586179731, "seq": 100, "ts": "1700000000000"}]
+}""")
+UPDATE = json.loads("""{
+  "action": "update",
+  "arg": {"instType": "SPOT", "channel": "books", "instId": "BTCUSDT"},
+  "data": [{"asks": [["3367", "1.5"]], "bids": [["3366", "0"]],
+            "checksum": 800816058, "seq": 101, "ts": "1700000000100"}]
+}""")
+
+
+def push(books, message):
+    books.handle(message["arg"]["instId"], message["action"], message["data"])
+
+
+def test_checksum_matches_bitget_fixture():
+    book = OrderBook("BTCUSDT")
+    assert book.apply("snapshot", SNAPSHOT["data"][0])
+    assert book.checksum() == 1586179731
+    assert book.apply("update", UPDATE["data"][0])
+    assert book.checksum() == 800816058
+    assert book.top(5) == ([(3366.1, 7.0737)], [(3366.8, 9.7345), (3367.0, 1.5), (3368.0, 0.3911)])
+
+
+def test_checksum_covers_only_top_25_levels_and_is_signed():
+    book = OrderBook("BTCUSDT")
+    book.apply("snapshot", {"bids": [[f"{100 - i}.5", "1"] for i in range(30)],
+                            "asks": [[f"{101 + i}.25", "2.10"] for i in range(3)]})
+    before = book.checksum()
+    book.apply("update", {"bids": [["60.5", "9"]]})  # ngoài top 25 bids
+    assert book.checksum() == before
+    book.apply("update", {"bids": [["99.5", "3"]]})
+    assert book.checksum() != before
+    assert -(1 << 31) <= book.checksum() < (1 << 31)
+
+
+def test_checksum_mismatch_resubscribes_once_until_next_snapshot(tmp_path):
+    resynced = []
+    books = OrderBooks(str(tmp_path), on_resync=resynced.append)
+    push(books, SNAPSHOT)
+    push(books, dict(UPDATE, data=[dict(UPDATE["data"][0], checksum=12345)]))
+    assert resynced == ["BTCUSDT"] and not books.books["BTCUSDT"].valid
+
+    push(books, UPDATE)  # bỏ qua tới khi có snapshot mới, không resubscribe lại
+    assert resynced == ["BTCUSDT"] and books.resyncs == 1
+    books.persist()
+    assert read_book(str(tmp_path), "BTCUSDT", 10) is None  # book lỗi không được ghi ra
+
+    push(books, SNAPSHOT)
+    push(books, UPDATE)
+    assert books.books["BTCUSDT"].valid
+    books.persist()
+    ts, seq, bids, asks, _ = read_book(str(tmp_path), "BTCUSDT", 10)
+    assert (ts, seq, bids) == (1700000000100, 101, [[3366.1, 7.0737]])
+    assert asks[0] == [3366.8, 9.7345]
+
+
+def test_collector_resubscribes_book_channel(tmp_path, monkeypatch):
+    pytest.importorskip("websocket")
+    pytest.importorskip("websockets")
+    monkeypatch.chdir(tmp_path)
+    import data_collector
+    collector = data_collector.BitgetDataCollectorProduction()
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+
+        def send(self, message):
+            self.sent.append(json.loads(message))
+
+    collector.ws = FakeSocket()
+    collector.is_running = True
+    collector.resync_book("BTCUSDT")
+    arg = {"instType": "SPOT", "channel": "books", "instId": "BTCUSDT"}
+    assert collector.ws.sent == [{"op": "unsubscribe", "args": [arg]}, {"op": "subscribe", "args": [arg]}]
+
+
+def test_mock_server_book_pushes_pass_checksum(tmp_path):
+    pytest.importorskip("websockets")
+    from mock_bitget_server import MockBook
+    resynced = []
+    books = OrderBooks(str(tmp_path), on_resync=resynced.append)
+    mock = MockBook("BTCUSDT", depth=30)
+    books.handle("BTCUSDT", "snapshot", [mock.snapshot(1700000000000)])
+    for i in range(2000):
+        books.handle("BTCUSDT", "update", [mock.update(1700000000000 + i)])
+    assert resynced == []
+    assert books.books["BTCUSDT"].checksum() == mock.book.checksum()
@@ -0,0 +1,134 @@
+import gzip
+import os
+import time
+
+import pytest
+
+import codec
+from retention import DAY_MS, RetentionManager, TradeArchive, day_of, day_start
+from trade_log import TradeLog
+
+START = 1700006400000  # 00:00 UTC
+
+
+def record(i, step_ms=3600 * 1000):
+    return {"ts": START + i * step_ms, "symbol": "BTCUSDT" if i % 3 else "ETHUSDT",
+            "price": 100.0 + i, "size": 0.5, "side": "buy", "tradeId": i}
+
+
+def make_log(log_dir, count, segment_records=12):
+    """Trade log of ``count`` hourly trades, ``segment_records`` per sealed segment"""
+    line_bytes = max(len(codec.dumps(record(i))) + 1 for i in range(count))
+    log = TradeLog(log_dir, segment_max_bytes=line_bytes * segment_records, max_segments=None)
+    log.open()
+    for i in range(count):
+        log.append(record(i))
+    log.close()
+    return log
+
+
+def read_gzip(path):
+    with gzip.open(path, 'rb') as f:
+        return [codec.loads(line) for line in f]
+
+
+def age_segments(log, mtime):
+    """Sealed records of ``log`` after backdating every segment to ``mtime``"""
+    for index in log.list_segments():
+        os.utime(log.segment_path(index), (mtime, mtime))
+    return [item for index in log.list_segments()[:-1] for item in log.read_segment(index)]
+
+
+def test_archive_segment_files_match_the_manifest(tmp_path):
+    log = make_log(str(tmp_path / "trade_log"), 30, segment_records=30)  # 30 giờ: 2 ngày
+    archive = TradeArchive(str(tmp_path / "trade_archive"))
+    manifest = archive.load_manifest()
+    assert archive.archive_segment(log, 1, manifest) == 30
+
+    expected = {}
+    for i in range(30):
+        expected.setdefault((day_of(record(i)["ts"]), record(i)["symbol"]), []).append(record(i))
+    assert {(day, symbol) for day in manifest["days"] for symbol in manifest["days"][day]} == set(expected)
+    for (day, symbol), records in expected.items():
+        [entry] = manifest["days"][day][symbol]
+        path = os.path.join(archive.archive_dir, entry["file"])
+        assert entry["file"] == os.path.join(day, symbol, "000001.ndjson.gz")
+        assert read_gzip(path) == records
+        assert (entry["segment"], entry["records"]) == (1, len(records))
+        assert (entry["first_ts"], entry["last_ts"]) == (records[0]["ts"], records[-1]["ts"])
+        assert entry["bytes"] == os.path.getsize(path)
+    assert not [name for _, _, names in os.walk(archive.archive_dir) for name in names if name.endswith(".tmp")]
+
+    # Chạy lại (compaction bị ngắt) ghi đè cùng files, không nhân đôi entries
+    archive.archive_segment(log, 1, manifest)
+    assert all(len(files) == 1 for symbols in manifest["days"].values() for files in symbols.values())
+    assert list(archive.iter_records(manifest=manifest)) == [record(i) for i in range(30)]
+
+
+def test_expire_removes_old_days_and_their_manifest_entries(tmp_path):
+    log = make_log(str(tmp_path / "trade_log"), 72, segment_records=72)  # 3 ngày
+    archive = TradeArchive(str(tmp_path / "trade_archive"))
+    manifest = archive.load_manifest()
+    archive.archive_segment(log, 1, manifest)
+    days = sorted(manifest["days"])
+    assert len(days) == 3
+
+    assert archive.expire(manifest, days[2]) == days[:2]
+    assert sorted(manifest["days"]) == days[2:]
+    assert sorted(name for name in os.listdir(archive.archive_dir)) == days[2:]
+    assert archive.first_ts(manifest) == day_start(days[2])
+    assert [item["ts"] for item in archive.iter_records(manifest=manifest)] == \
+        [START + i * 3600 * 1000 for i in range(48, 72)]
+
+
+def test_compact_archives_sealed_segments_older_than_the_hot_window(tmp_path):
+    log = make_log(str(tmp_path / "trade_log"), 40)  # segments 1..4, segment 4 đang active
+    log.open()
+    sealed = age_segments(log, time.time() - 8 * 86400)
+    manager = RetentionManager(log, str(tmp_path / "trade_archive"), hot_days=7, archive_days=None)
+    manager.compact()
+    log.close()
+
+    assert log.list_segments() == [4]
+    manifest = manager.archive.load_manifest()
+    assert manifest["pending_segments"] == []
+    assert list(manager.archive.iter_records(manifest=manifest)) == sealed
+
+
+def test_pending_segments_are_removed_after_a_crash(tmp_path, monkeypatch):
+    log = make_log(str(tmp_path / "trade_log"), 40)
+    log.open()
+    sealed = age_segments(log, time.time() - 8 * 86400)
+    crashing = RetentionManager(log, str(tmp_path / "trade_archive"), hot_days=7, archive_days=None)
+
+    def crash(index, manifest):
+        raise OSError("killed")
+
+    # Crash sau khi archive + ghi manifest, trước khi xoá segment khỏi trade log
+    monkeypatch.setattr(crashing, "_remove_segment", crash)
+    with pytest.raises(OSError):
+        crashing.compact()
+    assert crashing.archive.load_manifest()["pending_segments"] == [1]
+    assert log.list_segments() == [1, 2, 3, 4]
+
+    restarted = RetentionManager(log, str(tmp_path / "trade_archive"), hot_days=7, archive_days=None)
+    restarted.compact()
+    log.close()
+    manifest = restarted.archive.load_manifest()
+    assert manifest["pending_segments"] == [] and log.list_segments() == [4]
+    assert list(restarted.archive.iter_records(manifest=manifest)) == sealed
+
+
+def test_compact_expires_archives_beyond_archive_days(tmp_path):
+    log = make_log(str(tmp_path / "trade_log"), 40)
+    log.open()
+    now = (START + DAY_MS) / 1000 + 400 * 86400
+    sealed = age_segments(log, now - 8 * 86400)
+    manager = RetentionManager(log, str(tmp_path / "trade_archive"), hot_days=7, archive_days=400)
+    manager.compact(now=now)
+    log.close()
+    # Trades của ngày đầu (00:00 .. 23:00) quá 400 ngày, ngày sau còn giữ
+    manifest = manager.archive.load_manifest()
+    assert sorted(manifest["days"]) == [day_of(START + DAY_MS)]
+    assert list(manager.archive.iter_records(manifest=manifest)) == \
+        [item for item in sealed if item["ts"] >= START + DAY_MS]
@@ -0,0 +1,91 @@
+import glob
+import os
+
+import pytest
+
+from column_store import ColumnStoreWriter
+from shared_cache import SharedTradeCache
+from trade_record import Trade
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path / "trade_columns"), flush_batch=100000)
+    writer.open()
+    yield writer
+    writer.close()
+
+
+def append(writer, count):
+    start = writer.count
+    for row in range(start, start + count):
+        writer.append_trade(Trade(1700000000000 + row * 1000, writer.symbol_id("BTCUSDT" if row % 2 else "ETHUSDT"),
+                                  100.0, 20.0 if row % 5 == 0 else 1.0, 1, row))
+    writer.flush()
+
+
+def shared(tmp_path):
+    return SharedTradeCache(str(tmp_path / "trade_columns"), max_records=1000, snapshot_dir=str(tmp_path / "snapshots"),
+                            startup_wait=0, publish_interval=0)
+
+
+def publish(leader):
+    leader.next_publish = 0  # bỏ qua backoff theo PUBLISH_BUDGET
+    leader.refresh()
+
+
+def trade_ids(cache, symbol=None):
+    rows, _, _ = cache.range_query(symbol, limit=1000)
+    return [int(record["data"]["tradeId"]) for record in rows]
+
+
+def test_follower_maps_leader_generation_and_takes_over(tmp_path, writer):
+    append(writer, 100)
+    leader, follower = shared(tmp_path), shared(tmp_path)
+    publish(leader)
+    follower.refresh()
+    assert leader.is_leader and not follower.is_leader
+    assert follower.generation == leader.generation == 1
+    assert follower.version == 100 and follower.builder is None
+    assert trade_ids(follower, "ETHUSDT") == list(range(0, 100, 2))
+    assert follower.large_trades(min_usd=1000)[1] == 20
+
+    append(writer, 50)
+    follower.refresh()
+    assert follower.version == 100  # chỉ leader ingest và publish
+    publish(leader)
+    follower.refresh()
+    assert follower.generation == 2 and follower.version == 150
+    assert follower.stats_breakdown()["BTCUSDT"]["count"] == 75
+
+    # Leader dừng: lock được nhả, follower tự lên làm loader ở lần poll tiếp theo
+    leader.stop()
+    append(writer, 25)
+    follower.refresh()
+    assert follower.is_leader
+    assert follower.generation == 3 and follower.version == 175
+    assert trade_ids(follower)[-1] == 174
+    follower.stop()
+
+
+def test_leader_keeps_only_recent_generations(tmp_path, writer):
+    leader = shared(tmp_path)
+    for _ in range(6):
+        append(writer, 10)
+        publish(leader)
+    generations = sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / "snapshots" / "gen_*.snap")))
+    assert generations == [f"gen_{generation:012d}.snap" for generation in (4, 5, 6)]
+    assert leader.generation == 6 and leader.version == 60
+    leader.stop()
+
+
+def test_leader_publishes_at_most_every_interval(tmp_path, writer):
+    append(writer, 10)
+    leader = shared(tmp_path)
+    leader.publish_interval = 60
+    leader.refresh()
+    append(writer, 10)
+    leader.refresh()
+    assert leader.generation == 1 and leader.version == 10
+    assert leader.builder.version == 20  # đã ingest, chờ generation sau
+    leader.stop()
@@ -0,0 +1,299 @@
+import pytest
+
+from column_store import ColumnStoreWriter
+from trade_cache import SymbolIndex, TradeCache, decode_cursor
+from trade_record import Trade
+
+
+def write_store(store_dir, trades):
+    """Column store holding (ts, symbol, trade_id) tuples in the given order"""
+    writer = ColumnStoreWriter(str(store_dir), flush_batch=1000)
+    writer.open()
+    for ts, symbol, trade_id in trades:
+        writer.append_trade(Trade(ts, writer.symbol_id(symbol), 100.0, 1.0, 0, trade_id))
+    writer.close()
+
+
+def page_all(cache, symbol=None, limit=3, **kwargs):
+    results, cursor = [], None
+    for _ in range(len(cache.all_index) + 1):  # cursor lỗi không được lặp vô hạn
+        rows, _, next_cursor = cache.range_query(symbol, cursor=cursor, limit=limit, **kwargs)
+        results.extend(int(record["data"]["tradeId"]) for record in rows)
+        if next_cursor is None:
+            return results
+        cursor = decode_cursor(next_cursor)
+    return results
+
+
+@pytest.fixture
+def mixed_cache(tmp_path):
+    # Cùng ts, nhiều symbols, tradeIds không tăng theo thứ tự insert
+    trades = []
+    for ts in (1000, 1000, 1000, 2000, 2000, 3000):
+        for symbol, base in (("BTCUSDT", 900), ("ETHUSDT", 100), ("SOLUSDT", 500)):
+            trades.append((ts, symbol, base + len(trades)))
+    trades.append((2000, "ETHUSDT", 1))  # đến trễ, tradeId nhỏ nhất
+    write_store(tmp_path, trades)
+    cache = TradeCache(str(tmp_path), max_records=1000)
+    cache.refresh()
+    return cache, trades
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 7])
+def test_cursor_pages_mixed_symbols_exactly_once(mixed_cache, limit):
+    cache, trades = mixed_cache
+    ids = page_all(cache, limit=limit)
+    assert sorted(ids) == sorted(trade_id for _, _, trade_id in trades)
+    assert len(ids) == len(set(ids))
+
+
+def test_cursor_pages_symbol_and_range_exactly_once(mixed_cache):
+    cache, trades = mixed_cache
+    expected = sorted(trade_id for ts, symbol, trade_id in trades if symbol == "ETHUSDT" and 1000 <= ts <= 2000)
+    ids = page_all(cache, "ETHUSDT", limit=2, from_ts=1000, to_ts=2000)
+    assert sorted(ids) == expected
+    assert len(ids) == len(set(ids))
+
+
+def test_late_trades_merge_on_commit_without_shifting_readers():
+    index = SymbolIndex()
+    for row, ts in enumerate((1000, 2000, 3000, 4000)):
+        index.add(row, ts)
+    index.commit()
+    before = index.state
+
+    # Batch xen kẽ nhiều symbols: ts lùi lại so với tail
+    for row, ts in ((4, 5000), (5, 2500), (6, 1000), (7, 4500)):
+        index.add(row, ts)
+    rows, stamps, size = index.state
+    assert index.state is before and list(rows[:size]) == [0, 1, 2, 3]
+
+    index.commit()
+    rows, stamps, size = index.state
+    assert list(stamps[:size]) == [1000, 1000, 2000, 2500, 3000, 4000, 4500, 5000]
+    assert list(rows[:size]) == [0, 6, 1, 5, 2, 3, 7, 4]
+    assert list(before[0][:before[2]]) == [0, 1, 2, 3]  # snapshot cũ của reader không đổi
+
+
+def test_in_order_batch_appends_in_place():
+    index = SymbolIndex()
+    index.add(0, 1000)
+    index.commit()
+    rows = index.state[0]
+    index.add(2, 2000)
+    index.add(1, 1000)  # cùng ts với tail, row lớn hơn
+    index.commit()
+    assert index.state[0] is rows
+    assert list(index.state[0]) == [0, 1, 2]
+
+
+def window_rows(cache):
+    for index in [cache.all_index, *cache.symbol_index.values()]:
+        rows, _, size = index.state
+        yield from rows[:size]
+
+
+def test_cold_load_and_refresh_keep_indexes_to_the_window(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000)
+    writer.open()
+    row = 0
+    for _ in range(5000):
+        # Mỗi trade thứ 10 đến trễ 5s: arrays không tăng dần theo row
+        ts = row * 1000 - (5000 if row % 10 == 9 else 0)
+        writer.append_trade(Trade(ts, writer.symbol_id("BTCUSDT" if row % 3 else "ETHUSDT"), 100.0, 1.0, 0, row))
+        row += 1
+    writer.flush()
+
+    cache = TradeCache(str(tmp_path), max_records=1000)
+    cache.refresh()
+    assert len(cache.all_index) == 1000
+    assert min(window_rows(cache)) == 4000
+
+    for _ in range(3):
+        for _ in range(700):
+            ts = row * 1000 - (5000 if row % 10 == 9 else 0)
+            writer.append_trade(Trade(ts, writer.symbol_id("BTCUSDT" if row % 3 else "ETHUSDT"), 100.0, 1.0, 0, row))
+            row += 1
+        writer.flush()
+        cache.refresh()
+        rows = sorted(window_rows(cache))
+        assert len(cache.all_index) == 1000
+        assert rows == sorted(list(range(row - 1000, row)) * 2)
+        stamps = cache.all_index.state[1]
+        assert list(stamps) == sorted(stamps)
+    writer.close()
+
+
+def test_commit_with_exported_buffer_copies_and_can_retry():
+    index = SymbolIndex()
+    index.add(0, 1000)
+    index.commit()
+    rows = index.state[0]
+    exported = memoryview(rows)  # reader giữ buffer: extend tại chỗ sẽ BufferError
+    index.add(1, 2000)
+    index.commit()
+    assert index.state[0] is not rows and list(index.state[0]) == [0, 1]
+    assert list(exported) == [0] and not index.pending
+    exported.release()
+
+
+def stats_of(cache):
+    return cache.total_trades, cache.total_volume, {symbol: (stats["count"], stats["volume"], stats["min_price"],
+                                                              stats["max_price"], stats["last_price"])
+                                                     for symbol, stats in cache.stats_breakdown().items()}
+
+
+def test_aggregates_cover_the_store_regardless_of_restarts(tmp_path):
+    writer = ColumnStoreWriter(str(tmp_path), flush_batch=100000)
+    writer.open()
+    warm = TradeCache(str(tmp_path), max_records=100)
+    for batch in range(5):
+        for i in range(300):
+            row = batch * 300 + i
+            writer.append_trade(Trade(row * 1000, writer.symbol_id("BTCUSDT" if row % 3 else "ETHUSDT"),
+                                      100.0 + row % 50, 0.5, 0, row))
+        writer.flush()
+        warm.refresh()
+
+    cold = TradeCache(str(tmp_path), max_records=100)
+    cold.refresh()
+    assert len(cold.all_index) == 100
+    assert stats_of(cold) == stats_of(warm)
+    assert warm.total_trades == 1500
+
+    # Retention: aggregates được tính lại từ rows còn lại
+    writer.drop_before(1000 * 1000)
+    warm.refresh()
+    fresh = TradeCache(str(tmp_path), max_records=100)
+    fresh.refresh()
+    writer.close()
+    assert warm.total_trades == 500
+    assert stats_of(warm) == stats_of(fresh)
+
+
+
+def test_retention_drop_only_rescans_the_block_it_cuts(tmp_path, monkeypatch):
+    import trade_cache
+    monkeypatch.setattr(trade_cache, "STATS_BLOCK_ROWS", 100)
+    store_dir = str(tmp_path / "trade_columns")
+    checkpoint = str(tmp_path / "cache.snap")
+    writer = ColumnStoreWriter(store_dir, flush_batch=100000)
+    writer.open()
+    for row in range(1500):
+        # Giá thấp nhất/cao nhất nằm trong rows sẽ bị drop
+        price = 1.0 if row == 3 else 999.0 if row == 1021 else 100.0 + row % 50
+        writer.append_trade(Trade(row * 1000, writer.symbol_id("BTCUSDT" if row % 3 else "ETHUSDT"),
+                                  price, 0.5, 0, row))
+    writer.flush()
+    cache = TradeCache(store_dir, max_records=100, checkpoint_path=checkpoint)
+    cache.refresh()
+    cache.save_checkpoint()
+    restored = TradeCache(store_dir, max_records=100, checkpoint_path=checkpoint)
+    assert restored.warm_start()
+
+    scanned = []
+    for each in (cache, restored):
+        accumulate = each.accumulate
+        monkeypatch.setattr(each, "accumulate", lambda start, stop, accumulate=accumulate:
+                            scanned.append((start, stop)) or accumulate(start, stop))
+    writer.drop_before(1050 * 1000)
+    cache.refresh()
+    restored.refresh()
+    fresh = TradeCache(store_dir, max_records=100)
+    fresh.refresh()
+    writer.close()
+
+    assert scanned == [(1050, 1100), (1050, 1100)]  # chỉ phần còn lại của block 1000..1099
+    assert cache.total_trades == 450
+    assert stats_of(cache) == stats_of(restored) == stats_of(fresh)
+    assert stats_of(cache)[2]["ETHUSDT"][2] > 1.0 and stats_of(cache)[2]["BTCUSDT"][3] < 999.0
+
+@pytest.fixture
+def checkpointed(tmp_path):
+    """Column store of 300 rows with a checkpoint taken at row 200"""
+    store_dir = str(tmp_path / "trade_columns")
+    checkpoint = str(tmp_path / "cache.snap")
+    writer = ColumnStoreWriter(store_dir, flush_batch=100000)
+    writer.open()
+    for row in range(300):
+        writer.append_trade(Trade(row * 1000, writer.symbol_id("BTCUSDT" if row % 2 else "ETHUSDT"),
+                                  100.0, 50.0 if row % 7 == 0 else 1.0, 0, row))
+        if row == 199:
+            writer.flush()
+            cache = TradeCache(store_dir, max_records=1000, checkpoint_path=checkpoint)
+            cache.refresh()
+            cache.save_checkpoint()
+    writer.close()
+    return store_dir, checkpoint
+
+
+def cache_state(cache):
+    return (cache.version, stats_of(cache), page_all(cache, limit=1000),
+            cache.large_trades(None, None, 0, 1000, False))
+
+
+def test_warm_start_resumes_from_checkpoint(checkpointed):
+    store_dir, checkpoint = checkpointed
+    warm = TradeCache(store_dir, max_records=1000, checkpoint_path=checkpoint)
+    assert warm.warm_start()
+    assert warm.version == 200 and warm.checkpoint_version == 200
+    assert warm.refresh() == 100  # chỉ ingest phần đuôi sau checkpoint
+
+    cold = TradeCache(store_dir, max_records=1000)
+    cold.refresh()
+    assert cache_state(warm) == cache_state(cold)
+
+
+@pytest.mark.parametrize("kwargs", [{"max_records": 500}, {"large_trade_usd": 10.0}])
+def test_warm_start_rejects_checkpoint_with_other_settings(checkpointed, kwargs):
+    store_dir, checkpoint = checkpointed
+    options = {"max_records": 1000, **kwargs}
+    cache = TradeCache(store_dir, checkpoint_path=checkpoint, **options)
+    assert not cache.warm_start()
+    assert cache.version == 0
+
+    cache.load()  # fallback: cold load
+    expected = TradeCache(store_dir, **options)
+    expected.refresh()
+    assert cache_state(cache) == cache_state(expected)
+
+
+def test_warm_start_rejects_checkpoint_of_a_replaced_store(checkpointed, tmp_path):
+    store_dir, checkpoint = checkpointed
+    # Store mới: ít rows hơn checkpoint, rồi cùng số rows nhưng ts khác
+    for count, offset in ((150, 0), (250, 7)):
+        replaced = str(tmp_path / f"replaced_{count}")
+        writer = ColumnStoreWriter(replaced, flush_batch=100000)
+        writer.open()
+        for row in range(count):
+            writer.append_trade(Trade(row * 1000 + offset, writer.symbol_id("BTCUSDT"), 100.0, 1.0, 0, row))
+        writer.close()
+        cache = TradeCache(replaced, max_records=1000, checkpoint_path=checkpoint)
+        assert not cache.warm_start()
+        cache.load()
+        assert cache.version == count and cache.total_trades == count
+        assert page_all(cache, limit=1000) == list(range(count))
+
+
+@pytest.mark.parametrize("corrupt", ["empty", "header", "magic", "meta", "arrays", "arrays_aligned"])
+def test_warm_start_ignores_corrupted_checkpoint(checkpointed, corrupt):
+    store_dir, checkpoint = checkpointed
+    with open(checkpoint, 'rb') as f:
+        raw = f.read()
+    raw = {
+        "empty": b"",
+        "header": raw[:10],
+        "magic": b"XXXXXXXX" + raw[8:],
+        "meta": raw[:40],
+        "arrays": raw[:-3],
+        "arrays_aligned": raw[:-64],   # cắt đúng biên 8 bytes: cast vẫn thành công
+    }[corrupt]
+    with open(checkpoint, 'wb') as f:
+        f.write(raw)
+
+    cache = TradeCache(store_dir, max_records=1000, checkpoint_path=checkpoint)
+    assert not cache.warm_start()
+    cache.load()
+    cold = TradeCache(store_dir, max_records=1000)
+    cold.refresh()
+    assert cache_state(cache) == cache_state(cold)
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import trade_guard
+from trade_guard import TradeGuard, load_gaps
+from trade_record import Trade
+
+
+def trade(trade_id, ts):
+    return Trade(ts, 0, 100.0, 1.0, 1, trade_id)
+
+
+@pytest.fixture
+def guard(tmp_path):
+    return TradeGuard(window=4, gaps_file=str(tmp_path / "gaps.json"))
+
+
+def ids(trades):
+    return [trade.trade_id for trade in trades]
+
+
+def test_drops_duplicate_trade_ids(guard):
+    assert ids(guard.filter("BTCUSDT", [trade(1, 1000), trade(2, 1001), trade(2, 1001)])) == [1, 2]
+    assert ids(guard.filter("BTCUSDT", [trade(2, 1001), trade(3, 1002)])) == [3]
+    assert ids(guard.filter("ETHUSDT", [trade(2, 1001)])) == [2]  # tradeId theo từng symbol
+    assert guard.duplicates() == 2
+
+
+def test_evicts_ids_past_the_window(guard):
+    guard.filter("BTCUSDT", [trade(i, 1000 + i) for i in range(1, 7)])
+    state = guard.symbols["BTCUSDT"]
+    assert state.seen == {3, 4, 5, 6} and list(state.order) == [3, 4, 5, 6]
+    # Id đã bị evict được nhận lại, id còn trong window thì không
+    assert ids(guard.filter("BTCUSDT", [trade(1, 1001), trade(6, 1006)])) == [1]
+
+
+def test_resync_batch_overlapping_known_ids_records_no_gap(guard, tmp_path):
+    guard.filter("BTCUSDT", [trade(1, 1000), trade(2, 2000)])
+    guard.expect_resync()
+    # Reconnect: Bitget gửi lại vài trades gần nhất cùng trades mới
+    assert ids(guard.filter("BTCUSDT", [trade(2, 2000), trade(3, 9000)])) == [3]
+    assert guard.gaps == []
+    assert not os.path.exists(tmp_path / "gaps.json")
+
+
+def test_resync_batch_after_last_ts_records_gap_atomically(guard, tmp_path, monkeypatch):
+    path = str(tmp_path / "gaps.json")
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(trade_guard.os, "replace",
+                        lambda src, dst: (replaced.append((src, dst)), replace(src, dst)))
+
+    guard.filter("BTCUSDT", [trade(1, 1000), trade(2, 2000)])
+    guard.expect_resync(["BTCUSDT"])
+    assert ids(guard.filter("BTCUSDT", [trade(10, 7000), trade(9, 6000)])) == [10, 9]
+
+    assert [(gap["symbol"], gap["from_ts"], gap["to_ts"]) for gap in guard.gaps] == [("BTCUSDT", 2000, 6000)]
+    assert replaced == [(path + ".tmp", path)]  # ghi file tạm rồi rename
+    assert not os.path.exists(path + ".tmp")
+    assert load_gaps(path) == guard.gaps
+    # Gaps đã ghi được load lại khi collector khởi động lại
+    assert TradeGuard(gaps_file=path).gaps == guard.gaps
+
+
+def test_only_the_first_batch_after_resync_is_checked(guard):
+    guard.filter("BTCUSDT", [trade(1, 1000)])
+    guard.expect_resync()
+    guard.filter("BTCUSDT", [trade(1, 1000)])
+    guard.filter("BTCUSDT", [trade(5, 9000)])  # batch thường: không phải gap
+    assert guard.gaps == []
+
+
+def test_process_trades_forwards_only_fresh_trades(tmp_path, monkeypatch):
+    pytest.importorskip("websocket")
+    pytest.importorskip("websockets")
+    monkeypatch.chdir(tmp_path)
+    import data_collector
+    collector = data_collector.BitgetDataCollectorProduction()
+    submitted = []
+    monkeypatch.setattr(collector.writer, "submit", submitted.append)
+
+    push = [{"ts": "1700000000000", "price": "100", "size": "0.5", "side": "buy", "tradeId": "11"},
+            {"ts": "1700000000001", "price": "101", "size": "0.5", "side": "sell", "tradeId": "12"}]
+    collector.column_store.open()
+    try:
+        collector.process_trades("BTCUSDT", push)
+        collector.process_trades("BTCUSDT", push[1:] + [dict(push[1], tradeId="13")])
+    finally:
+        collector.column_store.close()
+    assert [trade.trade_id for trade in submitted] == [11, 12, 13]
+    assert collector.guard.duplicates() == 1
+    assert collector.guard.gaps == []
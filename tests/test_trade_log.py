@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import trade_log
+from trade_log import CLEAN_MARKER, TradeLog, parse_segment_index, segment_name
+
+
+def record(i):
+    return {"ts": 1700000000000 + i, "symbol": "BTCUSDT", "price": "100.5", "size": "0.25", "tradeId": str(i)}
+
+
+def trade_ids(log):
+    return [int(item["tradeId"]) for item in log.iter_records()]
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """File descriptors passed to os.fsync, in call order"""
+    calls = []
+    fsync = os.fsync
+    monkeypatch.setattr(trade_log.os, "fsync", lambda fd: calls.append(fd) or fsync(fd))
+    return calls
+
+
+def test_recover_truncates_torn_line_and_appends_continue(tmp_path):
+    log = TradeLog(str(tmp_path))
+    log.open()
+    for i in range(3):
+        log.append(record(i))
+    log.flush()
+    path = log.segment_path(log.active_index)
+    log.active_file.close()  # crash: không có close(), không có CLEAN marker
+    intact = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'{"ts": 1700000000003, "symbol": "BTC')
+
+    reopened = TradeLog(str(tmp_path))
+    reopened.open()
+    assert not reopened.clean_start
+    assert os.path.getsize(path) == intact == reopened.active_size
+    reopened.append(record(3))
+    reopened.close()
+    assert trade_ids(TradeLog(str(tmp_path))) == [0, 1, 2, 3]
+
+
+def test_recover_drops_an_invalid_line_and_everything_after_it(tmp_path):
+    log = TradeLog(str(tmp_path))
+    log.open()
+    log.append(record(0))
+    log.flush()
+    path = log.segment_path(log.active_index)
+    log.active_file.close()
+    with open(path, 'ab') as f:
+        f.write(b'not json\n' + trade_log.codec.dumps(record(1)) + b'\n')
+
+    log.recover_segment(log.active_index)
+    assert trade_ids(log) == [0]
+
+
+def test_rollover_at_segment_max_bytes(tmp_path):
+    line_bytes = len(trade_log.codec.dumps(record(0))) + 1
+    log = TradeLog(str(tmp_path), segment_max_bytes=line_bytes * 10, max_segments=None)
+    log.open()
+    for i in range(25):
+        log.append(record(i))
+    log.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        [CLEAN_MARKER, segment_name(1), segment_name(2), segment_name(3)])
+    assert segment_name(2) == "segment_000002.ndjson" and parse_segment_index(segment_name(2)) == 2
+    assert parse_segment_index("segment_000002.ndjson.tmp") is None
+    assert [len(log.read_segment(index)) for index in log.list_segments()] == [10, 10, 5]
+    assert trade_ids(log) == list(range(25))
+    assert [int(item["tradeId"]) for item in log.read_tail(7)] == list(range(18, 25))
+
+
+def test_rollover_removes_segments_beyond_max_segments(tmp_path):
+    line_bytes = len(trade_log.codec.dumps(record(0))) + 1
+    log = TradeLog(str(tmp_path), segment_max_bytes=line_bytes * 2, max_segments=2)
+    log.open()
+    for i in range(9):
+        log.append(record(i))
+    log.close()
+    assert log.list_segments() == [4, 5]
+    assert trade_ids(log) == [6, 7, 8]
+
+
+def test_fsync_is_batched(tmp_path, fsyncs):
+    log = TradeLog(str(tmp_path), fsync_batch=5, fsync_interval=3600)
+    log.open()
+    fd = log.active_file.fileno()
+    del fsyncs[:]
+    for i in range(12):
+        log.append(record(i))
+    assert fsyncs.count(fd) == 2 and log.pending == 2
+    log.flush()
+    assert fsyncs.count(fd) == 3 and log.pending == 0
+    log.flush()  # không có gì pending: không fsync lại
+    assert fsyncs.count(fd) == 3
+    log.close()
+
+
+def test_fsync_after_interval_even_below_batch(tmp_path, fsyncs, monkeypatch):
+    log = TradeLog(str(tmp_path), fsync_batch=1000, fsync_interval=1.0)
+    log.open()
+    fd = log.active_file.fileno()
+    del fsyncs[:]  # fsync của segment mới tạo (cùng số fd)
+    log.append(record(0))
+    assert fsyncs.count(fd) == 0
+    monkeypatch.setattr(trade_log.time, "time", lambda: log.last_fsync + 1.5)
+    log.append(record(1))
+    assert fsyncs.count(fd) == 1 and log.pending == 0
+    log.close()
+
+
+def test_restart_with_clean_marker_skips_recovery(tmp_path, monkeypatch):
+    log = TradeLog(str(tmp_path))
+    log.open()
+    for i in range(3):
+        log.append(record(i))
+    log.close()
+    assert os.path.exists(os.path.join(str(tmp_path), CLEAN_MARKER))
+
+    scanned = []
+    monkeypatch.setattr(TradeLog, "recover_segment", lambda self, index: scanned.append(index))
+    reopened = TradeLog(str(tmp_path))
+    reopened.open()
+    assert reopened.clean_start and scanned == []
+    assert not os.path.exists(os.path.join(str(tmp_path), CLEAN_MARKER))  # marker chỉ dùng một lần
+    reopened.append(record(3))
+    reopened.close()
+    assert trade_ids(reopened) == [0, 1, 2, 3]
+
+
+def test_restart_with_stale_or_missing_marker_recovers(tmp_path, monkeypatch):
+    log = TradeLog(str(tmp_path))
+    log.open()
+    log.append(record(0))
+    log.close()
+    # Segment bị ghi thêm sau close() (size không còn khớp marker)
+    with open(log.segment_path(log.active_index), 'ab') as f:
+        f.write(b'{"torn')
+
+    scanned = []
+    recover = TradeLog.recover_segment
+    monkeypatch.setattr(TradeLog, "recover_segment",
+                        lambda self, index: scanned.append(index) or recover(self, index))
+    stale = TradeLog(str(tmp_path))
+    stale.open()
+    assert not stale.clean_start and scanned == [1]
+    stale.active_file.close()  # crash: không có marker
+
+    missing = TradeLog(str(tmp_path))
+    missing.open()
+    assert not missing.clean_start and scanned == [1, 1]
+    missing.close()
+    assert trade_ids(missing) == [0]
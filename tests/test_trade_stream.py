@@ -0,0 +1,114 @@
+import socket
+import threading
+import time
+
+import codec
+from trade_stream import Subscription, TradePublisher, TradeSubscriber
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def trade(i, symbol="BTCUSDT"):
+    return {"symbol": symbol, "ts": 1700000000000 + i, "price": "100.5", "size": "0.25", "tradeId": str(i)}
+
+
+def test_slow_client_is_dropped_while_others_keep_receiving(tmp_path):
+    path = str(tmp_path / "stream.sock")
+    publisher = TradePublisher(path, max_pending_bytes=64 * 1024)
+    publisher.start()
+    subscriber = TradeSubscriber(path, reconnect_delay=0.05)
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.connect(path)  # không bao giờ đọc
+        subscription = subscriber.subscribe(max_queue=100000)
+        assert wait_for(lambda: len(publisher.clients) == 2)
+
+        sent = 0
+        while sent < 20000:
+            publisher.publish([trade(sent + i) for i in range(500)])
+            sent += 500
+            assert wait_for(lambda: subscriber.received == sent)  # fast client theo kịp từng batch
+
+        assert publisher.dropped_clients == 1
+        assert len(publisher.clients) == 1
+        received = []
+        while len(received) < sent:
+            batch = subscription.get_batch(1.0)
+            assert batch
+            received.extend(batch)
+        assert [int(record["tradeId"]) for record in received] == list(range(sent))
+        assert publisher.published == sent
+    finally:
+        subscriber.stop()
+        slow.close()
+        publisher.stop()
+
+
+def test_backlog_is_flushed_without_another_publish(tmp_path):
+    path = str(tmp_path / "stream.sock")
+    publisher = TradePublisher(path, max_pending_bytes=16 * 1024 * 1024)
+    publisher.start()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.connect(path)
+        assert wait_for(lambda: len(publisher.clients) == 1)
+        publisher.publish([trade(i) for i in range(20000)])  # lớn hơn socket buffer: còn backlog
+        assert any(publisher.clients.values())
+
+        # Collector im lặng từ đây: client đọc dần và vẫn nhận đủ
+        data = bytearray()
+        client.settimeout(5)
+        while data.count(b"\n") < 20000:
+            chunk = client.recv(65536)
+            assert chunk
+            data += chunk
+        assert [int(codec.loads(line)["tradeId"]) for line in data.splitlines()] == list(range(20000))
+        assert publisher.dropped_clients == 0
+    finally:
+        client.close()
+        publisher.stop()
+
+
+def test_subscription_coalesces_and_drops_oldest():
+    notified = []
+    subscription = Subscription(max_queue=1000, notify=lambda: notified.append(1))
+    for i in range(1500):
+        subscription.offer(trade(i))
+    assert len(notified) == 1  # chỉ báo khi queue rỗng có trade mới
+    batch = subscription.get_batch(0)
+    assert [int(record["tradeId"]) for record in batch] == list(range(500, 1500))
+    assert subscription.dropped == 500
+    assert subscription.get_batch(0) == []
+
+    subscription.offer(trade(1500))
+    assert len(notified) == 2
+
+
+def test_dispatch_filters_symbols_and_close_wakes_readers():
+    subscriber = TradeSubscriber("/nonexistent.sock")
+    subscriber.ensure_started = lambda: None  # không cần reader thread
+    btc = subscriber.subscribe({"BTCUSDT"})
+    everything = subscriber.subscribe()
+    for i, symbol in enumerate(("btcusdt", "ETHUSDT", "BTCUSDT")):
+        subscriber._dispatch(codec.dumps(trade(i, symbol)))
+    subscriber._dispatch(b"not json\n")
+    assert [record["tradeId"] for record in btc.get_batch(0)] == ["0", "2"]
+    assert len(everything.get_batch(0)) == 3
+    assert subscriber.received == 3
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(btc.get_batch(10)))
+    waiter.start()
+    time.sleep(0.05)
+    subscriber.unsubscribe(btc)
+    waiter.join(2)
+    assert result == [[]] and subscriber.subscriptions == [everything]
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from trade_writer import TradeWriter
+
+
+class Sink:
+    """Records batches; ``gate`` (if set) holds the writer inside sink() until released"""
+
+    def __init__(self, gated=False):
+        self.batches = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        if not gated:
+            self.gate.set()
+        self.fail = False
+
+    def __call__(self, batch):
+        self.entered.set()
+        self.gate.wait(5)
+        if self.fail:
+            raise OSError("disk full")
+        self.batches.append(list(batch))
+
+    def items(self):
+        return [item for batch in self.batches for item in batch]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def make_writer():
+    writers = []
+
+    def make(sink, **kwargs):
+        writer = TradeWriter(sink, **kwargs)
+        writer.start()
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.stop()
+
+
+def test_full_ring_blocks_then_drops(make_writer):
+    sink = Sink(gated=True)
+    writer = make_writer(sink, capacity=4, flush_records=1, flush_interval=10.0, block_timeout=0.05)
+    assert writer.submit(0)
+    assert sink.entered.wait(2)  # writer đang kẹt trong sink với batch [0]
+
+    for i in range(1, 5):
+        assert writer.submit(i)
+    assert writer.depth() == 4
+    started = time.monotonic()
+    assert not writer.submit(5)
+    assert not writer.submit(6)
+    assert time.monotonic() - started >= 0.1  # mỗi lần chờ block_timeout trước khi drop
+    metrics = writer.metrics()
+    assert (metrics["dropped"], metrics["blocked"], metrics["submitted"]) == (2, 2, 5)
+    assert metrics["max_queue_depth"] == 4
+
+    sink.gate.set()
+    writer.stop()
+    assert sink.items() == [0, 1, 2, 3, 4]
+    assert writer.metrics()["written"] == 5
+
+
+def test_blocked_producer_resumes_when_the_writer_frees_space(make_writer):
+    sink = Sink(gated=True)
+    writer = make_writer(sink, capacity=2, flush_records=1, flush_interval=10.0, block_timeout=2.0)
+    writer.submit(0)
+    assert sink.entered.wait(2)
+    writer.submit(1)
+    writer.submit(2)
+
+    result = []
+    producer = threading.Thread(target=lambda: result.append(writer.submit(3)))
+    producer.start()
+    assert wait_for(lambda: writer.blocked == 1)
+    sink.gate.set()
+    producer.join(2)
+    assert result == [True] and writer.dropped == 0
+    writer.stop()
+    assert sink.items() == [0, 1, 2, 3]
+
+
+def test_flushes_once_flush_records_are_queued(make_writer):
+    sink = Sink()
+    writer = make_writer(sink, flush_records=3, flush_interval=10.0)
+    writer.submit("a")
+    writer.submit("b")
+    time.sleep(0.1)
+    assert sink.batches == []
+    writer.submit("c")
+    assert wait_for(lambda: sink.batches)
+    assert sink.batches == [["a", "b", "c"]]
+
+
+def test_flushes_partial_batch_after_flush_interval(make_writer):
+    sink = Sink()
+    writer = make_writer(sink, flush_records=1000, flush_interval=0.1)
+    started = time.monotonic()
+    writer.submit("a")
+    assert wait_for(lambda: sink.batches)
+    assert sink.batches == [["a"]]
+    assert time.monotonic() - started < 1.0
+    writer.submit("b")
+    writer.flush()  # flush() không chờ interval
+    assert wait_for(lambda: len(sink.batches) == 2)
+
+
+def test_sink_errors_are_counted_and_writer_keeps_going(make_writer):
+    sink = Sink()
+    sink.fail = True
+    writer = make_writer(sink, flush_records=1, flush_interval=10.0)
+    writer.submit("lost")
+    assert wait_for(lambda: writer.errors == 1)
+    sink.fail = False
+    writer.submit("kept")
+    writer.stop()
+    assert sink.items() == ["kept"]
+    assert writer.metrics()["written"] == 1
+
+
+def test_stop_drains_and_releases_producers():
+    sink = Sink()
+    writer = TradeWriter(sink, capacity=1000, flush_records=1000, flush_interval=10.0)
+    writer.start()
+    for i in range(100):
+        writer.submit(i)
+    writer.stop()
+    assert sink.items() == list(range(100))
+    assert writer.depth() == 0
+
+    # Writer đã dừng: ring đầy thì drop ngay, không chờ block_timeout
+    stopped = TradeWriter(sink, capacity=1, block_timeout=10.0)
+    assert stopped.submit("x")
+    started = time.monotonic()
+    assert not stopped.submit("y")
+    assert time.monotonic() - started < 1.0
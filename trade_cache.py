@@ -0,0 +1,731 @@
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+
+from column_store import ColumnStoreReader, RowsView, read_extent
+import codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = metrics.histogram("trade_cache_refresh_seconds", "Incremental cache refresh time")
+REFRESH_ROWS = metrics.histogram("trade_cache_refresh_rows", "Rows ingested per cache refresh",
+                                 buckets=metrics.COUNT_BUCKETS)
+
+# Aggregates are kept per block of rows: retention drops whole blocks and rescans one at most
+STATS_BLOCK_ROWS = 1 << 16
+
+
+class SymbolIndex:
+    """Row numbers and exchange timestamps of one symbol, sorted by (ts, row).
+
+    Readers take ``state`` (rows, ts, size) in one attribute read. ``add``
+    only queues a row; ``commit`` sorts the batch and appends it past
+    ``size`` (into a copy if a reader still exports the arrays' buffer),
+    or merges it into new arrays when it holds trades older than the
+    tail. Trims build new arrays too, so a reader's snapshot never
+    shifts under it.
+    """
+
+    def __init__(self):
+        self.state = (array('q'), array('q'), 0)
+        self.pending = []
+
+    def add(self, row, ts):
+        self.pending.append((ts, row))
+
+    def commit(self):
+        """Publish the rows added since the previous commit"""
+        pending = self.pending
+        if not pending:
+            return
+        pending.sort()
+        rows, stamps, size = self.state
+        if not size or pending[0][0] >= stamps[size - 1]:
+            # Cả batch nằm sau tail: append tại chỗ, reader chỉ đọc tới size cũ
+            new_rows = [row for _, row in pending]
+            new_stamps = [ts for ts, _ in pending]
+            try:
+                rows.extend(new_rows)
+                stamps.extend(new_stamps)
+            except BufferError:
+                # Một reader còn export buffer của arrays (vd. memoryview): append vào bản copy
+                rows = rows[:size]
+                stamps = stamps[:size]
+                rows.extend(new_rows)
+                stamps.extend(new_stamps)
+        else:
+            # Trade đến trễ (all_index gần như batch nào cũng có): merge cả batch một lần
+            # với phần tail có ts >= ts nhỏ nhất của batch, vào arrays mới
+            position = bisect_right(stamps, pending[0][0], 0, size)
+            merged = list(zip(stamps[position:size], rows[position:size]))
+            merged.extend(pending)
+            merged.sort()
+            rows = rows[:position]
+            stamps = stamps[:position]
+            rows.extend([row for _, row in merged])
+            stamps.extend([ts for ts, _ in merged])
+        self.state = (rows, stamps, len(rows))
+        # Chỉ bỏ batch khi đã publish: commit lỗi giữa chừng có thể chạy lại
+        self.pending = []
+
+    def trim(self, first_row, max_ts=None):
+        """Drop every entry with row < first_row.
+
+        ``max_ts`` bounds the ts of those rows, so only the head of the
+        arrays up to it is scanned; the rest is copied as is.
+        """
+        rows, stamps, size = self.state
+        end = size if max_ts is None else bisect_right(stamps, max_ts, 0, size)
+        keep = [i for i in range(end) if rows[i] >= first_row]
+        if len(keep) == end:
+            return
+        new_rows = array('q', [rows[i] for i in keep])
+        new_stamps = array('q', [stamps[i] for i in keep])
+        new_rows.extend(rows[end:size])
+        new_stamps.extend(stamps[end:size])
+        self.state = (new_rows, new_stamps, len(new_rows))
+
+    def keep_last(self, limit):
+        """Keep the newest ``limit`` entries"""
+        rows, stamps, size = self.state
+        if size > limit:
+            self.state = (rows[size - limit:size], stamps[size - limit:size], limit)
+
+    def __len__(self):
+        return self.state[2]
+
+
+class SymbolStats:
+    """Running aggregates for one symbol, updated in O(1) per trade"""
+
+    __slots__ = ("count", "volume", "base_volume", "min_price", "max_price", "last_ts", "last_price")
+
+    def __init__(self):
+        self.count = 0
+        self.volume = 0.0        # notional (price * size)
+        self.base_volume = 0.0   # sum of size, for VWAP
+        self.min_price = None
+        self.max_price = None
+        self.last_ts = 0
+        self.last_price = None
+
+    def update(self, price, size, ts):
+        self.count += 1
+        self.volume += price * size
+        self.base_volume += size
+        if self.min_price is None or price < self.min_price:
+            self.min_price = price
+        if self.max_price is None or price > self.max_price:
+            self.max_price = price
+        if ts >= self.last_ts:
+            self.last_ts = ts
+            self.last_price = price
+
+    def merge(self, other):
+        """Fold in the aggregates of later rows"""
+        if not other.count:
+            return
+        self.count += other.count
+        self.volume += other.volume
+        self.base_volume += other.base_volume
+        if self.min_price is None or other.min_price < self.min_price:
+            self.min_price = other.min_price
+        if self.max_price is None or other.max_price > self.max_price:
+            self.max_price = other.max_price
+        if other.last_ts >= self.last_ts:
+            self.last_ts = other.last_ts
+            self.last_price = other.last_price
+
+    @property
+    def vwap(self):
+        return self.volume / self.base_volume if self.base_volume else None
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "volume": self.volume,
+            "base_volume": self.base_volume,
+            "vwap": self.vwap,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+            "last_price": self.last_price,
+            "last_ts": self.last_ts
+        }
+
+
+# Snapshot file: magic, generation, meta length; meta JSON; 8-byte aligned int64 arrays
+SNAPSHOT_MAGIC = b"TRSNAP02"
+LARGE_PREFIX = "large:"   # snapshot keys of the large-trade indexes
+SNAPSHOT_HEADER_FORMAT = "<8sQI"
+SNAPSHOT_HEADER_SIZE = struct.calcsize(SNAPSHOT_HEADER_FORMAT)
+
+
+class MappedIndex:
+    """Read-only SymbolIndex over int64 arrays of a mapped snapshot"""
+
+    __slots__ = ("state",)
+
+    def __init__(self, rows, stamps):
+        self.state = (rows, stamps, len(rows))
+
+    def __len__(self):
+        return self.state[2]
+
+
+def write_snapshot(path, generation, cache):
+    """Serialize a TradeCache's indexes and aggregates into one immutable file"""
+    indexes = {"all": cache.all_index, LARGE_PREFIX + "all": cache.all_large_index}
+    indexes.update((str(symbol_id), index) for symbol_id, index in cache.symbol_index.items())
+    indexes.update((LARGE_PREFIX + str(symbol_id), index) for symbol_id, index in cache.large_index.items())
+    arrays = []
+    layout = {}
+    offset = 0
+    for key, index in indexes.items():
+        rows, stamps, size = index.state
+        layout[key] = [offset, size]
+        arrays.append(memoryview(rows)[:size])
+        arrays.append(memoryview(stamps)[:size])
+        offset += size * 16
+
+    meta = codec.dumps({
+        "version": cache.version,
+        "first_row": cache.first_row,
+        "window_row": cache.window_row,
+        "max_records": cache.max_records,
+        "large_trade_usd": cache.large_trade_usd,
+        # ts của row cuối: phát hiện column store đã bị thay (không khớp snapshot)
+        "last_row_ts": cache.store.column("ts")[cache.version - 1] if cache.version else None,
+        "last_ts": cache.last_ts,
+        "last_update": cache.last_update,
+        "total_trades": cache.total_trades,
+        "total_volume": cache.total_volume,
+        "symbol_lookup": cache.symbol_lookup,
+        "symbol_stats": {str(symbol_id): [getattr(stats, name) for name in SymbolStats.__slots__]
+                         for symbol_id, stats in cache.symbol_stats.items()},
+        "stat_blocks": {str(block): {str(symbol_id): [getattr(stats, name) for name in SymbolStats.__slots__]
+                                     for symbol_id, stats in block_stats.items()}
+                        for block, block_stats in cache.stat_blocks.items()},
+        "indexes": layout
+    })
+    data_start = SNAPSHOT_HEADER_SIZE + len(meta)
+    padding = b"\0" * (-data_start % 8)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(SNAPSHOT_HEADER_FORMAT, SNAPSHOT_MAGIC, generation, len(meta)))
+        f.write(meta)
+        f.write(padding)
+        for data in arrays:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_stats(values_by_symbol):
+    """{symbol id: SymbolStats} from a snapshot's ``{"id": [slot values]}``"""
+    symbol_stats = {}
+    for symbol_id, values in values_by_symbol.items():
+        stats = SymbolStats()
+        for name, value in zip(SymbolStats.__slots__, values):
+            setattr(stats, name, value)
+        symbol_stats[int(symbol_id)] = stats
+    return symbol_stats
+
+
+def split_indexes(indexes, convert=lambda index: index):
+    """(symbol_index, all_index, large_index, all_large_index) from snapshot keys"""
+    symbol_index, large_index = {}, {}
+    for key, index in indexes.items():
+        if key.startswith(LARGE_PREFIX):
+            if key != LARGE_PREFIX + "all":
+                large_index[int(key[len(LARGE_PREFIX):])] = convert(index)
+        elif key != "all":
+            symbol_index[int(key)] = convert(index)
+    return symbol_index, convert(indexes["all"]), large_index, convert(indexes[LARGE_PREFIX + "all"])
+
+
+class Snapshot:
+    """A mapped, immutable snapshot generation"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < SNAPSHOT_HEADER_SIZE:
+            raise ValueError(f"Truncated cache snapshot {path}")
+        magic, self.generation, meta_len = struct.unpack_from(SNAPSHOT_HEADER_FORMAT, self.mm)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Invalid cache snapshot {path}")
+        self.meta = codec.loads(self.mm[SNAPSHOT_HEADER_SIZE:SNAPSHOT_HEADER_SIZE + meta_len])
+        data_start = SNAPSHOT_HEADER_SIZE + meta_len
+        data_start += -data_start % 8
+        # File bị cắt ngắn (crash giữa lúc copy): arrays thiếu thì không dùng snapshot
+        data_end = data_start + max((offset + size * 16 for offset, size in self.meta["indexes"].values()), default=0)
+        if data_end > len(self.mm):
+            raise ValueError(f"Truncated cache snapshot {path}")
+        buffer = memoryview(self.mm)
+        self.indexes = {}
+        for key, (offset, size) in self.meta["indexes"].items():
+            start = data_start + offset
+            rows = buffer[start:start + size * 8].cast('q')
+            stamps = buffer[start + size * 8:start + size * 16].cast('q')
+            self.indexes[key] = MappedIndex(rows, stamps)
+
+
+class TradeCache:
+    """Incrementally refreshed view over the column store.
+
+    Each refresh only looks at rows committed since the previous one
+    (tracked by the store's row count), and refreshes run on a background
+    thread so requests never wait for them. A cold load only indexes the
+    newest ``max_records`` rows, and every refresh trims the indexes back
+    to that window. The running aggregates (``total_trades``,
+    ``total_volume``, ``symbol_stats``) cover every row still in the column
+    store: a cold load scans the older rows once for them, and they are
+    summed from per-block partials (``STATS_BLOCK_ROWS`` rows each), so a
+    retention drop only forgets whole blocks and rescans the one it cuts
+    through; they never depend on restart history. With ``checkpoint_path`` the indexes and aggregates are saved
+    periodically, and a restart loads that snapshot and only ingests the
+    rows appended after it.
+
+    Trades worth at least ``large_trade_usd`` are also kept in secondary
+    per-symbol indexes (the newest ``large_trade_max`` each, beyond the
+    cache window), so large-trade queries only look at those.
+    """
+
+    def __init__(self, columns_dir, max_records, refresh_interval=1.0,
+                 checkpoint_path=None, checkpoint_interval=60.0, large_trade_usd=1000.0, large_trade_max=100000):
+        self.store = ColumnStoreReader(columns_dir)
+        self.max_records = max_records
+        self.large_trade_usd = large_trade_usd
+        self.large_trade_max = large_trade_max
+        self.refresh_interval = refresh_interval
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_version = 0
+        self.last_checkpoint = time.time()
+
+        self.version = 0          # row count covered by the cache
+        self.first_row = 0        # rows trước đó đã bị drop khỏi column store (retention)
+        self.window_row = 0       # symbol/all indexes chỉ còn rows >= window_row
+        self.last_refresh = 0.0
+        self.last_update = 0.0    # time the version last changed
+        self.refresh_duration = 0.0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.is_running = False
+        self.loaded = threading.Event()
+
+        # symbol id -> SymbolIndex; all_index covers every symbol
+        self.symbol_index = {}
+        self.all_index = SymbolIndex()
+        self.large_index = {}     # symbol id -> SymbolIndex của trades >= large_trade_usd
+        self.all_large_index = SymbolIndex()
+        self.symbol_lookup = {}   # upper-case symbol -> symbol id
+        self.symbol_stats = {}    # symbol id -> SymbolStats (mọi rows còn trong column store)
+        self.stat_blocks = {}     # block -> {symbol id -> SymbolStats} của rows trong block đó
+        self.closed_stats = {}    # gộp các blocks < closed_block (đã đầy)
+        self.closed_block = 0
+        self.total_trades = 0
+        self.total_volume = 0.0
+        self.last_ts = 0
+
+    def refresh(self):
+        """Ingest rows appended since the last refresh"""
+        started = time.time()
+        with self.lock:
+            first_row = read_extent(self.store.store_dir)[2]
+            dropped = first_row > self.first_row
+            if dropped:
+                # Bỏ rows đã drop khỏi indexes trước khi store map sang files mới
+                self.drop_rows(first_row)
+            self.store.refresh()
+            count = self.store.count
+            previous = self.version
+            if count > previous:
+                # Cold load (hoặc tụt lại quá xa): chỉ index cửa sổ max_records rows mới nhất,
+                # rows cũ hơn chỉ được cộng vào aggregates
+                start = max(previous, self.store.first_row)
+                window_start = max(start, count - self.max_records)
+                self.accumulate(start, window_start)
+                self.ingest(window_start, count)
+            if dropped or count > previous:
+                self.sum_blocks(count)
+            self.version = count
+            self.last_refresh = time.time()
+            if count > previous:
+                self.last_update = self.last_refresh
+            self.refresh_duration = self.last_refresh - started
+        REFRESH_SECONDS.observe(self.refresh_duration)
+        REFRESH_ROWS.observe(count - previous)
+
+        if count > previous:
+            logger.debug(f"Cache refresh: {count - previous} new records in {self.refresh_duration * 1000:.1f}ms")
+        return count - previous
+
+    def ingest(self, start, stop):
+        """Update per-symbol indexes with newly committed rows, then trim them to the window"""
+        stamps = self.store.column("ts")
+        symbols = self.store.column("symbol")
+        prices = self.store.column("price")
+        sizes = self.store.column("size")
+        symbol_index = self.symbol_index
+        all_index = self.all_index
+        large_index = self.large_index
+        all_large_index = self.all_large_index
+        large_trade_usd = self.large_trade_usd
+        last_ts = self.last_ts
+        for block_start, block_stop, block_stats in self.blocks(start, stop):
+            for row in range(block_start, block_stop):
+                ts = stamps[row]
+                symbol_id = symbols[row]
+                index = symbol_index.get(symbol_id)
+                if index is None:
+                    index = symbol_index[symbol_id] = SymbolIndex()
+                index.add(row, ts)
+                all_index.add(row, ts)
+
+                price = prices[row]
+                size = sizes[row]
+                stats = block_stats.get(symbol_id)
+                if stats is None:
+                    stats = block_stats[symbol_id] = SymbolStats()
+                stats.update(price, size, ts)
+                notional = price * size
+                if notional >= large_trade_usd:
+                    large = large_index.get(symbol_id)
+                    if large is None:
+                        large = large_index[symbol_id] = SymbolIndex()
+                    large.add(row, ts)
+                    all_large_index.add(row, ts)
+                if ts > last_ts:
+                    last_ts = ts
+        self.last_ts = last_ts
+
+        if len(self.symbol_lookup) != len(self.store.symbols):
+            self.symbol_lookup = {name.upper(): i for i, name in enumerate(self.store.symbols)}
+
+        # Rows rời cửa sổ đều nằm trong [window_row, first_row) và đã được index ở các lần
+        # trước (< version), nên ts lớn nhất của chúng giới hạn phần đầu arrays cần quét
+        first_row = max(stop - self.max_records, self.first_row)
+        stale_stop = min(first_row, self.version)
+        max_ts = max(stamps[self.window_row:stale_stop]) if self.window_row < stale_stop else None
+        for index in list(symbol_index.values()) + [all_index]:
+            index.commit()
+            if max_ts is not None:
+                index.trim(first_row, max_ts)
+        self.window_row = max(self.window_row, first_row)
+        for index in list(large_index.values()) + [all_large_index]:
+            index.commit()
+            index.keep_last(self.large_trade_max)
+
+    def accumulate(self, start, stop):
+        """Add rows [start, stop) to the per-block aggregates without indexing them"""
+        if start >= stop:
+            return
+        stamps = self.store.column("ts")
+        symbols = self.store.column("symbol")
+        prices = self.store.column("price")
+        sizes = self.store.column("size")
+        last_ts = self.last_ts
+        for block_start, block_stop, block_stats in self.blocks(start, stop):
+            for row in range(block_start, block_stop):
+                symbol_id = symbols[row]
+                stats = block_stats.get(symbol_id)
+                if stats is None:
+                    stats = block_stats[symbol_id] = SymbolStats()
+                ts = stamps[row]
+                stats.update(prices[row], sizes[row], ts)
+                if ts > last_ts:
+                    last_ts = ts
+        self.last_ts = last_ts
+
+    def blocks(self, start, stop):
+        """(start, stop, block stats) of each aggregate block overlapping rows [start, stop)"""
+        while start < stop:
+            block = start // STATS_BLOCK_ROWS
+            block_stop = min(stop, (block + 1) * STATS_BLOCK_ROWS)
+            yield start, block_stop, self.stat_blocks.setdefault(block, {})
+            start = block_stop
+
+    def sum_blocks(self, stop):
+        """Rebuild the running aggregates from the block partials of rows below ``stop``.
+
+        Full blocks are merged once into ``closed_stats``; each call only
+        adds the open block to a copy of it, and swaps the result in at once
+        so readers never see a half-built breakdown.
+        """
+        open_block = max(stop - 1, 0) // STATS_BLOCK_ROWS
+        closed_stats = self.closed_stats
+        while self.closed_block < open_block:
+            for symbol_id, stats in self.stat_blocks.get(self.closed_block, {}).items():
+                closed = closed_stats.get(symbol_id)
+                if closed is None:
+                    closed = closed_stats[symbol_id] = SymbolStats()
+                closed.merge(stats)
+            self.closed_block += 1
+
+        symbol_stats = {}
+        for symbol_id, stats in closed_stats.items():
+            symbol_stats[symbol_id] = merged = SymbolStats()
+            merged.merge(stats)
+        for symbol_id, stats in self.stat_blocks.get(open_block, {}).items():
+            merged = symbol_stats.get(symbol_id)
+            if merged is None:
+                merged = symbol_stats[symbol_id] = SymbolStats()
+            merged.merge(stats)
+        self.symbol_stats = symbol_stats
+        self.total_trades = sum(stats.count for stats in symbol_stats.values())
+        self.total_volume = sum(stats.volume for stats in symbol_stats.values())
+
+    def drop_rows(self, first_row):
+        """Forget index entries and aggregate blocks of rows compacted out of the column store"""
+        for index in (list(self.symbol_index.values()) + [self.all_index] +
+                      list(self.large_index.values()) + [self.all_large_index]):
+            index.trim(first_row)
+        # Blocks nằm hẳn trước first_row bị bỏ; block bị cắt ngang được tính lại từ rows còn lại
+        # (store vẫn map files cũ nên các rows đó đọc được), các blocks sau giữ nguyên
+        boundary = first_row // STATS_BLOCK_ROWS
+        for block in [block for block in self.stat_blocks if block <= boundary]:
+            del self.stat_blocks[block]
+        self.accumulate(first_row, min((boundary + 1) * STATS_BLOCK_ROWS, self.version))
+        self.closed_stats = {}
+        self.closed_block = boundary
+        self.first_row = first_row
+        self.window_row = max(self.window_row, first_row)
+        logger.info(f"Cache: dropped index entries before row {first_row}")
+
+    def view(self):
+        """Window over the newest ``max_records`` rows"""
+        stop = self.version
+        return self.store.view(max(stop - self.max_records, self.first_row), stop)
+
+    def stats_breakdown(self):
+        """Per-symbol aggregates keyed by symbol name, O(symbols)"""
+        return {
+            self.store.symbol_name(symbol_id): stats.to_dict()
+            for symbol_id, stats in list(self.symbol_stats.items())
+        }
+
+    def get_index(self, symbol=None):
+        """SymbolIndex for a symbol (or every symbol); None if unknown"""
+        if symbol is None:
+            return self.all_index
+        symbol_id = self.symbol_lookup.get(symbol.upper())
+        if symbol_id is None:
+            return None
+        return self.symbol_index.get(symbol_id)
+
+    def get_large_index(self, symbol=None):
+        """Large-trade index of a symbol (or every symbol); None if the symbol has none"""
+        if symbol is None:
+            return self.all_large_index
+        return self.large_index.get(self.symbol_lookup.get(symbol.upper()))
+
+    def large_trades(self, symbol=None, from_ts=None, min_usd=None, limit=50, by_notional=True):
+        """Trades worth >= ``min_usd`` with ts >= ``from_ts`` from the large-trade index.
+
+        Returns ([(notional, row)], matches): the ``limit`` largest through a
+        bounded min-heap, or the newest first when ``by_notional`` is False.
+        """
+        index = self.get_large_index(symbol)
+        if index is None:
+            return [], 0
+        rows, stamps, size = index.state
+        start = bisect_left(stamps, from_ts, 0, size) if from_ts is not None else 0
+        if start >= size:
+            return [], 0  # column store có thể chưa được map (chưa có trades)
+        min_usd = self.large_trade_usd if min_usd is None else min_usd
+        prices = self.store.column("price")
+        sizes = self.store.column("size")
+
+        if not by_notional:
+            newest = []
+            matches = 0
+            for i in range(size - 1, start - 1, -1):
+                row = rows[i]
+                notional = prices[row] * sizes[row]
+                if notional >= min_usd:
+                    matches += 1
+                    if len(newest) < limit:
+                        newest.append((notional, row))
+            return newest, matches
+
+        heap = []
+        matches = 0
+        for i in range(start, size):
+            row = rows[i]
+            notional = prices[row] * sizes[row]
+            if notional < min_usd:
+                continue
+            matches += 1
+            if len(heap) < limit:
+                heapq.heappush(heap, (notional, row))
+            elif notional > heap[0][0]:
+                heapq.heapreplace(heap, (notional, row))
+        return sorted(heap, reverse=True), matches
+
+    def symbol_view(self, symbol):
+        """Rows of one symbol in ts order; None if the symbol is unknown"""
+        index = self.get_index(symbol)
+        if index is None:
+            return None
+        rows, _, size = index.state
+        return RowsView(self.store, rows, 0, size)
+
+    def range_query(self, symbol=None, from_ts=None, to_ts=None, cursor=None, limit=100):
+        """Trades with from_ts <= ts <= to_ts, oldest first, after ``cursor``.
+
+        Bounds are found by bisecting the sorted ts array, so any page costs
+        O(log n + limit). Returns (records view, total in range, next cursor).
+        """
+        index = self.get_index(symbol)
+        if index is None:
+            return [], 0, None
+        rows, stamps, size = index.state
+
+        start = bisect_left(stamps, from_ts, 0, size) if from_ts is not None else 0
+        stop = bisect_right(stamps, to_ts, 0, size) if to_ts is not None else size
+        total = max(stop - start, 0)
+
+        if cursor is not None:
+            # Index order is (ts, store row): row của trade cuối trang trước
+            # phân định các trades cùng ts, kể cả khi xen kẽ nhiều symbols
+            cursor_ts, cursor_row = cursor
+            position = max(bisect_left(stamps, cursor_ts, 0, size), start)
+            while position < stop and stamps[position] == cursor_ts and rows[position] <= cursor_row:
+                position += 1
+            start = position
+
+        end = min(start + limit, stop) if limit > 0 else start
+        next_cursor = None
+        if end < stop and end > start:
+            next_cursor = encode_cursor(stamps[end - 1], rows[end - 1])
+        return RowsView(self.store, rows, start, end), total, next_cursor
+
+    def restore(self, snapshot):
+        """Adopt a snapshot's indexes and aggregates; False if it does not match the store"""
+        meta = snapshot.meta
+        version = meta["version"]
+        self.store.refresh()
+        if (meta.get("max_records") != self.max_records or "stat_blocks" not in meta or
+                meta.get("large_trade_usd") != self.large_trade_usd or version > self.store.count or
+                (version and self.store.column("ts")[version - 1] != meta.get("last_row_ts"))):
+            return False
+
+        def mutable(index):
+            rows, stamps, size = index.state
+            restored = SymbolIndex()
+            restored_rows, restored_stamps = array('q'), array('q')
+            restored_rows.frombytes(rows.cast('B'))   # memcpy từ mmap
+            restored_stamps.frombytes(stamps.cast('B'))
+            restored.state = (restored_rows, restored_stamps, size)
+            return restored
+
+        stat_blocks = {int(block): load_stats(block_stats) for block, block_stats in meta["stat_blocks"].items()}
+
+        with self.lock:
+            (self.symbol_index, self.all_index,
+             self.large_index, self.all_large_index) = split_indexes(snapshot.indexes, mutable)
+            self.symbol_lookup = meta["symbol_lookup"]
+            self.stat_blocks = stat_blocks
+            self.closed_stats = {}
+            self.closed_block = min(stat_blocks, default=0)
+            self.sum_blocks(version)
+            self.last_ts = meta["last_ts"]
+            self.last_update = meta["last_update"]
+            self.first_row = meta.get("first_row", 0)
+            self.window_row = meta.get("window_row", self.first_row)
+            self.version = version
+        return True
+
+    def warm_start(self, paths=()):
+        """Restore the newest usable snapshot among ``paths`` and the checkpoint"""
+        candidates = []
+        for path in list(paths) + [self.checkpoint_path]:
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                candidates.append(Snapshot(path))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring cache snapshot {path}: {e}")
+        for snapshot in sorted(candidates, key=lambda snapshot: snapshot.meta["version"], reverse=True):
+            if self.restore(snapshot):
+                self.checkpoint_version = self.version
+                logger.info(f"Warm start: {self.version} rows from snapshot, "
+                            f"{self.store.count - self.version} rows to ingest")
+                return True
+        return False
+
+    def save_checkpoint(self):
+        """Write indexes and aggregates to ``checkpoint_path`` (same thread as refresh)"""
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_snapshot(self.checkpoint_path, self.version, self)
+        self.checkpoint_version = self.version
+        self.last_checkpoint = time.time()
+
+    def maybe_checkpoint(self):
+        # Sau cold load thì checkpoint ngay, để restart kế tiếp không phải ingest lại từ đầu
+        if (self.checkpoint_path and self.version != self.checkpoint_version and
+                (self.checkpoint_version == 0 or time.time() - self.last_checkpoint >= self.checkpoint_interval)):
+            try:
+                self.save_checkpoint()
+            except OSError as e:
+                logger.error(f"Error saving cache checkpoint: {e}")
+
+    def load(self):
+        """Initial load: checkpoint (if any) plus the rows appended after it"""
+        if self.checkpoint_path:
+            self.warm_start()
+        self.refresh()
+        logger.info(f"Loaded cache with {self.version} records")
+
+    def ensure_started(self, wait=True):
+        """Load in the background thread, then keep refreshing there.
+
+        Started lazily so every gunicorn worker gets its own thread after fork.
+        ``wait=False`` returns immediately (health checks during startup).
+        """
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.is_running = True
+                    self.thread = threading.Thread(target=self._run, name="trade-cache-refresh", daemon=True)
+                    self.thread.start()
+        if wait:
+            self.loaded.wait()
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"Error loading cache: {e}")
+        self.loaded.set()
+        while self.is_running:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+                self.maybe_checkpoint()
+            except Exception as e:
+                logger.error(f"Error refreshing cache: {e}")
+
+    def stop(self):
+        self.is_running = False
+
+
+def encode_cursor(ts, row):
+    """Opaque pagination cursor built from the last returned ts and store row"""
+    return f"{ts}_{row}"
+
+
+def decode_cursor(cursor):
+    """Parse a cursor; raises ValueError when malformed"""
+    ts, row = cursor.split("_", 1)
+    return int(ts), int(row)
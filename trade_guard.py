@@ -0,0 +1,133 @@
+import os
+import threading
+import logging
+from collections import deque
+from datetime import datetime
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolGuard:
+    """Recent trade ids of one symbol (bounded set + eviction order)"""
+
+    __slots__ = ("seen", "order", "last_ts", "resync", "duplicates")
+
+    def __init__(self, window):
+        self.seen = set()
+        self.order = deque(maxlen=window)
+        self.last_ts = 0
+        self.resync = True
+        self.duplicates = 0
+
+
+class TradeGuard:
+    """De-duplicates trades by tradeId and detects gaps after reconnects.
+
+    Each symbol keeps its last ``window`` trade ids in a set, so a check
+    is one hash lookup per trade. After a (re)connect the first batch of
+    a symbol must overlap what was already seen; if it does not, the
+    interval between the last known trade and that batch is recorded as
+    a gap and persisted to ``gaps_file``.
+    """
+
+    def __init__(self, window=4096, gaps_file="gaps.json", max_gaps=1000):
+        self.window = window
+        self.gaps_file = gaps_file
+        self.max_gaps = max_gaps
+        self.symbols = {}
+        self.gaps = load_gaps(gaps_file)
+        self.lock = threading.Lock()
+
+    def _guard(self, symbol):
+        guard = self.symbols.get(symbol)
+        if guard is None:
+            guard = self.symbols[symbol] = SymbolGuard(self.window)
+        return guard
+
+    def seed(self, symbol, trade_id, ts):
+        """Register an already persisted trade (startup)"""
+        guard = self._guard(symbol)
+        if trade_id and trade_id not in guard.seen:
+            if len(guard.order) == guard.order.maxlen:
+                guard.seen.discard(guard.order[0])
+            guard.order.append(trade_id)
+            guard.seen.add(trade_id)
+        if ts > guard.last_ts:
+            guard.last_ts = ts
+
+    def expect_resync(self, symbols=None):
+        """Mark symbols whose next batch follows a (re)connect"""
+        for symbol in (symbols if symbols is not None else list(self.symbols)):
+            self._guard(symbol).resync = True
+
+    def filter(self, symbol, trades):
+        """Return only trades not seen before, checking for a gap after resync"""
+        guard = self._guard(symbol)
+        seen = guard.seen
+        order = guard.order
+
+        if guard.resync and trades:
+            guard.resync = False
+            if guard.last_ts and not any(trade.trade_id in seen for trade in trades):
+                first_ts = min(trade.ts for trade in trades)
+                if first_ts > guard.last_ts:
+                    self.record_gap(symbol, guard.last_ts, first_ts)
+
+        fresh = []
+        last_ts = guard.last_ts
+        for trade in trades:
+            trade_id = trade.trade_id
+            if trade_id:
+                if trade_id in seen:
+                    guard.duplicates += 1
+                    continue
+                if len(order) == order.maxlen:
+                    seen.discard(order[0])
+                order.append(trade_id)
+                seen.add(trade_id)
+            if trade.ts > last_ts:
+                last_ts = trade.ts
+            fresh.append(trade)
+        guard.last_ts = last_ts
+        return fresh
+
+    def duplicates(self):
+        return sum(guard.duplicates for guard in self.symbols.values())
+
+    def record_gap(self, symbol, from_ts, to_ts):
+        gap = {
+            "symbol": symbol,
+            "from_ts": from_ts,
+            "to_ts": to_ts,
+            "duration_ms": to_ts - from_ts,
+            "detected_at": datetime.now().isoformat()
+        }
+        with self.lock:
+            self.gaps.append(gap)
+            del self.gaps[:-self.max_gaps]
+            try:
+                save_gaps(self.gaps_file, self.gaps)
+            except OSError as e:
+                logger.error(f"Error saving gaps: {e}")
+        logger.warning(f"[PRODUCTION] Gap detected for {symbol}: {gap['duration_ms'] / 1000:.1f}s of trades missing")
+
+
+def load_gaps(path):
+    """Recorded gaps, oldest first (empty if the file does not exist)"""
+    try:
+        with open(path, 'rb') as f:
+            return codec.loads(f.read())
+    except FileNotFoundError:
+        return []
+    except ValueError as e:
+        logger.error(f"Invalid gaps file {path}: {e}")
+        return []
+
+
+def save_gaps(path, gaps):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(codec.dumps(gaps))
+    os.replace(tmp_path, path)
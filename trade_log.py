@@ -0,0 +1,288 @@
+import os
+import time
+import threading
+import logging
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".ndjson"
+CLEAN_MARKER = "CLEAN"     # "<active index> <size>", written by close(), removed by open()
+
+
+def segment_name(index):
+    """Build segment file name from its index"""
+    return f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}"
+
+
+def parse_segment_index(name):
+    """Return segment index for a file name, or None if it is not a segment"""
+    if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+        return None
+    try:
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+    except ValueError:
+        return None
+
+
+class TradeLog:
+    """Append-only, newline-delimited segment store for trade records.
+
+    Records are appended to the active segment and fsync'd in batches.
+    When the active segment grows past ``segment_max_bytes`` it is sealed
+    and a new segment is created, so a save never rewrites old history.
+    """
+
+    def __init__(self, log_dir, segment_max_bytes=16 * 1024 * 1024,
+                 fsync_batch=50, fsync_interval=1.0, max_segments=64):
+        self.log_dir = log_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.max_segments = max_segments
+
+        self.active_index = None
+        self.active_file = None
+        self.active_size = 0
+        self.pending = 0
+        self.last_fsync = time.time()
+        self.clean_start = False   # open() found the log cleanly closed
+        self.lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Segment helpers (safe for read-only users such as the API server)
+    # ------------------------------------------------------------------
+    def list_segments(self):
+        """Return sorted segment indexes present on disk"""
+        if not os.path.isdir(self.log_dir):
+            return []
+        indexes = []
+        for name in os.listdir(self.log_dir):
+            index = parse_segment_index(name)
+            if index is not None:
+                indexes.append(index)
+        return sorted(indexes)
+
+    def segment_path(self, index):
+        return os.path.join(self.log_dir, segment_name(index))
+
+    def total_size(self):
+        """Total bytes used by all segments"""
+        total = 0
+        for index in self.list_segments():
+            try:
+                total += os.path.getsize(self.segment_path(index))
+            except OSError:
+                pass
+        return total
+
+    def iter_segment(self, index):
+        """Lazily yield the complete records of a segment.
+
+        A trailing line without newline belongs to a write in progress
+        (or a torn write) and is skipped.
+        """
+        try:
+            with open(self.segment_path(index), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = codec.loads(line)
+                    except ValueError:
+                        break
+                    yield record
+        except FileNotFoundError:
+            pass
+
+    def read_segment(self, index):
+        """Read all complete records of a segment"""
+        return list(self.iter_segment(index))
+
+    def first_record(self, index):
+        """First complete record of a segment, or None"""
+        for record in self.iter_segment(index):
+            return record
+        return None
+
+    def iter_records(self):
+        """Iterate over every record, oldest first"""
+        for index in self.list_segments():
+            yield from self.iter_segment(index)
+
+    def read_tail(self, count):
+        """Return the newest ``count`` records, oldest first"""
+        chunks = []
+        collected = 0
+        for index in reversed(self.list_segments()):
+            records = self.read_segment(index)
+            chunks.append(records)
+            collected += len(records)
+            if collected >= count:
+                break
+
+        result = []
+        for records in reversed(chunks):
+            result.extend(records)
+        return result[-count:] if count > 0 else []
+
+    # ------------------------------------------------------------------
+    # Writer side (data collector only)
+    # ------------------------------------------------------------------
+    def open(self):
+        """Recover the newest segment and open it for appending"""
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        segments = self.list_segments()
+        self.clean_start = False
+        if segments:
+            self.active_index = segments[-1]
+            # Đóng sạch lần trước (size khớp marker): bỏ qua bước quét toàn bộ segment
+            self.clean_start = self._read_clean_marker() == (self.active_index, os.path.getsize(self.segment_path(self.active_index)))
+            if not self.clean_start:
+                self.recover_segment(self.active_index)
+        else:
+            self.active_index = 1
+            self._create_segment(self.active_index)
+
+        path = self.segment_path(self.active_index)
+        self.active_file = open(path, 'ab')
+        self.active_size = self.active_file.tell()
+        logger.info(f"Trade log opened: {path} ({self.active_size} bytes, {len(segments)} segments"
+                    f"{', clean shutdown' if self.clean_start else ''})")
+
+    def _read_clean_marker(self):
+        """(index, size) left by the last close(); the marker is consumed"""
+        path = os.path.join(self.log_dir, CLEAN_MARKER)
+        try:
+            with open(path, 'r') as f:
+                index, size = f.read().split()
+            os.remove(path)
+            self._fsync_dir()
+            return int(index), int(size)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_clean_marker(self):
+        path = os.path.join(self.log_dir, CLEAN_MARKER)
+        with open(path + ".tmp", 'w') as f:
+            f.write(f"{self.active_index} {self.active_size}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def recover_segment(self, index):
+        """Truncate a segment after its last complete, valid record.
+
+        Called on startup so a crash during a write never leaves a torn
+        line in front of new appends.
+        """
+        path = self.segment_path(index)
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    codec.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+            f.seek(0, os.SEEK_END)
+            total = f.tell()
+
+        if valid_size < total:
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+                f.flush()
+                os.fsync(f.fileno())
+            logger.warning(f"Recovered {path}: dropped {total - valid_size} trailing bytes")
+
+    def _create_segment(self, index):
+        """Create an empty segment atomically (tmp file + rename)"""
+        path = self.segment_path(index)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.log_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def append(self, record):
+        """Append one record; fsync happens in batches"""
+        line = codec.dumps(record) + b'\n'
+        with self.lock:
+            self.active_file.write(line)
+            self.active_size += len(line)
+            self.pending += 1
+
+            if (self.pending >= self.fsync_batch or
+                    time.time() - self.last_fsync >= self.fsync_interval):
+                self._flush()
+
+            if self.active_size >= self.segment_max_bytes:
+                self._rollover()
+
+    def flush(self):
+        """Flush buffered writes and fsync the active segment"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.active_file is None or self.pending == 0:
+            return
+        self.active_file.flush()
+        os.fsync(self.active_file.fileno())
+        self.pending = 0
+        self.last_fsync = time.time()
+
+    def _rollover(self):
+        """Seal the active segment and start a new one"""
+        self._flush()
+        self.active_file.close()
+        sealed = self.active_index
+
+        self.active_index += 1
+        self._create_segment(self.active_index)
+        self.active_file = open(self.segment_path(self.active_index), 'ab')
+        self.active_size = 0
+        logger.info(f"Sealed segment {segment_name(sealed)}, rolled over to {segment_name(self.active_index)}")
+
+        self.enforce_retention()
+
+    def enforce_retention(self):
+        """Drop the oldest sealed segments beyond ``max_segments`` (None = keep all)"""
+        if self.max_segments is None:
+            return
+        segments = self.list_segments()
+        excess = len(segments) - self.max_segments
+        for index in segments[:max(excess, 0)]:
+            if index == self.active_index:
+                continue
+            try:
+                os.remove(self.segment_path(index))
+                logger.info(f"Removed old segment {segment_name(index)}")
+            except OSError as e:
+                logger.error(f"Error removing segment {segment_name(index)}: {e}")
+
+    def close(self):
+        with self.lock:
+            if self.active_file is not None:
+                self._flush()
+                self.active_file.close()
+                self.active_file = None
+                self._write_clean_marker()
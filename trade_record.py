@@ -0,0 +1,76 @@
+from column_store import SIDE_NAMES, encode_side, parse_float, parse_int
+
+
+def compact_record(record):
+    """Compact trade log record from either the compact or legacy nested format"""
+    if 'data' in record:
+        raw = record['data']
+        return {
+            "ts": parse_int(raw.get('ts')),
+            "symbol": record.get('symbol', 'Unknown'),
+            "price": parse_float(raw.get('price')),
+            "size": parse_float(raw.get('size')),
+            "side": raw.get('side'),
+            "tradeId": parse_int(raw.get('tradeId'))
+        }
+    return record
+
+
+class Trade:
+    """Compact, pre-parsed trade created once at ingest.
+
+    Price and size are floats, ts and trade_id are ints, the symbol is an
+    interned id shared with the column store and side is a small int code.
+    """
+
+    __slots__ = ("ts", "symbol_id", "price", "size", "side", "trade_id")
+
+    def __init__(self, ts, symbol_id, price, size, side, trade_id):
+        self.ts = ts
+        self.symbol_id = symbol_id
+        self.price = price
+        self.size = size
+        self.side = side
+        self.trade_id = trade_id
+
+    @classmethod
+    def from_bitget(cls, raw, symbol_id):
+        """Parse one entry of a Bitget trade push"""
+        return cls(
+            parse_int(raw.get('ts')),
+            symbol_id,
+            parse_float(raw.get('price')),
+            parse_float(raw.get('size')),
+            encode_side(raw.get('side')),
+            parse_int(raw.get('tradeId'))
+        )
+
+    @classmethod
+    def from_record(cls, record, symbol_id_for):
+        """Build from a trade log record (compact or legacy nested format)"""
+        if 'data' in record:
+            # Legacy format: {"timestamp", "symbol", "data": {...strings}}
+            return cls.from_bitget(record['data'], symbol_id_for(record.get('symbol', 'Unknown')))
+        return cls(
+            parse_int(record.get('ts')),
+            symbol_id_for(record.get('symbol', 'Unknown')),
+            parse_float(record.get('price')),
+            parse_float(record.get('size')),
+            encode_side(record.get('side')),
+            parse_int(record.get('tradeId'))
+        )
+
+    @property
+    def notional(self):
+        return self.price * self.size
+
+    def to_record(self, symbols):
+        """Compact trade log record"""
+        return {
+            "ts": self.ts,
+            "symbol": symbols[self.symbol_id],
+            "price": self.price,
+            "size": self.size,
+            "side": SIDE_NAMES.get(self.side),
+            "tradeId": self.trade_id
+        }
@@ -0,0 +1,238 @@
+import os
+import select
+import socket
+import threading
+import time
+import logging
+from collections import deque
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+
+class TradePublisher:
+    """Collector side: fan out new trades over a local Unix socket.
+
+    Every API worker connects as a client and receives NDJSON lines.
+    Sockets are non-blocking; a client whose unsent backlog exceeds
+    ``max_pending_bytes`` is disconnected instead of being buffered
+    without limit, so a slow reader never stalls ingest. A flusher thread
+    sends the rest of a backlog as soon as the socket becomes writable,
+    so the last trades of a quiet period do not wait for the next publish.
+    """
+
+    def __init__(self, socket_path, max_pending_bytes=4 * 1024 * 1024):
+        self.socket_path = socket_path
+        self.max_pending_bytes = max_pending_bytes
+        self.server = None
+        self.clients = {}   # socket -> pending bytearray
+        self.lock = threading.Lock()
+        self.backlogged = threading.Event()   # set khi có client còn pending bytes
+        self.is_running = False
+        self.published = 0
+        self.dropped_clients = 0
+
+    def start(self):
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(64)
+        self.is_running = True
+        threading.Thread(target=self._accept_loop, name="trade-stream-accept", daemon=True).start()
+        threading.Thread(target=self._flush_loop, name="trade-stream-flush", daemon=True).start()
+        logger.info(f"Trade stream publishing on {self.socket_path}")
+
+    def _accept_loop(self):
+        while self.is_running:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break
+            client.setblocking(False)
+            with self.lock:
+                self.clients[client] = bytearray()
+            logger.info(f"Trade stream client connected ({len(self.clients)} total)")
+
+    def publish(self, records):
+        """Send a batch of trade records to every connected client"""
+        if not self.clients:
+            return
+        payload = b"".join(codec.dumps(record) + b"\n" for record in records)
+        with self.lock:
+            for client, pending in list(self.clients.items()):
+                pending += payload
+                self._send(client, pending)
+        self.published += len(records)
+
+    def _send(self, client, pending):
+        """Send as much of a client's backlog as the socket takes (lock held)"""
+        try:
+            sent = client.send(pending)
+            del pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(client, "disconnected")
+            return
+        if len(pending) > self.max_pending_bytes:
+            self._drop(client, "too slow")
+        elif pending:
+            self.backlogged.set()
+
+    def _flush_loop(self):
+        """Send backlogs once their sockets become writable, without waiting for new trades"""
+        while self.is_running:
+            if not self.backlogged.wait(1.0):
+                continue
+            with self.lock:
+                waiting = [client for client, pending in self.clients.items() if pending]
+                if not waiting:
+                    self.backlogged.clear()
+                    continue
+            try:
+                _, writable, _ = select.select([], waiting, [], 0.5)
+            except (OSError, ValueError):
+                writable = waiting   # socket đã đóng: _send sẽ drop client
+            with self.lock:
+                for client in writable:
+                    pending = self.clients.get(client)
+                    if pending:
+                        self._send(client, pending)
+
+    def _drop(self, client, reason):
+        self.clients.pop(client, None)
+        self.dropped_clients += 1
+        try:
+            client.close()
+        except OSError:
+            pass
+        logger.warning(f"Dropped trade stream client ({reason})")
+
+    def stop(self):
+        self.is_running = False
+        with self.lock:
+            for client in list(self.clients):
+                client.close()
+            self.clients = {}
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class Subscription:
+    """One streaming client: bounded queue, oldest trades dropped on overflow"""
+
+    def __init__(self, symbols=None, max_queue=1000, notify=None):
+        self.symbols = symbols   # set of upper-case symbols, None = all
+        self.notify = notify     # gọi khi queue rỗng có trade mới (async clients), từ reader thread
+        self.queue = deque(maxlen=max_queue)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, record):
+        with self.cond:
+            was_empty = not self.queue
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(record)
+            self.cond.notify()
+        if was_empty and self.notify is not None:
+            self.notify()
+
+    def get_batch(self, timeout):
+        """Wait for trades; returns a (possibly empty) list"""
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            batch = list(self.queue)
+            self.queue.clear()
+        return batch
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.notify is not None:
+            self.notify()
+
+
+class TradeSubscriber:
+    """API worker side: read the collector's stream and fan out to clients"""
+
+    def __init__(self, socket_path, max_subscribers=100, reconnect_delay=2.0):
+        self.socket_path = socket_path
+        self.max_subscribers = max_subscribers
+        self.reconnect_delay = reconnect_delay
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.is_running = False
+        self.connected = False
+        self.received = 0
+
+    def ensure_started(self):
+        """Started lazily so every gunicorn worker gets its own thread after fork"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.is_running = True
+            self.thread = threading.Thread(target=self._run, name="trade-stream-reader", daemon=True)
+            self.thread.start()
+
+    def subscribe(self, symbols=None, max_queue=1000, notify=None):
+        """Register a client; returns None when the worker is at capacity"""
+        self.ensure_started()
+        with self.lock:
+            if len(self.subscriptions) >= self.max_subscribers:
+                return None
+            subscription = Subscription(symbols, max_queue, notify)
+            # Copy-on-write: reader thread duyệt list cũ mà không cần lock
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def _run(self):
+        while self.is_running:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.socket_path)
+                    self.connected = True
+                    logger.info(f"Connected to trade stream {self.socket_path}")
+                    with sock.makefile('rb') as stream:
+                        for line in stream:
+                            self._dispatch(line)
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            except Exception as e:
+                logger.warning(f"Trade stream error: {e}")
+            self.connected = False
+            time.sleep(self.reconnect_delay)
+
+    def _dispatch(self, line):
+        try:
+            record = codec.loads(line)
+        except ValueError:
+            return
+        self.received += 1
+        symbol = str(record.get('symbol', '')).upper()
+        for subscription in self.subscriptions:   # list bất biến (subscribe/unsubscribe thay list mới)
+            if subscription.symbols is None or symbol in subscription.symbols:
+                subscription.offer(record)
+
+    def stop(self):
+        self.is_running = False
@@ -0,0 +1,148 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TradeWriter:
+    """Dedicated writer stage fed by a bounded single-producer ring buffer.
+
+    The ingest thread only calls ``submit()``; the writer thread drains the
+    ring and calls ``sink(batch)`` once ``flush_records`` trades are queued
+    or ``flush_interval`` seconds have passed. When the ring is full the
+    producer waits up to ``block_timeout`` (backpressure) and then drops
+    the trade, so a stalled disk can never grow memory without bound.
+    """
+
+    def __init__(self, sink, capacity=65536, flush_records=500, flush_interval=0.5, block_timeout=1.0):
+        self.sink = sink
+        self.capacity = capacity
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+
+        self.ring = [None] * capacity
+        self.head = 0   # next slot to read (writer)
+        self.tail = 0   # next slot to write (producer)
+        self.cond = threading.Condition()
+        self.flush_requested = False
+        self.is_running = False
+        self.thread = None
+
+        # Metrics
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.errors = 0
+
+    def depth(self):
+        return self.tail - self.head
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="trade-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue one item; returns False if it had to be dropped"""
+        with self.cond:
+            if self.tail - self.head >= self.capacity:
+                self.blocked += 1
+                self.flush_requested = True
+                self.cond.notify()
+                deadline = time.monotonic() + self.block_timeout
+                while self.tail - self.head >= self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.is_running:
+                        self.dropped += 1
+                        return False
+                    self.cond.wait(remaining)
+
+            self.ring[self.tail % self.capacity] = item
+            self.tail += 1
+            self.submitted += 1
+            depth = self.tail - self.head
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth >= self.flush_records:
+                self.cond.notify()
+        return True
+
+    def flush(self):
+        """Ask the writer to flush now (non-blocking)"""
+        with self.cond:
+            self.flush_requested = True
+            self.cond.notify()
+
+    def _take_batch(self):
+        with self.cond:
+            deadline = time.monotonic() + self.flush_interval
+            while (self.is_running and not self.flush_requested and
+                   self.tail - self.head < self.flush_records):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            self.flush_requested = False
+            count = self.tail - self.head
+            batch = []
+            for i in range(self.head, self.head + count):
+                slot = i % self.capacity
+                batch.append(self.ring[slot])
+                self.ring[slot] = None
+            self.head += count
+            self.cond.notify_all()   # wake producers waiting for space
+        return batch
+
+    def _run(self):
+        while True:
+            running = self.is_running
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            if not running and self.depth() == 0:
+                break
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self.sink(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error writing batch of {len(batch)} trades: {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        if elapsed_ms > self.max_flush_ms:
+            self.max_flush_ms = elapsed_ms
+
+    def stop(self, timeout=10.0):
+        """Drain everything still queued, then stop the writer thread"""
+        with self.cond:
+            self.is_running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def metrics(self):
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "queue_depth": self.depth(),
+            "max_queue_depth": self.max_depth,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "errors": self.errors
+        }